@@ -9,6 +9,8 @@ from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from .database import get_db
 from .models import models
+from .utils.ttl_cache import TTLCache
+from .services import read_cache
 
 # Cargar variables de entorno
 load_dotenv()
@@ -24,23 +26,56 @@ if not SECRET_KEY:
 
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 1440))
+# Usuarios ya resueltos por token (sub, iat): una petición con el usuario en caché no consulta
+# la base. Editar o eliminar un usuario lo descarta aquí y publica su nuevo auth_version en el
+# backend de services/read_cache.py, que los demás workers comparan en cada petición (con Redis
+# el cambio rige al momento en todos; con la caché en memoria, como mucho tras AUTH_CACHE_TTL_SECONDS).
+AUTH_CACHE_TTL_SECONDS = int(os.getenv("AUTH_CACHE_TTL_SECONDS", 60))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", 1024))
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
+_principals = TTLCache(max_entries=AUTH_CACHE_MAX_ENTRIES, ttl_seconds=AUTH_CACHE_TTL_SECONDS)
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+_PRINCIPAL_EXCLUDED = ("data_version", "password_hash")
+
+def _principal(db_user: models.Usuario) -> models.Usuario:
+    """
+    Copia del usuario sin sesión (no caduca con el commit de otra petición). No incluye
+    data_version, que cambia con cada escritura (se lee con read_cache.data_version), ni
+    password_hash, que se lee de la base donde se verifica (current_password_hash).
+    """
+    return models.Usuario(**{
+        c.name: getattr(db_user, c.name) for c in models.Usuario.__table__.columns if c.name not in _PRINCIPAL_EXCLUDED
+    })
+
+def current_password_hash(db: Session, user_id: int) -> Optional[str]:
+    """Hash vigente de la contraseña del usuario (nunca desde la caché de usuarios)"""
+    return db.query(models.Usuario.password_hash).filter(models.Usuario.id == user_id).scalar()
+
+def invalidate_principal(usuario: str, auth_version: int = -1):
+    """
+    Descarta los usuarios en caché de ese nombre (al editarlo, desactivarlo o eliminarlo) y
+    publica su auth_version vigente para los otros procesos (-1: usuario eliminado). Tras el commit.
+    """
+    _principals.delete_where(lambda key: key[0] == usuario)
+    read_cache.publish_auth_version(usuario, auth_version)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    # iat distingue los tokens de un mismo usuario en la caché de get_current_user
+    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -75,9 +110,19 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
         
-    user = db.query(models.Usuario).filter(models.Usuario.usuario == username).first()
+    # Usuario en caché, salvo que otro proceso haya publicado un auth_version distinto
+    key = (username, payload.get("iat"))
+    user = _principals.get(key)
+    if user is not None:
+        publicada = read_cache.published_auth_version(username)
+        if publicada is not None and publicada != user.auth_version:
+            user = None
     if user is None:
-        raise credentials_exception
+        db_user = db.query(models.Usuario).filter(models.Usuario.usuario == username).first()
+        if db_user is None:
+            raise credentials_exception
+        user = _principal(db_user)
+        _principals.set(key, user)
         
     if user.is_active == 0:
         raise HTTPException(
@@ -1,15 +1,23 @@
 import os
+import hmac
+import time
 import logging
 from dotenv import load_dotenv
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Depends, HTTPException, Request
 # Force redeploy trigger: 2026-02-08-FIX-DEPLOY-LOOP-2
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from slowapi.errors import RateLimitExceeded
 from slowapi import _rate_limit_exceeded_handler
 from .utils.limiter import limiter
-from .database import engine
+from .database import engine, async_engine, pool_status
 from .models import models
 from .routes import auth, ninos, visitas, excel
+from .services.job_queue import start_job_queue, stop_job_queue
+from .services import read_cache
+from .utils import executors, request_metrics
+from .auth import get_current_user
 
 # Configuración de Logging
 logging.basicConfig(
@@ -18,17 +26,37 @@ logging.basicConfig(
     handlers=[logging.StreamHandler()]
 )
 logger = logging.getLogger("AlyAPI")
+timing_logger = logging.getLogger("AlyAPI.Timing")
+
+# Métricas SQL por petición (ver utils/request_metrics.py)
+request_metrics.install_sql_hooks(engine)
+if async_engine is not None:
+    request_metrics.install_sql_hooks(async_engine.sync_engine)
 
 # Configuración de Rate Limiting (SlowAPI)
 app = FastAPI(title="Niños Aly API", version="0.1.0")
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    # Pool de conexiones agotado durante DB_POOL_TIMEOUT: el cliente puede reintentar
+    logger.warning(f"Pool de conexiones agotado en {request.url.path}")
+    return JSONResponse(status_code=503, content={"detail": "Servidor ocupado, intente nuevamente"},
+                        headers={"Retry-After": "1"})
+
 @app.on_event("startup")
 def startup_event():
     # Crear las tablas al iniciar
     # models.Base.metadata.create_all(bind=engine)
     print("--- STARTUP SKIPPED CREATE_ALL ---")
+    # Cola de cargas de Excel: re-encola las interrumpidas y arranca los trabajadores
+    start_job_queue()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    stop_job_queue()
+    executors.shutdown()
 
 # Cargar variables de entorno
 load_dotenv()
@@ -75,6 +103,32 @@ async def add_security_headers(request: Request, call_next):
     except Exception:
         return await call_next(request)
 
+# Middleware de tiempos: duración, consultas y tiempo en la base por plantilla de ruta
+@app.middleware("http")
+async def request_timing(request: Request, call_next):
+    stats = request_metrics.start_request()
+    read_cache.start_request()
+    inicio = time.perf_counter()
+    response = await call_next(request)
+    # En respuestas en streaming (NDJSON) solo cuenta hasta el envío de las cabeceras
+    elapsed = time.perf_counter() - inicio
+
+    route = request.scope.get("route")
+    template = route.path if route is not None else "sin_ruta"
+    request_metrics.observe(request.method, template, response.status_code, elapsed, stats)
+    response.headers["Server-Timing"] = request_metrics.server_timing(elapsed, stats)
+
+    if request_metrics.REQUEST_BUDGET_MS and elapsed * 1000 > request_metrics.REQUEST_BUDGET_MS:
+        detalle = f"{stats.queries} consultas, {stats.db_time * 1000:.0f} ms en la base"
+        if stats.slowest_statement:
+            lenta = " ".join(stats.slowest_statement.split())[:300]
+            detalle += f"; más lenta {stats.slowest_time * 1000:.0f} ms: {lenta}"
+        timing_logger.warning(
+            f"{request.method} {template} {response.status_code} {elapsed * 1000:.0f} ms "
+            f"(presupuesto {request_metrics.REQUEST_BUDGET_MS:.0f} ms): {detalle}"
+        )
+    return response
+
 # Registro de rutas
 app.include_router(auth.router)
 app.include_router(ninos.router)
@@ -85,6 +139,29 @@ app.include_router(excel.router)
 async def root():
     return {"message": "Bienvenida Alicia. El backend de Niños Aly está corriendo."}
 
+@app.get("/debug/executors")
+def debug_executors(current_user: models.Usuario = Depends(get_current_user)):
+    if current_user.rol != "admin":
+        raise HTTPException(status_code=403, detail="No tiene permisos para ver estas métricas")
+    return executors.stats()
+
+@app.get("/debug/db-pool")
+def debug_db_pool(current_user: models.Usuario = Depends(get_current_user)):
+    if current_user.rol != "admin":
+        raise HTTPException(status_code=403, detail="No tiene permisos para ver estas métricas")
+    return pool_status()
+
+@app.get("/metrics", include_in_schema=False)
+def metrics(request: Request):
+    # Solo con METRICS_TOKEN definido; Prometheus envía "Authorization: Bearer <token>"
+    token = os.getenv("METRICS_TOKEN")
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        raise HTTPException(status_code=401, detail="No autorizado")
+    body, content_type = request_metrics.render_metrics()
+    return Response(content=body, media_type=content_type)
+
 @app.get("/debug-system")
 def debug_system():
     import pkg_resources
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Date, UniqueConstraint, Index
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Date, UniqueConstraint, Index, DDL, event, text
 from sqlalchemy.orm import relationship
 from ..database import Base
+from ..utils.periodo import periodo_of
 import datetime
 
 class Usuario(Base):
@@ -12,8 +13,18 @@ class Usuario(Base):
     rol = Column(String(20), default="gestor") # 'admin', 'gestor'
     is_active = Column(Integer, default=1)
     fecha_expiracion = Column(Date, nullable=True)
+    # Versión de sus datos: cada escritura la incrementa (invalida services/read_cache.py)
+    data_version = Column(Integer, nullable=False, default=0, server_default="0")
+    # Versión de la cuenta (rol, estado, expiración, contraseña): invalida la caché de auth.py en todos los procesos
+    auth_version = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime, default=datetime.datetime.now)
 
+def _pg_trgm_disponible(ddl, target, bind, **kw):
+    """El índice de trigramas de Nino.busqueda solo se crea en PostgreSQL con la extensión pg_trgm instalada"""
+    if bind is None or bind.dialect.name != "postgresql":
+        return False
+    return bind.execute(text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).first() is not None
+
 class Nino(Base):
     __tablename__ = "ninos"
     id = Column(Integer, primary_key=True, index=True)
@@ -28,16 +39,36 @@ class Nino(Base):
     rango_edad = Column(String(100))
     historia_clinica = Column(String(100))
     establecimiento_asignado = Column(String(255))
+    # Resumen de sus visitas (lo mantiene services/resumen_service.refresh_ninos)
+    primera_visita = Column(Date, nullable=True)
+    ultima_visita = Column(Date, nullable=True)
+    ultimo_estado = Column(String(20), nullable=True)
+    visitas_count = Column(Integer, default=0, server_default="0")
+    # DNI, nombres y nombre de la madre normalizados para el filtro de búsqueda (services/busqueda_service.py)
+    busqueda = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.now)
     updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
     
     __table_args__ = (
         UniqueConstraint('dni_nino', 'user_id', name='_dni_user_uc'),
         Index('idx_nino_user_est', 'user_id', 'establecimiento_asignado'),
+        Index('idx_nino_user_primera', 'user_id', 'primera_visita'),
+        Index('idx_nino_user_nombres', 'user_id', 'nombres', 'id'),
+        Index('idx_nino_busqueda_trgm', 'busqueda', postgresql_using='gin',
+              postgresql_ops={'busqueda': 'gin_trgm_ops'}).ddl_if(callable_=_pg_trgm_disponible),
     )
 
     visitas = relationship("Visita", back_populates="nino", cascade="all, delete-orphan")
 
+event.listen(
+    Nino.__table__, "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(callable_=_pg_trgm_disponible)
+)
+
+def _periodo_default(context):
+    """Periodo de la fila que se inserta, a partir de su fecha_visita"""
+    return periodo_of(context.get_current_parameters().get("fecha_visita"))
+
 class Visita(Base):
     __tablename__ = "visitas"
     id = Column(Integer, primary_key=True, index=True)
@@ -46,6 +77,8 @@ class Visita(Base):
     estado = Column(String(20), index=True) # 'encontrado', 'no encontrado', 'pendiente'
     observacion = Column(String)
     fecha_visita = Column(Date, nullable=False, index=True)
+    # Mes de la visita como entero AAAAMM, para agrupar por periodo (ver utils/periodo.py)
+    periodo = Column(Integer, default=_periodo_default)
     establecimiento_atencion = Column(String(150), index=True)
     actor_social = Column(String(150), index=True)
     created_at = Column(DateTime, default=datetime.datetime.now)
@@ -53,10 +86,16 @@ class Visita(Base):
 
     __table_args__ = (
         Index('idx_visita_user_fecha', 'user_id', 'fecha_visita'),
+        Index('idx_visita_user_periodo', 'user_id', 'periodo'),
     )
 
     nino = relationship("Nino", back_populates="visitas")
 
+# El default de periodo cubre todas las inserciones (ORM y bulk); al editar una visita se recalcula aquí
+@event.listens_for(Visita, "before_update")
+def _visita_periodo(mapper, connection, target):
+    target.periodo = periodo_of(target.fecha_visita)
+
 
 
 class CargaExcel(Base):
@@ -68,11 +107,43 @@ class CargaExcel(Base):
     user_id = Column(Integer, ForeignKey("usuario_config.id", ondelete="CASCADE"), nullable=True, index=True)
     total_registros = Column(Integer)
     total_repetidos = Column(Integer, default=0)
-    estado = Column(String(50), default="completado") # 'procesando', 'completado', 'error'
+    total_nuevos = Column(Integer, default=0)
+    estado = Column(String(50), default="completado") # 'pendiente', 'procesando', 'completado', 'error'
+    # Clase de trabajo en la cola: 'excel' (carga de un archivo) o 'purga' (niños sin visitas)
+    tipo = Column(String(20), nullable=False, default="excel", server_default="excel")
     mensaje_error = Column(String, nullable=True)
+    # Datos de la cola de procesamiento (ver services/job_queue.py)
+    eess_filter = Column(String(255), nullable=True)
+    ruta_archivo = Column(String(500), nullable=True)
+    intentos = Column(Integer, default=0)
+    iniciado_en = Column(DateTime, nullable=True)
+    finalizado_en = Column(DateTime, nullable=True)
+    # Avance de la carga (etapa actual, porcentaje y filas de esa etapa)
+    etapa = Column(String(30), nullable=True)
+    progreso = Column(Integer, default=0)
+    filas_procesadas = Column(Integer, default=0)
+    progreso_en = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.now)
     updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
 
     __table_args__ = (
         Index('idx_carga_user_periodo', 'user_id', 'anio', 'mes'),
+        Index('idx_carga_estado_creado', 'estado', 'created_at'),
     )
+
+class ResumenMensual(Base):
+    """Totales de visitas por usuario y mes, mantenidos por services/resumen_service.py"""
+    __tablename__ = "resumen_mensual"
+    user_id = Column(Integer, ForeignKey("usuario_config.id", ondelete="CASCADE"), primary_key=True)
+    anio = Column(Integer, primary_key=True)
+    mes = Column(Integer, primary_key=True)
+    total_visitas = Column(Integer, nullable=False, default=0)
+    # Niños únicos del mes (en total y por estado de visita)
+    total_ninos = Column(Integer, nullable=False, default=0)
+    encontrados = Column(Integer, nullable=False, default=0)
+    no_encontrados = Column(Integer, nullable=False, default=0)
+    pendientes = Column(Integer, nullable=False, default=0)
+    # Visitas por estado (totales globales de /ninos/stats)
+    visitas_encontrado = Column(Integer, nullable=False, default=0)
+    visitas_no_encontrado = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
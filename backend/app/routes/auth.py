@@ -3,13 +3,15 @@ from dotenv import load_dotenv
 from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, Cookie
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from datetime import timedelta, date
 from ..database import get_db
 from ..models import models
-from ..auth import verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, get_password_hash, get_current_user
+from ..auth import verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, get_password_hash, get_current_user, invalidate_principal, current_password_hash
 from ..schemas import schemas
 from typing import List
 from ..utils.limiter import limiter
+from ..utils import executors
 
 # Cargar variables de entorno
 load_dotenv()
@@ -25,7 +27,7 @@ def login(
     db: Session = Depends(get_db)
 ):
     user = db.query(models.Usuario).filter(models.Usuario.usuario == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.password_hash):
+    if not user or not executors.bcrypt_pool.call(verify_password, form_data.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Usuario o contraseña incorrectos",
@@ -97,7 +99,7 @@ def setup_initial_user(db: Session = Depends(get_db)):
     new_user = models.Usuario(
         usuario="admin",
         nombre_completo="Administrador Aly",
-        password_hash=get_password_hash("admin123"),
+        password_hash=executors.bcrypt_pool.call(get_password_hash, "admin123"),
         rol="admin"
     )
     db.add(new_user)
@@ -127,7 +129,7 @@ def create_user(user: schemas.UsuarioCreate, db: Session = Depends(get_db), curr
     db_user = models.Usuario(
         usuario=user.usuario,
         nombre_completo=user.nombre_completo,
-        password_hash=get_password_hash(user.password),
+        password_hash=executors.bcrypt_pool.call(get_password_hash, user.password),
         rol=user.rol,
         is_active=user.is_active,
         fecha_expiracion=user.fecha_expiracion
@@ -157,10 +159,14 @@ def update_user(user_id: int, user_data: schemas.UsuarioUpdate, db: Session = De
     if user_data.password is not None and user_data.password.strip() != "":
         if len(user_data.password) < 8:
             raise HTTPException(status_code=400, detail="La nueva contraseña debe tener al menos 8 caracteres")
-        db_user.password_hash = get_password_hash(user_data.password)
-        
+        db_user.password_hash = executors.bcrypt_pool.call(get_password_hash, user_data.password)
+
+    # Rol, estado, expiración o contraseña nuevos: se descarta el usuario de la caché de
+    # get_current_user en este proceso y se publica el nuevo auth_version para los demás
+    db_user.auth_version = models.Usuario.auth_version + 1
     db.commit()
     db.refresh(db_user)
+    invalidate_principal(db_user.usuario, db_user.auth_version)
     return db_user
 
 @router.delete("/users/{user_id}")
@@ -175,13 +181,16 @@ def delete_user(user_id: int, db: Session = Depends(get_db), current_user: model
     if not db_user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
         
+    usuario = db_user.usuario
     db.delete(db_user)
     db.commit()
+    invalidate_principal(usuario)
     return {"message": "Usuario eliminado correctamente"}
 
 @router.post("/verify-password")
 @limiter.limit("5/minute")
-async def verify_admin_password(request: Request, data: schemas.VerifyPasswordRequest, current_user: models.Usuario = Depends(get_current_user)):
-    if not verify_password(data.password, current_user.password_hash):
+async def verify_admin_password(request: Request, data: schemas.VerifyPasswordRequest, db: Session = Depends(get_db), current_user: models.Usuario = Depends(get_current_user)):
+    password_hash = await run_in_threadpool(current_password_hash, db, current_user.id)
+    if not await executors.bcrypt_pool.run(verify_password, data.password, password_hash):
         raise HTTPException(status_code=401, detail="Contraseña incorrecta")
     return {"message": "Contraseña verificada"}
@@ -1,14 +1,35 @@
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, BackgroundTasks
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, BackgroundTasks, Path, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from ..database import get_db
-from ..services.excel_service import process_minsa_excel, get_excel_preview, process_excel_async
+from ..services.excel_service import InvalidExcelError, parse_excel_preview, preview_rows
+from ..services.parse_cache import parse_cache
+from ..services import job_queue, export_service, read_cache
 from ..models import models
 from ..auth import get_current_user
-import pandas as pd
-import io
+from ..utils.uploads import spool_upload
+from ..utils.etag import user_data_etag
+from ..utils import executors
+import asyncio
+import json
+import logging
+import time
+import os
 
 router = APIRouter(prefix="/excel", tags=["Excel"])
+logger = logging.getLogger("AlyAPI.Excel")
+
+# Streams de avance (Server-Sent Events)
+SSE_POLL_SECONDS = float(os.getenv("EXCEL_SSE_POLL_SECONDS", 1.0))
+SSE_KEEPALIVE_SECONDS = 15
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# Límites de tamaño de los archivos (configurables desde .env)
+MAX_PREVIEW_SIZE = int(os.getenv("EXCEL_MAX_PREVIEW_MB", 5)) * 1024 * 1024
+MAX_UPLOAD_SIZE = int(os.getenv("EXCEL_MAX_UPLOAD_MB", 10)) * 1024 * 1024
 
 @router.post("/preview")
 async def preview_excel(
@@ -18,38 +39,72 @@ async def preview_excel(
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="El archivo debe ser un Excel (.xlsx o .xls)")
     
+    ruta = job_queue.new_spool_path(file.filename)
     try:
-        # Límite para preview: 5MB
-        MAX_PREVIEW_SIZE = 5 * 1024 * 1024
-        file_size = 0
-        content = b""
-        while chunk := await file.read(1024 * 100):
-            file_size += len(chunk)
-            if file_size > MAX_PREVIEW_SIZE:
-                raise HTTPException(status_code=413, detail="El archivo es demasiado grande para vista previa. Máximo 5MB.")
-            content += chunk
-        
-        preview_data = get_excel_preview(content)
+        # El archivo se copia a disco por bloques (sin concatenar en memoria) para que lo lea otro proceso
+        _, file_key = await spool_upload(
+            file, MAX_PREVIEW_SIZE,
+            f"El archivo es demasiado grande para vista previa. Máximo {MAX_PREVIEW_SIZE // (1024 * 1024)}MB.",
+            dest_path=ruta
+        )
+        entry = parse_cache.get(file_key)
+        if entry is not None:
+            preview_data = await run_in_threadpool(preview_rows, entry)
+        else:
+            # pandas retiene el GIL: el parseo va al pool de procesos y el resultado queda en la
+            # caché de este proceso para la carga posterior del mismo archivo
+            preview_data, entry = await executors.cpu_pool.run(parse_excel_preview, ruta, file_key)
+            parse_cache.put(file_key, entry)
         return {
             "archivo": file.filename,
             "total_encontrados": len(preview_data),
             "registros": preview_data
         }
+    except HTTPException:
+        raise
+    except InvalidExcelError as e:
+        raise HTTPException(status_code=400, detail=f"No se pudo leer el archivo Excel: {str(e)}")
     except Exception as e:
+        logger.exception("Error interno en la vista previa")
         raise HTTPException(status_code=500, detail=f"Error en vista previa: {str(e)}")
+    finally:
+        if os.path.exists(ruta):
+            os.remove(ruta)
+
+def _sin_cargas_activas(items) -> bool:
+    """
+    El avance de una carga en curso cambia sin pasar por bump_version, así que ese historial no se
+    cachea ni se revalida; una carga solo entra en cola con enqueue_upload, que sí incrementa la versión.
+    """
+    return not any(i["estado"] in job_queue.ACTIVE_STATES for i in items)
 
-@router.get("/history")
-def get_upload_history(db: Session = Depends(get_db), current_user: models.Usuario = Depends(get_current_user)):
+@router.get("/history", dependencies=[Depends(user_data_etag)])
+def get_upload_history(response: Response, db: Session = Depends(get_db), current_user: models.Usuario = Depends(get_current_user)):
     try:
-        history = db.query(models.CargaExcel).filter(models.CargaExcel.user_id == current_user.id).order_by(models.CargaExcel.created_at.desc()).all()
-        return history
+        def historial():
+            history = db.query(models.CargaExcel).filter(
+                models.CargaExcel.user_id == current_user.id,
+                models.CargaExcel.tipo == job_queue.TIPO_EXCEL
+            ).order_by(models.CargaExcel.created_at.desc()).all()
+            return [job_queue.history_item(carga) for carga in history]
+        # Con cargas en curso la respuesta no se guarda ni lleva ETag (ver _sin_cargas_activas)
+        items = read_cache.cached(db, current_user, "excel.history", (), historial, store_if=_sin_cargas_activas)
+        if not _sin_cargas_activas(items):
+            del response.headers["ETag"]
+        return items
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error obteniendo historial: {str(e)}")
 
+@router.get("/cache/stats")
+def get_parse_cache_stats(current_user: models.Usuario = Depends(get_current_user)):
+    if current_user.rol != "admin":
+        raise HTTPException(status_code=403, detail="No tiene permisos para ver estas métricas")
+    return parse_cache.stats()
+
 @router.get("/export/{anio}/{mes}")
 def export_monthly_report(
-    anio: int, 
-    mes: int, 
+    anio: int = Path(..., ge=1900, le=2999),
+    mes: int = Path(..., ge=1, le=12),
     search: str = None,
     eess: str = None,
     estado: str = None,
@@ -58,106 +113,30 @@ def export_monthly_report(
     current_user: models.Usuario = Depends(get_current_user)
 ):
     try:
-        from sqlalchemy import extract, or_, func
-        # 1. Base Query - Empezamos por visitas en el periodo
-        query = db.query(models.Visita).join(models.Nino).filter(
-            extract('month', models.Visita.fecha_visita) == mes,
-            extract('year', models.Visita.fecha_visita) == anio,
-            models.Visita.user_id == current_user.id
+        # Una fila por niño, agregada en SQL y escrita en streaming
+        query = export_service.build_report_query(
+            db, anio, mes, current_user.id,
+            search=search, eess=eess, estado=estado, solo_nuevos=solo_nuevos
         )
+        path, count = export_service.export_report_to_tempfile(query)
 
-        # Filtro de Niños Nuevos
-        if solo_nuevos:
-            # Subquery para encontrar la fecha de la primera visita de cada niño
-            first_v_subq = db.query(
-                models.Visita.nino_id,
-                func.min(models.Visita.fecha_visita).label("min_fecha")
-            ).group_by(models.Visita.nino_id).subquery()
-            
-            # Unir con la subquery y filtrar los niños cuya primera visita sea en el mes/año actual
-            query = query.join(first_v_subq, models.Visita.nino_id == first_v_subq.c.nino_id).filter(
-                extract('month', first_v_subq.c.min_fecha) == mes,
-                extract('year', first_v_subq.c.min_fecha) == anio,
-                models.Visita.user_id == current_user.id
-            )
-
-        # 2. Aplicar Filtros (Misma lógica que en el listado)
-        if search:
-            search_filt = f"%{search}%"
-            query = query.filter(
-                or_(
-                    models.Nino.dni_nino.ilike(search_filt),
-                    models.Nino.nombres.ilike(search_filt),
-                    models.Nino.nombre_madre.ilike(search_filt)
-                )
-            )
-        
-        if eess:
-            query = query.filter(models.Nino.establecimiento_asignado == eess)
-        
-        if estado:
-            query = query.filter(models.Visita.estado == estado.lower())
-
-        # 3. Obtener resultados ordenados
-        visitas = query.order_by(models.Nino.nombres).all()
-        
-        if not visitas:
+        if count == 0:
+            os.remove(path)
             raise HTTPException(status_code=404, detail="No se encontraron registros con los filtros seleccionados")
-            
-        # 4. Agrupar por niño para evitar duplicados (1 fila por niño, como en la tabla UI)
-        children_data = {}
-        for v in visitas:
-            if v.nino_id not in children_data:
-                children_data[v.nino_id] = {
-                    "DNI Niño": v.nino.dni_nino,
-                    "Nombres y Apellidos": v.nino.nombres,
-                    "Fecha Nacimiento": v.nino.fecha_nacimiento.strftime('%d/%m/%Y') if v.nino.fecha_nacimiento else '---',
-                    "Rango de Edad": v.nino.rango_edad or '---',
-                    "Dirección": v.nino.direccion or '---',
-                    "DNI Madre": v.nino.dni_madre or '---',
-                    "Nombre Madre": v.nino.nombre_madre or '---',
-                    "Celular Madre": v.nino.celular_madre or '---',
-                    "Actor Social": v.actor_social or '---',
-                    "Historia Clinica": v.nino.historia_clinica or '---',
-                    "EESS Asignado": v.nino.establecimiento_asignado or '---',
-                    "EESS Atención": v.establecimiento_atencion or '---',
-                    "Estado": (v.estado or "pendiente").capitalize(),
-                    "Visitas en el Mes": 1
-                }
-            else:
-                children_data[v.nino_id]["Visitas en el Mes"] += 1
-            
-        df = pd.DataFrame(list(children_data.values()))
-        
-        # 5. Generar archivo Excel
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='Reporte Filtrado')
-            worksheet = writer.sheets['Reporte Filtrado']
-            
-            # Formato de cabecera
-            header_format = writer.book.add_format({
-                'bold': True,
-                'bg_color': '#FCE7F3',
-                'border': 1
-            })
-            
-            for col_num, value in enumerate(df.columns.values):
-                worksheet.write(0, col_num, value, header_format)
-                column_len = max(df[value].astype(str).map(len).max(), len(value)) + 2
-                worksheet.set_column(col_num, col_num, min(column_len, 50))
-                
-        output.seek(0)
-        
+
         suffix = "filtrado" if (search or eess or estado or solo_nuevos) else "completo"
         filename = f"Reporte_{mes}_{anio}_{suffix}.xlsx"
         
-        return StreamingResponse(
-            output, 
+        # El archivo temporal se envía por bloques y se borra al terminar la respuesta
+        return FileResponse(
+            path,
             media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
+            headers={"Content-Disposition": f"attachment; filename={filename}"},
+            background=BackgroundTask(os.remove, path)
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         error_msg = traceback.format_exc()
@@ -166,9 +145,10 @@ def export_monthly_report(
 
 @router.post("/upload")
 async def upload_excel(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    mes: int = Form(...),
-    anio: int = Form(...),
+    mes: int = Form(..., ge=1, le=12),
+    anio: int = Form(..., ge=1900, le=2999),
     eess_filter: str = Form(None),
     db: Session = Depends(get_db),
     current_user: models.Usuario = Depends(get_current_user)
@@ -177,58 +157,111 @@ async def upload_excel(
         raise HTTPException(status_code=400, detail="El archivo debe ser un Excel (.xlsx o .xls)")
     
     try:
-        # Límite de tamaño: 10MB (10 * 1024 * 1024 bytes)
-        MAX_SIZE = 10 * 1024 * 1024
-        file_size = 0
-        content = b""
-        
-        # Leer en trozos para verificar tamaño sin cargar todo si es excesivo
-        while chunk := await file.read(1024 * 100): # 100KB chunks
-            file_size += len(chunk)
-            if file_size > MAX_SIZE:
-                raise HTTPException(status_code=413, detail="El archivo es demasiado grande. Máximo 10MB.")
-            content += chunk
-        
-        # 1. Crear el registro inicial
-        nueva_carga = models.CargaExcel(
-            nombre_archivo=file.filename,
-            mes=mes,
-            anio=anio,
-            total_registros=0,
-            total_repetidos=0,
-            user_id=current_user.id,
-            estado="procesando"
+        # Guardar el archivo en disco por bloques verificando el límite de tamaño
+        ruta = job_queue.new_spool_path(file.filename)
+        await spool_upload(
+            file, MAX_UPLOAD_SIZE,
+            f"El archivo es demasiado grande. Máximo {MAX_UPLOAD_SIZE // (1024 * 1024)}MB.",
+            dest_path=ruta
         )
-        db.add(nueva_carga)
-        db.commit()
-        db.refresh(nueva_carga)
-        
-        # 2. PROCESAMIENTO SÍNCRONO para feedback inmediato
+
+        # 1. Encolar la carga (la procesa un trabajador en segundo plano)
         try:
-            total_visitas, repetidos, nuevos = process_minsa_excel(content, db, mes, anio, current_user.id, eess_filter)
-            
-            # 3. Actualizar registro y devolver resultados
-            nueva_carga.estado = "completado"
-            nueva_carga.total_registros = total_visitas
-            nueva_carga.total_repetidos = repetidos
-            db.commit()
-            
-            return {
-                "message": "Carga completada con éxito.",
-                "total_registros": total_visitas,
-                "nuevos": nuevos,
-                "existentes": repetidos,
-                "archivo": file.filename,
-                "estado": "completado",
-                "filter_received": eess_filter
-            }
-        except Exception as process_error:
-            nueva_carga.estado = "error"
-            nueva_carga.mensaje_error = str(process_error)[:450]
-            db.commit()
-            raise HTTPException(status_code=500, detail=f"Error procesando datos: {str(process_error)}")
+            # Escritura en la base: fuera del event loop
+            nueva_carga = await run_in_threadpool(
+                job_queue.enqueue_upload, db, ruta, file.filename, mes, anio, current_user.id, eess_filter
+            )
+        except Exception:
+            os.remove(ruta)
+            raise
+
+        # Sin procesos trabajadores configurados, la carga se procesa en este proceso tras responder
+        if job_queue.EXCEL_WORKERS <= 0:
+            background_tasks.add_task(job_queue.run_pending_jobs)
+
+        return {
+            "message": "Carga recibida. Se está procesando en segundo plano.",
+            "job_id": nueva_carga.id,
+            "archivo": file.filename,
+            "estado": nueva_carga.estado,
+            "filter_received": eess_filter
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error al iniciar carga: {str(e)}")
+
+@router.get("/jobs/events")
+async def stream_active_jobs(
+    request: Request,
+    current_user: models.Usuario = Depends(get_current_user)
+):
+    """Stream SSE con las cargas pendientes/en proceso del usuario (reemplaza el sondeo de /excel/history)"""
+    user_id = current_user.id
+
+    async def event_stream():
+        last = None
+        last_sent = time.monotonic()
+        while not await request.is_disconnected():
+            jobs = await run_in_threadpool(job_queue.load_active_jobs, user_id)
+            payload = json.dumps(jsonable_encoder(jobs))
+            if payload != last:
+                last = payload
+                last_sent = time.monotonic()
+                yield f"event: jobs\ndata: {payload}\n\n"
+            elif time.monotonic() - last_sent > SSE_KEEPALIVE_SECONDS:
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+            await asyncio.sleep(SSE_POLL_SECONDS)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.get("/jobs/{job_id}")
+def get_upload_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.Usuario = Depends(get_current_user)
+):
+    carga = db.query(models.CargaExcel).filter(models.CargaExcel.id == job_id).first()
+    if not carga or (carga.user_id != current_user.id and current_user.rol != "admin"):
+        raise HTTPException(status_code=404, detail="Carga no encontrada")
+    return job_queue.job_status(carga, job_queue.queue_position(db, carga))
+
+@router.get("/jobs/{job_id}/events")
+async def stream_upload_job(
+    job_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.Usuario = Depends(get_current_user)
+):
+    """Stream SSE con el avance de una carga; termina cuando la carga se completa o falla"""
+    carga = db.query(models.CargaExcel).filter(models.CargaExcel.id == job_id).first()
+    if not carga or (carga.user_id != current_user.id and current_user.rol != "admin"):
+        raise HTTPException(status_code=404, detail="Carga no encontrada")
+
+    # El generador usa su propia sesión: la de la dependencia se cierra antes de transmitir
+    async def event_stream():
+        last = None
+        last_sent = time.monotonic()
+        while not await request.is_disconnected():
+            status = await run_in_threadpool(job_queue.load_job_status, job_id)
+            if status is None:
+                yield "event: end\ndata: {}\n\n"
+                return
+            payload = json.dumps(jsonable_encoder(status))
+            if payload != last:
+                last = payload
+                last_sent = time.monotonic()
+                yield f"event: progress\ndata: {payload}\n\n"
+            elif time.monotonic() - last_sent > SSE_KEEPALIVE_SECONDS:
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+            if status["estado"] in (job_queue.COMPLETADO, job_queue.ERROR):
+                yield f"event: end\ndata: {payload}\n\n"
+                return
+            await asyncio.sleep(SSE_POLL_SECONDS)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
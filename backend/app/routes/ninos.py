@@ -1,29 +1,38 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List
-from ..database import get_db
+from ..database import get_db, get_read_db, run_db
 from ..models import models
 from ..schemas import schemas
 from ..auth import get_current_user
-from ..services.pdf_service import generate_child_history_pdf
+from ..services.pdf_service import render_child_history_pdf
+from ..services import resumen_service, read_cache, roster_service, job_queue
+from ..utils.periodo import month_filter
+from ..utils.etag import user_data_etag
+from ..utils import executors
 
 router = APIRouter(prefix="/ninos", tags=["Niños"])
 
-@router.get("/stats")
-def get_stats(db: Session = Depends(get_db), current_user: models.Usuario = Depends(get_current_user)):
-    from sqlalchemy import func, extract, case
+@router.get("/stats", dependencies=[Depends(user_data_etag)])
+async def get_stats(db=Depends(get_read_db), current_user: models.Usuario = Depends(get_current_user)):
+    # En caché hasta la próxima escritura del usuario (ver services/read_cache.py)
+    def stats(db: Session):
+        return read_cache.cached(db, current_user, "ninos.stats", (), lambda: _compute_stats(db, current_user.id))
+    return await run_db(db, stats)
+
+def _compute_stats(db: Session, user_id: int):
+    from sqlalchemy import func, case
     
-    total_ninos = db.query(func.count(models.Nino.id)).filter(models.Nino.user_id == current_user.id).scalar()
+    total_ninos = db.query(func.count(models.Nino.id)).filter(models.Nino.user_id == user_id).scalar()
     
-    # Obtener totales de visitas de una sola vez
-    visitas_stats = db.query(
-        func.count(models.Visita.id).label("total"),
-        func.count(case((models.Visita.estado == 'encontrado', 1))).label("encontrados"),
-        func.count(case((models.Visita.estado == 'no encontrado', 1))).label("no_encontrados")
-    ).filter(models.Visita.user_id == current_user.id).first()
+    # Totales de visitas del historial (suma de las filas de resumen_mensual del usuario)
+    visitas_stats = resumen_service.global_totals(db, user_id)
     
     # Obtener última carga
-    ultima_carga = db.query(models.CargaExcel).filter(models.CargaExcel.user_id == current_user.id).order_by(models.CargaExcel.created_at.desc()).first()
+    ultima_carga = db.query(models.CargaExcel).filter(
+        models.CargaExcel.user_id == user_id, models.CargaExcel.tipo == job_queue.TIPO_EXCEL
+    ).order_by(models.CargaExcel.created_at.desc()).first()
     
     repetidos = 0
     nuevos = 0
@@ -32,37 +41,17 @@ def get_stats(db: Session = Depends(get_db), current_user: models.Usuario = Depe
     
     if ultima_carga:
         from .visitas import get_month_name
-        from datetime import date
         mes_nombre = f"{get_month_name(ultima_carga.mes)} {ultima_carga.anio}"
         
-        # Calcular rango para la carga
-        start_c = date(ultima_carga.anio, ultima_carga.mes, 1)
-        if ultima_carga.mes == 12:
-            end_c = date(ultima_carga.anio + 1, 1, 1)
-        else:
-            end_c = date(ultima_carga.anio, ultima_carga.mes + 1, 1)
-        
         # Un niño es nuevo este mes si su PRIMERA visita histórica es en el periodo de la carga
-        # Primero identificamos niños que ya tenían visitas ANTES de este mes
-        viejos_ids = db.query(models.Visita.nino_id).filter(
-            models.Visita.user_id == current_user.id,
-            models.Visita.fecha_visita < start_c
-        ).distinct()
-        
-        # Nuevos: Niños que tienen visita este mes Y NO están en la lista de 'viejos'
-        nuevos = db.query(func.count(func.distinct(models.Visita.nino_id))).filter(
-            models.Visita.user_id == current_user.id,
-            models.Visita.fecha_visita >= start_c,
-            models.Visita.fecha_visita < end_c,
-            ~models.Visita.nino_id.in_(viejos_ids)
+        nuevos = db.query(func.count(models.Nino.id)).filter(
+            models.Nino.user_id == user_id,
+            month_filter(models.Nino.primera_visita, ultima_carga.anio, ultima_carga.mes)
         ).scalar() or 0
         
         # total_mes: Niños únicos que tuvieron visitas este mes
-        total_mes = db.query(func.count(func.distinct(models.Visita.nino_id))).filter(
-            models.Visita.fecha_visita >= start_c,
-            models.Visita.fecha_visita < end_c,
-            models.Visita.user_id == current_user.id
-        ).scalar() or 0
+        resumen_mes = resumen_service.get_month(db, user_id, ultima_carga.anio, ultima_carga.mes)
+        total_mes = resumen_mes.total_ninos if resumen_mes else 0
         
         repetidos = max(0, total_mes - nuevos)
         
@@ -80,62 +69,20 @@ def get_stats(db: Session = Depends(get_db), current_user: models.Usuario = Depe
         }
     }
 
-@router.get("/", response_model=List[schemas.NinoListItem])
-def read_ninos(db: Session = Depends(get_db), current_user: models.Usuario = Depends(get_current_user)):
-    from sqlalchemy import func, outerjoin
-    from datetime import date
-    
-    today = date.today()
-    
-    # Optimizamos: Traer niños con el estado de su última visita y flag de si es nuevo
-    # Subquery para la primera visita (para es_nuevo)
-    first_v = db.query(
-        models.Visita.nino_id,
-        func.min(models.Visita.fecha_visita).label("primera")
-    ).group_by(models.Visita.nino_id).subquery()
-    
-    # Subquery para la última visita (para estado)
-    last_v_id = db.query(
-        models.Visita.nino_id,
-        func.max(models.Visita.id).label("max_id")
-    ).group_by(models.Visita.nino_id).subquery()
-    
-    last_v = db.query(
-        models.Visita.nino_id,
-        models.Visita.estado
-    ).join(last_v_id, models.Visita.id == last_v_id.c.max_id).subquery()
-    
-    # Consulta principal
-    ninos_data = db.query(
-        models.Nino,
-        last_v.c.estado.label("ultimo_estado"),
-        first_v.c.primera.label("primera_visita"),
-        func.count(models.Visita.id).label("v_count")
-    ).outerjoin(last_v, models.Nino.id == last_v.c.nino_id)\
-     .outerjoin(first_v, models.Nino.id == first_v.c.nino_id)\
-     .outerjoin(models.Visita, models.Nino.id == models.Visita.nino_id)\
-     .filter(models.Nino.user_id == current_user.id)\
-     .group_by(models.Nino.id, last_v.c.estado, first_v.c.primera)\
-     .all()
-    
-    result = []
-    for nino_obj, est, prim, v_count in ninos_data:
-        # Convertir el objeto SQLAlchemy a diccionario base
-        nino_dict = {c.name: getattr(nino_obj, c.name) for c in nino_obj.__table__.columns}
-        
-        # Añadir campos calculados
-        nino_dict["estado"] = est or "pendiente"
-        nino_dict["visitas_count"] = v_count or 0
-        
-        # Lógica de es_nuevo
-        if prim:
-            nino_dict["es_nuevo"] = (prim.year == today.year and prim.month == today.month)
-        else:
-            nino_dict["es_nuevo"] = False
-            
-        result.append(nino_dict)
-            
-    return result
+@router.get("/", response_model=List[schemas.NinoListItem], dependencies=[Depends(user_data_etag)])
+async def read_ninos(response: Response, formato: str = "json", db=Depends(get_read_db), current_user: models.Usuario = Depends(get_current_user)):
+    # formato=ndjson: un niño por línea, enviado por lotes mientras se lee la consulta
+    if formato == "ndjson":
+        return StreamingResponse(
+            roster_service.roster_ndjson(current_user.id),
+            media_type="application/x-ndjson",
+            headers=dict(response.headers)
+        )
+    if formato != "json":
+        raise HTTPException(status_code=400, detail="formato debe ser 'json' o 'ndjson'")
+
+    # Estado de la última visita, primera visita y número de visitas ya vienen en la fila del niño
+    return await run_db(db, roster_service.roster_items, current_user.id)
 
 @router.post("/", response_model=schemas.Nino)
 def create_nino(nino: schemas.NinoCreate, db: Session = Depends(get_db), current_user: models.Usuario = Depends(get_current_user)):
@@ -147,11 +94,12 @@ def create_nino(nino: schemas.NinoCreate, db: Session = Depends(get_db), current
         raise HTTPException(status_code=400, detail="DNI ya registrado para este usuario")
     db_nino = models.Nino(**nino.model_dump(), user_id=current_user.id)
     db.add(db_nino)
+    read_cache.bump_version(db, current_user.id)
     db.commit()
     db.refresh(db_nino)
     return db_nino
 
-@router.get("/{nino_id}", response_model=schemas.Nino)
+@router.get("/{nino_id}", response_model=schemas.Nino, dependencies=[Depends(user_data_etag)])
 def read_nino(nino_id: int, db: Session = Depends(get_db), current_user: models.Usuario = Depends(get_current_user)):
     db_nino = db.query(models.Nino).filter(models.Nino.id == nino_id, models.Nino.user_id == current_user.id).first()
     if db_nino is None:
@@ -167,6 +115,7 @@ def update_nino(nino_id: int, nino_update: schemas.NinoCreate, db: Session = Dep
     for key, value in nino_update.model_dump().items():
         setattr(db_nino, key, value)
     
+    read_cache.bump_version(db, current_user.id)
     db.commit()
     db.refresh(db_nino)
     return db_nino
@@ -177,10 +126,17 @@ def delete_nino(nino_id: int, db: Session = Depends(get_db), current_user: model
     if db_nino is None:
         raise HTTPException(status_code=404, detail="Niño no encontrado o no tiene permisos")
     
+    # Meses en los que el niño tenía visitas (se eliminan en cascada)
+    fechas = [f for (f,) in db.query(models.Visita.fecha_visita).filter(models.Visita.nino_id == nino_id).distinct()]
     db.delete(db_nino)
+    resumen_service.refresh_months(db, current_user.id, fechas)
+    read_cache.bump_version(db, current_user.id)
     db.commit()
     return {"message": "Niño eliminado con éxito"}
 
+def _columnas(obj) -> dict:
+    return {c.name: getattr(obj, c.name) for c in obj.__table__.columns}
+
 @router.get("/{nino_id}/pdf")
 def get_nino_pdf(nino_id: int, db: Session = Depends(get_db), current_user: models.Usuario = Depends(get_current_user)):
     db_nino = db.query(models.Nino).filter(models.Nino.id == nino_id, models.Nino.user_id == current_user.id).first()
@@ -191,7 +147,10 @@ def get_nino_pdf(nino_id: int, db: Session = Depends(get_db), current_user: mode
     visitas = db.query(models.Visita).filter(models.Visita.nino_id == nino_id, models.Visita.user_id == current_user.id).all()
     
     try:
-        pdf_content = generate_child_history_pdf(db_nino, visitas)
+        # El PDF se arma en el pool de procesos con las columnas ya leídas
+        pdf_content = executors.cpu_pool.call(
+            render_child_history_pdf, _columnas(db_nino), [_columnas(v) for v in visitas]
+        )
         
         filename = f"Historial_{db_nino.dni_nino}.pdf"
         return Response(
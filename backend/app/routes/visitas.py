@@ -1,13 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Path
 from sqlalchemy.orm import Session
 from typing import List
-from ..database import get_db
+from ..database import get_db, get_read_db, run_db
 from ..models import models
 from ..schemas import schemas
 from ..auth import get_current_user
+from ..services import resumen_service, read_cache, purge_service, job_queue
+from ..services.busqueda_service import search_condition
+from ..utils.pagination import encode_cursor, decode_cursor
+from ..utils.periodo import month_filter, periodo_filter
+from ..utils.etag import user_data_etag
+from ..utils.ttl_cache import TTLCache
+from ..utils import executors
+import os
 
 router = APIRouter(prefix="/visitas", tags=["Visitas"])
 
+# Totales del detalle mensual por combinación de filtros (configurable desde .env)
+_detail_totals = TTLCache(
+    max_entries=int(os.getenv("DETAIL_TOTAL_CACHE_ENTRIES", 512)),
+    ttl_seconds=int(os.getenv("DETAIL_TOTAL_CACHE_TTL", 300))
+)
+
 @router.post("/", response_model=schemas.Visita)
 def create_visita(visita: schemas.VisitaCreate, db: Session = Depends(get_db), current_user: models.Usuario = Depends(get_current_user)):
     # Verificar si ya existe una visita para ese niño en esa fecha
@@ -26,6 +40,9 @@ def create_visita(visita: schemas.VisitaCreate, db: Session = Depends(get_db), c
         db_visita = models.Visita(**visita.model_dump(), user_id=current_user.id)
         db.add(db_visita)
     
+    resumen_service.refresh_months(db, current_user.id, [visita.fecha_visita])
+    resumen_service.refresh_ninos(db, current_user.id, nino_ids=[visita.nino_id])
+    read_cache.bump_version(db, current_user.id)
     db.commit()
     db.refresh(db_visita)
     return db_visita
@@ -36,181 +53,151 @@ def update_visita(visita_id: int, visita_data: schemas.VisitaCreate, db: Session
     if not db_visita:
         raise HTTPException(status_code=404, detail="Visita no encontrada")
     
+    fecha_anterior, nino_anterior = db_visita.fecha_visita, db_visita.nino_id
     for key, value in visita_data.model_dump().items():
         setattr(db_visita, key, value)
     
+    resumen_service.refresh_months(db, current_user.id, [fecha_anterior, db_visita.fecha_visita])
+    resumen_service.refresh_ninos(db, current_user.id, nino_ids=[nino_anterior, db_visita.nino_id])
+    read_cache.bump_version(db, current_user.id)
     db.commit()
     db.refresh(db_visita)
     return db_visita
 
-@router.get("/nino/{nino_id}", response_model=List[schemas.Visita])
+@router.get("/nino/{nino_id}", response_model=List[schemas.Visita], dependencies=[Depends(user_data_etag)])
 def read_visitas_nino(nino_id: int, db: Session = Depends(get_db), current_user: models.Usuario = Depends(get_current_user)):
     return db.query(models.Visita).filter(models.Visita.nino_id == nino_id, models.Visita.user_id == current_user.id).all()
 
-@router.get("/resumen")
-def get_monthly_summary(db: Session = Depends(get_db), current_user: models.Usuario = Depends(get_current_user)):
-    # Obtener totales agrupados por mes/anio usando EXTRACT de fecha_visita
-    from sqlalchemy import func, extract, case
-    
-    results = db.query(
-        extract('month', models.Visita.fecha_visita).label("mes"),
-        extract('year', models.Visita.fecha_visita).label("anio"),
-        func.count(models.Visita.id).label("total"),
-        func.count(func.distinct(models.Visita.nino_id)).label("totalNinos"),
-        # Contar NIÑOS únicos por estado
-        func.count(func.distinct(case((models.Visita.estado == 'encontrado', models.Visita.nino_id), else_=None))).label("encontrados"),
-        func.count(func.distinct(case((models.Visita.estado == 'no encontrado', models.Visita.nino_id), else_=None))).label("noEncontrados"),
-        func.count(func.distinct(case((models.Visita.estado == 'pendiente', models.Visita.nino_id), else_=None))).label("pendientes")
-    ).filter(
-        models.Visita.user_id == current_user.id
-    ).group_by(
-        extract('month', models.Visita.fecha_visita),
-        extract('year', models.Visita.fecha_visita)
-    ).order_by(
-        extract('year', models.Visita.fecha_visita).desc(),
-        extract('month', models.Visita.fecha_visita).desc()
-    ).all()
+@router.get("/resumen", dependencies=[Depends(user_data_etag)])
+async def get_monthly_summary(db=Depends(get_read_db), current_user: models.Usuario = Depends(get_current_user)):
+    # En caché hasta la próxima escritura del usuario (ver services/read_cache.py)
+    def summary(db: Session):
+        return read_cache.cached(db, current_user, "visitas.resumen", (), lambda: _monthly_summary(db, current_user.id))
+    return await run_db(db, summary)
+
+def _monthly_summary(db: Session, user_id: int):
+    # Totales por mes leídos de la tabla resumen_mensual (ver services/resumen_service.py)
+    results = resumen_service.get_summary(db, user_id)
     
     summary = []
     for r in results:
-        m = int(r.mes)
-        y = int(r.anio)
+        m = r.mes
+        y = r.anio
         summary.append({
             "mes": m,
             "anio": y,
             "month": f"{get_month_name(m)} {y}",
-            "total": r.total or 0,
-            "totalNinos": r.totalNinos or 0,
-            "encontrados": int(r.encontrados or 0),
-            "noEncontrados": int(r.noEncontrados or 0),
-            "pendientes": int(r.pendientes or 0)
+            "total": r.total_visitas,
+            "totalNinos": r.total_ninos,
+            "encontrados": r.encontrados,
+            "noEncontrados": r.no_encontrados,
+            "pendientes": r.pendientes
         })
     return summary
 
-@router.get("/detalle/{anio}/{mes}")
-def read_monthly_detail(
-    anio: int, 
-    mes: int, 
+@router.get("/detalle/{anio}/{mes}", dependencies=[Depends(user_data_etag)])
+async def read_monthly_detail(
+    anio: int = Path(..., ge=1900, le=2999),
+    mes: int = Path(..., ge=1, le=12),
     skip: int = 0, 
     limit: int = 50, 
     search: str = None, 
     eess: str = None,
     estado: str = None,
     solo_nuevos: bool = False,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    include_total: bool = True,
+    db=Depends(get_read_db),
     current_user: models.Usuario = Depends(get_current_user)
 ):
+    """
+    Niños con visitas en el mes, paginados por cursor: `next_cursor` de la respuesta se envía
+    como `cursor` para pedir la página siguiente (orden nombres, id). `skip` se mantiene para
+    clientes antiguos. El total exacto es opcional (`include_total`) y se cachea por filtros.
+    """
+    return await run_db(
+        db, _monthly_detail, current_user.id, anio, mes, skip, limit, search, eess, estado,
+        solo_nuevos, cursor, include_total
+    )
+
+def _monthly_detail(db: Session, user_id: int, anio: int, mes: int, skip: int, limit: int, search: str,
+                    eess: str, estado: str, solo_nuevos: bool, cursor: str, include_total: bool):
     try:
-        from datetime import date
-        from sqlalchemy import func, exists, and_
-        
-        # Calcular rango de fechas
-        start_date = date(anio, mes, 1)
-        if mes == 12:
-            end_date = date(anio + 1, 1, 1)
-        else:
-            end_date = date(anio, mes + 1, 1)
+        from sqlalchemy import func, select, tuple_
 
-        # 1. Identificar niños que tienen visitas en el periodo solicitado
-        # Es mucho más eficiente hacer un JOIN o un IN que un EXISTS correlacionado con extract
-        visitas_periodo = db.query(models.Visita.nino_id).filter(
-            models.Visita.fecha_visita >= start_date,
-            models.Visita.fecha_visita < end_date,
-            models.Visita.user_id == current_user.id
-        )
+        # 1. CTE con las visitas del periodo que cumplen todos los filtros (del niño y de la visita).
+        # La comparten el agregado de contadores y la consulta de la página.
+        visitas_filtradas = db.query(models.Visita.nino_id, models.Visita.estado)\
+            .join(models.Nino, models.Nino.id == models.Visita.nino_id)\
+            .filter(
+                periodo_filter(models.Visita.periodo, anio, mes),
+                models.Visita.user_id == user_id,
+                models.Nino.user_id == user_id
+            )
         
         if estado:
-            visitas_periodo = visitas_periodo.filter(models.Visita.estado == estado.lower())
-        
-        # Obtener IDs únicos de niños para este mes
-        query_kids = db.query(models.Nino).filter(models.Nino.id.in_(visitas_periodo))
+            visitas_filtradas = visitas_filtradas.filter(models.Visita.estado == estado.lower())
         
-        # Filtro de Niños Nuevos
+        # Filtro de Niños Nuevos: su PRIMERA visita es en este mes/año (índice idx_nino_user_primera)
         if solo_nuevos:
-            # Un niño es nuevo si su PRIMERA visita es en este mes/año
-            first_v_subq = db.query(
-                models.Visita.nino_id,
-                func.min(models.Visita.fecha_visita).label("min_fecha")
-            ).group_by(models.Visita.nino_id).subquery()
-            
-            query_kids = query_kids.join(first_v_subq, models.Nino.id == first_v_subq.c.nino_id).filter(
-                first_v_subq.c.min_fecha >= start_date,
-                first_v_subq.c.min_fecha < end_date
-            )
+            visitas_filtradas = visitas_filtradas.filter(month_filter(models.Nino.primera_visita, anio, mes))
 
+        # Búsqueda sin distinguir mayúsculas ni acentos sobre la columna normalizada (índice de trigramas)
         if search:
-            search_filter = f"%{search}%"
-            query_kids = query_kids.filter(
-                (models.Nino.dni_nino.ilike(search_filter)) |
-                (models.Nino.nombres.ilike(search_filter)) |
-                (models.Nino.nombre_madre.ilike(search_filter))
-            )
+            visitas_filtradas = visitas_filtradas.filter(search_condition(search))
         
         if eess:
-            query_kids = query_kids.filter(models.Nino.establecimiento_asignado == eess)
+            visitas_filtradas = visitas_filtradas.filter(models.Nino.establecimiento_asignado == eess)
 
-        # Total de niños únicos (para paginación)
-        total_unique_children = query_kids.count()
+        visitas_filtradas = visitas_filtradas.cte("visitas_filtradas")
 
-        # Obtener los niños de la página actual
-        paged_kids = query_kids.order_by(models.Nino.nombres).offset(skip).limit(limit).all()
+        # 2. Total y contadores por estado (niños únicos) en un solo agregado con FILTER. Se calculan
+        # una vez por combinación de filtros y se cachean por Usuario.data_version, que sube con cada
+        # escritura del usuario: una carga, edición o borrado nunca deja valores viejos.
+        version = read_cache.data_version(db, user_id)
+        totals_key = (user_id, anio, mes, search, eess, estado, solo_nuevos, version)
+        totals = _detail_totals.get(totals_key)
+        if totals is None:
+            ninos_unicos = func.count(func.distinct(visitas_filtradas.c.nino_id))
+            row = db.query(
+                ninos_unicos.label("total"),
+                ninos_unicos.filter(visitas_filtradas.c.estado == 'encontrado').label("encontrados"),
+                ninos_unicos.filter(visitas_filtradas.c.estado == 'no encontrado').label("no_encontrados"),
+                ninos_unicos.filter(visitas_filtradas.c.estado == 'pendiente').label("pendientes")
+            ).one()
+            totals = {k: row._mapping[k] or 0 for k in ("total", "encontrados", "no_encontrados", "pendientes")}
+            _detail_totals.set(totals_key, totals)
+        total_unique_children = totals["total"] if include_total else None
+
+        # 3. Página actual por keyset (índice idx_nino_user_nombres): el costo no crece con la profundidad
+        page_query = db.query(models.Nino).filter(
+            models.Nino.user_id == user_id,
+            models.Nino.id.in_(select(visitas_filtradas.c.nino_id))
+        ).order_by(models.Nino.nombres, models.Nino.id)
+        if cursor:
+            last_nombres, last_id = decode_cursor(cursor, 2)
+            page_query = page_query.filter(tuple_(models.Nino.nombres, models.Nino.id) > tuple_(last_nombres, last_id))
+        elif skip:
+            page_query = page_query.offset(skip)
+        # Una fila extra indica si hay más páginas sin necesidad del total
+        paged_kids = page_query.limit(limit + 1).all()
+        has_more = len(paged_kids) > limit
+        paged_kids = paged_kids[:limit]
+        next_cursor = encode_cursor(paged_kids[-1].nombres, paged_kids[-1].id) if has_more else None
         child_ids = [k.id for k in paged_kids]
 
-        # 2. Cargar las visitas de este mes para estos niños específicos
+        # Visitas de este mes para los niños de la página
         visitas = db.query(models.Visita).filter(
             models.Visita.nino_id.in_(child_ids),
-            models.Visita.fecha_visita >= start_date,
-            models.Visita.fecha_visita < end_date,
-            models.Visita.user_id == current_user.id
+            periodo_filter(models.Visita.periodo, anio, mes),
+            models.Visita.user_id == user_id
         ).all()
 
-        # 3. Datos de estadísticas (Encontrados / No Encontrados) - Respetando filtros
-        base_stats_query = db.query(func.count(func.distinct(models.Visita.nino_id))).join(models.Nino).filter(
-            models.Visita.fecha_visita >= start_date,
-            models.Visita.fecha_visita < end_date,
-            models.Visita.user_id == current_user.id
-        )
-        if solo_nuevos:
-             first_v_subq_stat = db.query(
-                models.Visita.nino_id,
-                func.min(models.Visita.fecha_visita).label("min_fecha")
-            ).group_by(models.Visita.nino_id).subquery()
-             base_stats_query = base_stats_query.join(first_v_subq_stat, models.Nino.id == first_v_subq_stat.c.nino_id).filter(
-                first_v_subq_stat.c.min_fecha >= start_date,
-                first_v_subq_stat.c.min_fecha < end_date
-            )
-        if search:
-            base_stats_query = base_stats_query.filter(
-                (models.Nino.dni_nino.ilike(search_filter)) |
-                (models.Nino.nombres.ilike(search_filter)) |
-                (models.Nino.nombre_madre.ilike(search_filter))
-            )
-        if eess:
-            base_stats_query = base_stats_query.filter(models.Nino.establecimiento_asignado == eess)
-        
-        # Aplicar filtro de estado si existe
-        if estado:
-            base_stats_query = base_stats_query.filter(models.Visita.estado == estado.lower())
-
-        encontrados_count = base_stats_query.filter(models.Visita.estado == 'encontrado').scalar() or 0
-        no_encon_count = base_stats_query.filter(models.Visita.estado == 'no encontrado').scalar() or 0
-        pendientes_count = base_stats_query.filter(models.Visita.estado == 'pendiente').scalar() or 0
-
-        # 4. Primera visita histórica (Eficiente para el flag es_nuevo)
-        first_visits = db.query(
-            models.Visita.nino_id,
-            func.min(models.Visita.fecha_visita).label("primera_fecha")
-        ).filter(
-            models.Visita.nino_id.in_(child_ids),
-            models.Visita.user_id == current_user.id
-        ).group_by(models.Visita.nino_id).all()
-        
-        first_visit_map = {fv.nino_id: fv.primera_fecha for fv in first_visits}
-        
-        # 5. Mapear resultados
+        # 4. Mapear resultados
         children_map = {}
         for k in paged_kids:
-            primera_f = first_visit_map.get(k.id)
+            # Nuevo: su primera visita histórica es de este mes
+            primera_f = k.primera_visita
             es_nuevo_item = (primera_f.year == anio and primera_f.month == mes) if primera_f else False
 
             children_map[k.id] = {
@@ -241,34 +228,41 @@ def read_monthly_detail(
         return {
             "total": total_unique_children, 
             "total_children": total_unique_children,
-            "encontrados": encontrados_count,
-            "no_encontrados": no_encon_count,
-            "pendientes": pendientes_count,
+            "encontrados": totals["encontrados"],
+            "no_encontrados": totals["no_encontrados"],
+            "pendientes": totals["pendientes"],
             "children": final_list,
-            "has_more": (skip + limit) < total_unique_children
+            "has_more": has_more,
+            "next_cursor": next_cursor
         }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"ERROR EN DETALLE: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/eess/{anio}/{mes}")
-def get_monthly_eess(anio: int, mes: int, db: Session = Depends(get_db), current_user: models.Usuario = Depends(get_current_user)):
-    from sqlalchemy import extract
-    # Obtener lista única de EESS asignados para un mes específico
+@router.get("/eess/{anio}/{mes}", dependencies=[Depends(user_data_etag)])
+def get_monthly_eess(anio: int = Path(..., ge=1900, le=2999), mes: int = Path(..., ge=1, le=12), db: Session = Depends(get_db), current_user: models.Usuario = Depends(get_current_user)):
+    return read_cache.cached(db, current_user, "visitas.eess", (anio, mes), lambda: _monthly_eess(db, current_user.id, anio, mes))
+
+def _monthly_eess(db: Session, user_id: int, anio: int, mes: int):
+    # Obtener lista única de EESS asignados para un mes específico (índice idx_visita_user_periodo)
     results = db.query(models.Nino.establecimiento_asignado).join(models.Visita).filter(
-        extract('month', models.Visita.fecha_visita) == mes,
-        extract('year', models.Visita.fecha_visita) == anio,
-        models.Visita.user_id == current_user.id
+        periodo_filter(models.Visita.periodo, anio, mes),
+        models.Visita.user_id == user_id
     ).distinct().all()
     
     eess_list = [r[0] for r in results if r[0]]
     return sorted(eess_list)
 
-@router.get("/eess/all")
+@router.get("/eess/all", dependencies=[Depends(user_data_etag)])
 def get_all_eess(db: Session = Depends(get_db), current_user: models.Usuario = Depends(get_current_user)):
+    return read_cache.cached(db, current_user, "visitas.eess_all", (), lambda: _all_eess(db, current_user.id))
+
+def _all_eess(db: Session, user_id: int):
     # Obtener lista única de todos los EESS registrados en el sistema del usuario
-    res1 = db.query(models.Nino.establecimiento_asignado).filter(models.Nino.user_id == current_user.id).distinct().all()
-    res2 = db.query(models.Visita.establecimiento_atencion).filter(models.Visita.user_id == current_user.id).distinct().all()
+    res1 = db.query(models.Nino.establecimiento_asignado).filter(models.Nino.user_id == user_id).distinct().all()
+    res2 = db.query(models.Visita.establecimiento_atencion).filter(models.Visita.user_id == user_id).distinct().all()
     
     # Combinar y limpiar
     eess_set = set()
@@ -280,47 +274,42 @@ def get_all_eess(db: Session = Depends(get_db), current_user: models.Usuario = D
     return sorted(list(eess_set))
 
 @router.delete("/{anio}/{mes}")
-def delete_monthly_report(anio: int, mes: int, request: schemas.DeleteReportRequest, db: Session = Depends(get_db), current_user: models.Usuario = Depends(get_current_user)):
+def delete_monthly_report(request: schemas.DeleteReportRequest, background_tasks: BackgroundTasks, anio: int = Path(..., ge=1900, le=2999), mes: int = Path(..., ge=1, le=12), segundo_plano: bool = False, db: Session = Depends(get_db), current_user: models.Usuario = Depends(get_current_user)):
     if not request.password:
         raise HTTPException(status_code=401, detail="Se requiere la contraseña para eliminar")
     
     # Verificar contraseña del usuario actual
-    from ..auth import verify_password
-    if not verify_password(request.password, current_user.password_hash):
+    from ..auth import verify_password, current_password_hash
+    password_hash = current_password_hash(db, current_user.id)
+    if not executors.bcrypt_pool.call(verify_password, request.password, password_hash):
         raise HTTPException(status_code=401, detail="Contraseña de seguridad incorrecta")
 
     try:
-        from sqlalchemy import extract
-        # 1. Eliminar visitas
-        db.query(models.Visita).filter(
-            extract('month', models.Visita.fecha_visita) == mes,
-            extract('year', models.Visita.fecha_visita) == anio,
-            models.Visita.user_id == current_user.id
-        ).delete(synchronize_session=False)
-        
-        # 2. Eliminar historial de carga excel si existe
-        db.query(models.CargaExcel).filter(
-            models.CargaExcel.mes == mes,
-            models.CargaExcel.anio == anio,
-            models.CargaExcel.user_id == current_user.id
-        ).delete()
-        
-        # 3. Limpiar niños huérfanos (que ya no tienen visitas en ningún mes) DEL USUARIO ACTUAL
-        # IMPORTANTE: Filtrar por user_id para no afectar a otros usuarios
-        orphans = db.query(models.Nino).filter(
-            models.Nino.user_id == current_user.id,
-            ~models.Nino.visitas.any()
-        ).all()
-        total_orphans = len(orphans)
-        for nino in orphans:
-            db.delete(nino)
-            
-        db.commit()
+        # 1. Visitas, cargas excel del mes y datos derivados (sentencias por conjuntos)
+        purge_service.delete_month(db, current_user.id, anio, mes)
+
+        # 2. Niños huérfanos (sin visitas en ningún mes) del usuario actual
+        job_id = None
+        if segundo_plano:
+            # Trabajo de la cola de cargas: su avance se consulta en /excel/jobs/{job_id} (o su stream)
+            job_id = job_queue.enqueue_orphan_purge(db, current_user.id, anio, mes).id
+            db.commit()
+            if job_queue.EXCEL_WORKERS <= 0:
+                background_tasks.add_task(job_queue.run_pending_jobs)
+            detalle = "Los registros de niños que ya no tienen visitas se eliminan en segundo plano."
+        else:
+            total_orphans = purge_service.purge_orphan_ninos(db, current_user.id)
+            db.commit()
+            detalle = f"Se eliminaron {total_orphans} registros de niños que ya no tenían visitas."
         return {
-            "message": f"Reporte {mes}/{anio} eliminado. Se eliminaron {total_orphans} registros de niños que ya no tenían visitas.",
+            "message": f"Reporte {mes}/{anio} eliminado. {detalle}",
             "anio": anio,
-            "mes": mes
+            "mes": mes,
+            "job_id": job_id
         }
+    except purge_service.ActiveUploadError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Hay una carga de Excel de este mes en proceso. Espere a que termine para eliminar el reporte.")
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error al eliminar reporte: {str(e)}")
@@ -333,6 +322,9 @@ def delete_visita(visita_id: int, db: Session = Depends(get_db), current_user: m
     
     try:
         db.delete(db_visita)
+        resumen_service.refresh_months(db, current_user.id, [db_visita.fecha_visita])
+        resumen_service.refresh_ninos(db, current_user.id, nino_ids=[db_visita.nino_id])
+        read_cache.bump_version(db, current_user.id)
         db.commit()
         return {"message": "Visita eliminada con éxito"}
     except Exception as e:
@@ -0,0 +1,99 @@
+"""
+Búsqueda de niños por DNI, nombres o nombre de la madre sin distinguir mayúsculas ni acentos.
+
+Nino.busqueda guarda "DNI|NOMBRES|NOMBRE MADRE" normalizado con normalize_text (mayúsculas,
+sin acentos ni tildes de la Ñ), así "NIÑO", "Nino" y "niño" encuentran lo mismo y el filtro
+es un único LIKE sobre una columna ya normalizada. En PostgreSQL la columna tiene un índice
+GIN de trigramas (extensión pg_trgm) que resuelve LIKE '%texto%' sin recorrer la tabla; en
+SQLite, o si la extensión no está instalada, el LIKE recorre las filas del usuario.
+
+La columna se calcula al guardar un niño por el ORM (eventos before_insert/before_update) y,
+en las cargas de Excel, que escriben con operaciones bulk sin eventos, con refresh_busqueda.
+
+Recalcular todo (por ejemplo tras cargar datos a mano en la base):
+    python -m app.services.busqueda_service [--user-id ID]
+"""
+import logging
+import pandas as pd
+from datetime import date
+from sqlalchemy import bindparam, event, select, update
+from sqlalchemy.orm import Session
+from ..models import models
+from .excel_service import normalize_text, normalize_text_series
+
+logger = logging.getLogger("AlyAPI.Busqueda")
+
+SEPARADOR = "|"
+
+def busqueda_value(dni_nino, nombres, nombre_madre) -> str:
+    return SEPARADOR.join(normalize_text(v) for v in (dni_nino, nombres, nombre_madre))
+
+def search_condition(search: str):
+    """Condición del filtro `search` del detalle mensual y de la exportación"""
+    termino = normalize_text(search).replace(SEPARADOR, " ")
+    return models.Nino.busqueda.like(f"%{termino}%")
+
+def _normalizados(valores) -> pd.Series:
+    return normalize_text_series(pd.Series(valores, dtype=object))
+
+@event.listens_for(models.Nino, "before_insert")
+@event.listens_for(models.Nino, "before_update")
+def _set_busqueda(mapper, connection, target):
+    target.busqueda = busqueda_value(target.dni_nino, target.nombres, target.nombre_madre)
+
+def refresh_busqueda(db: Session, user_id: int, nino_ids=None, fecha: date = None) -> int:
+    """
+    Recalcula Nino.busqueda de los niños del usuario (los de `nino_ids`, los que tienen una
+    visita en `fecha` o todos) y actualiza solo los que cambiaron. No hace commit.
+    Devuelve cuántos niños se actualizaron.
+    """
+    N, V = models.Nino, models.Visita
+    db.flush()
+
+    consulta = select(N.id, N.dni_nino, N.nombres, N.nombre_madre, N.busqueda).where(N.user_id == user_id)
+    if nino_ids is not None:
+        consulta = consulta.where(N.id.in_([i for i in set(nino_ids) if i is not None]))
+    if fecha is not None:
+        consulta = consulta.where(N.id.in_(
+            select(V.nino_id).where(V.user_id == user_id, V.fecha_visita == fecha)
+        ))
+    filas = db.execute(consulta).all()
+    if not filas:
+        return 0
+
+    ids, dnis, nombres, madres, actuales = zip(*filas)
+    # Normalización vectorizada: una llamada a normalize_text por cada valor distinto
+    nuevos = (
+        _normalizados(dnis) + SEPARADOR + _normalizados(nombres) + SEPARADOR + _normalizados(madres)
+    ).tolist()
+    cambios = [
+        {"b_id": i, "b_busqueda": nuevo}
+        for i, nuevo, actual in zip(ids, nuevos, actuales) if nuevo != actual
+    ]
+    if cambios:
+        # updated_at se conserva: la columna se deriva de datos que ya lo actualizaron
+        tabla = N.__table__
+        db.execute(
+            update(tabla).where(tabla.c.id == bindparam("b_id"))
+            .values(busqueda=bindparam("b_busqueda"), updated_at=tabla.c.updated_at),
+            cambios
+        )
+        logger.info(f"Búsqueda actualizada para {len(cambios)} niños")
+    return len(cambios)
+
+if __name__ == "__main__":
+    import argparse
+    from ..database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Recalcula la columna de búsqueda de los niños")
+    parser.add_argument("--user-id", type=int, default=None, help="Solo este usuario (por defecto, todos)")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        usuarios = [args.user_id] if args.user_id is not None else [u for (u,) in db.query(models.Usuario.id)]
+        total = sum(refresh_busqueda(db, uid) for uid in usuarios)
+        db.commit()
+        print(f"Búsqueda recalculada: {total} niños actualizados en {len(usuarios)} usuario(s)")
+    finally:
+        db.close()
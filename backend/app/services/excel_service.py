@@ -1,14 +1,29 @@
 import pandas as pd
+import numpy as np
+import openpyxl
 import logging
+import os
+import zipfile
+from sqlalchemy import text, insert
 from sqlalchemy.orm import Session
 from ..models import models
 from datetime import datetime, date
-from ..database import SessionLocal
+from .parse_cache import parse_cache, file_hash, ParsedWorkbook
+from .resumen_service import lock_user, refresh_month, refresh_ninos
+from .read_cache import bump_version
+from .vector_normalize import map_unique_text, none_or_nan_mask, falsy_or_na_mask
+from ..utils.periodo import periodo_of
 import io
 import traceback
 
 logger = logging.getLogger("AlyAPI.Excel")
 
+class InvalidExcelError(ValueError):
+    """El archivo no se pudo leer como Excel (dañado o en un formato no soportado)"""
+
+# Modo de escritura de la carga: 'auto' (COPY con PostgreSQL + psycopg2, ORM en el resto), 'copy' u 'orm'
+EXCEL_BULK_MODE = os.getenv("EXCEL_BULK_MODE", "auto").lower()
+
 def clean_document_value(val):
     """
     Limpia y normaliza documentos de identidad (DNI, CNV, RN, Pasaporte, etc.)
@@ -94,364 +109,485 @@ def normalize_status(text):
     # Por defecto
     return "pendiente"
 
-def get_mapped_dataframe(file_content: bytes, nrows=None):
-    """Función auxiliar para obtener el DataFrame mapeado y limpio de todas las hojas válidas"""
-    xls = pd.ExcelFile(io.BytesIO(file_content))
-    all_dfs = []
-    
-    trigger_words = ['DNI', 'DOCUMENTO', 'NOMBRES', 'PACIENTE', 'NIÑO', 'NIÑOS', 'APELLIDOS', 'IDENTIDAD']
-    
+# Versiones por columna: misma salida que las funciones de arriba, evaluadas una vez por valor distinto
+def clean_document_series(values):
+    return map_unique_text(values, clean_document_value, none_or_nan_mask(values), None)
+
+def normalize_text_series(values):
+    return map_unique_text(values, normalize_text, falsy_or_na_mask(values), "")
+
+def normalize_eess_series(values):
+    return map_unique_text(values, normalize_eess_name, falsy_or_na_mask(values), None)
+
+def normalize_status_series(values):
+    return map_unique_text(values, normalize_status, falsy_or_na_mask(values), "pendiente")
+
+# Palabras que delatan una fila de cabecera dentro de las primeras filas de cada hoja
+TRIGGER_WORDS = ['DNI', 'DOCUMENTO', 'NOMBRES', 'PACIENTE', 'NIÑO', 'NIÑOS', 'APELLIDOS', 'IDENTIDAD']
+HEADER_KEYWORDS = ['DNI', 'NOMBRE', 'DOCUMENTO', 'APELLIDO']
+HEADER_SCAN_ROWS = 30
+
+# Tamaño de bloque (filas) para la lectura en streaming del Excel
+EXCEL_CHUNK_ROWS = int(os.getenv("EXCEL_CHUNK_ROWS", 5000))
+
+# Valores que pandas interpreta como vacíos al leer un Excel (se replican en la lectura en streaming)
+NA_STRINGS = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+])
+
+COLUMN_ALIASES = [
+    ('dni_madre', ['DNI MADRE', 'DNI DE LA MADRE', 'DOCUMENTO MADRE', 'DNI MAD']),
+    ('nombre_madre', ['NOMBRE MADRE', 'NOMBRE DE LA MADRE', 'NOMBRES MADRE', 'NOMBRE DE MADRE']),
+    ('celular_madre', ['CELULAR DE LA MADRE', 'CELULAR MADRE', 'TELEFONO MADRE', 'CELULAR MAD']),
+    ('actor_social', ['ACTOR SOCIAL', 'PROMOTOR', 'ACTOR_SOCIAL', 'NOMBRES DEL ACTOR SOCIAL']),
+    ('dni_nino', ['DOCUMENTO DEL NIÑO', 'DOCUMENTO DEL NINO', 'DNI NIÑO', 'DNI NINO', 'DNI', 'IDENTIDAD', 'DOC', 'NUMERO DE DOCUMENTO', 'Nro Documento', 'DOCUMENTO']),
+    ('nombres', ['NOMBRE DEL NIÑO', 'NOMBRE DEL NINO', 'NOMBRE', 'NOMBRES', 'PACIENTE', 'NIÑO', 'NIÑA', 'NOMBRES COMPLETOS', 'NOMBRE NIÑO', 'NOMBRE NIÑA']),
+    ('fecha_nacimiento', ['FECHA DE NACIMIENTO', 'NACIMIENTO', 'F. NAC', 'FECHA NAC', 'F_NACIMIENTO', 'F.NACIMIENTO', 'FEC.NAC']),
+    ('direccion', ['DIRECCION', 'DOMICILIO', 'DIRECCIÓN', 'ZONA', 'MANZANA', 'SECTOR', 'DIRECCION']),
+    ('establecimiento_asignado', ['EESS', 'ESTABLECIMIENTO', 'CENTRO DE SALUD', 'SALUD', 'ESTABLECIMIENTO_ASIGNADO', 'IPRESS', 'ESTABLECIMIENTO DE SALUD', 'E.E.S.S']),
+    ('historia_clinica', ['HISTORIA', 'H.C.', 'EXPEDIENTE', 'HC', 'HISTORIA CLINICA']),
+    ('estado', ['ESTADO', 'ESTADO VISITA', 'CONDICION', 'SITUACION', 'ESTADO DEL MES']),
+    ('observacion', ['OBSERVACION', 'OBSERVACIÓN', 'OBSERVACIONES', 'MOTIVO', 'COMENTARIO', 'OBS', 'OBSER']),
+    ('rango_edad', ['RANGO DE EDAD', 'EDAD', 'ETAPA DE VIDA', 'RANGO_EDAD']),
+    ('nro_visitas', ['NRO VISITA', 'NUMERO DE VISITA', 'VISITA', 'NRO_VISITA', 'TOTAL VISITAS', 'NUMERO DE VISITAS', 'VISITAS']),
+    ('establecimiento_atencion', ['ESTABLECIMIENTO DE ATENCION', 'EESS ATENCION', 'EESS DONDE SE ATIENDE', 'DONDE SE ATIENDE', 'LUGAR DE ATENCION'])
+]
+
+def is_header_row(values):
+    """Indica si una fila (lista de celdas) parece la cabecera de una hoja de datos"""
+    row_text = " ".join([str(val).strip().upper() for val in values if pd.notna(val)])
+    if any(word in row_text for word in TRIGGER_WORDS):
+        if sum(1 for word in HEADER_KEYWORDS if word in row_text) >= 1:
+            return True
+    return False
+
+def map_columns(columns):
+    """Asocia los nombres de columna de una hoja con los nombres estándar del sistema"""
+    mapping = {}
+    used_cols = set()
+    columns_norm = [normalize_text(col) for col in columns]
+
+    # 1. Primero intentar coincidencias exactas para mayor precisión
+    for std_name, aliases in COLUMN_ALIASES:
+        aliases_norm = [normalize_text(a) for a in aliases]
+        for idx, col in enumerate(columns):
+            if idx in used_cols: continue
+            if columns_norm[idx] in aliases_norm:
+                mapping[col] = std_name
+                used_cols.add(idx)
+                break
+
+    # 2. Luego coincidencias parciales más inteligentes
+    for std_name, aliases in COLUMN_ALIASES:
+        if std_name in mapping.values(): continue
+
+        for idx, col in enumerate(columns):
+            if idx in used_cols: continue
+            col_norm = columns_norm[idx]
+
+            for a in aliases:
+                a_norm = normalize_text(a)
+                if len(a_norm) <= 4:
+                    is_match = a_norm == col_norm or f" {a_norm} " in f" {col_norm} " or col_norm.startswith(f"{a_norm} ") or col_norm.endswith(f" {a_norm}")
+                else:
+                    is_match = a_norm in col_norm
+
+                if is_match:
+                    if std_name in ['dni_nino', 'nombres'] and any(x in col_norm for x in ['MADRE', 'ACTOR', 'PADRE']):
+                        continue
+                    if std_name == 'nro_visitas' and any(x in col_norm for x in ['FECHA', 'ESTADO', 'DNI', 'MADRE']):
+                        continue
+
+                    mapping[col] = std_name
+                    used_cols.add(idx)
+                    break
+            if idx in used_cols: break
+
+    return mapping
+
+def _header_names(values):
+    """Nombres de columna a partir de la fila de cabecera (mismo criterio que pandas: 'Unnamed: n' y sufijos .1, .2)"""
+    names = []
+    seen = {}
+    for idx, val in enumerate(values):
+        name = f"Unnamed: {idx}" if val is None or (isinstance(val, str) and val.strip() == "") else val
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def _convert_cell(val):
+    """Conversión de celdas equivalente a la de pandas (enteros exactos, vacíos como NaN)"""
+    if val is None:
+        return None
+    if isinstance(val, float):
+        if val.is_integer():
+            return int(val)
+        return val
+    if isinstance(val, str) and val in NA_STRINGS:
+        return None
+    return val
+
+def _open_source(source):
+    """Devuelve un objeto tipo archivo posicionado al inicio a partir de bytes, ruta o archivo"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if isinstance(source, (str, os.PathLike)):
+        return open(source, "rb")
+    source.seek(0)
+    return source
+
+def _iter_sheet_chunks_openpyxl(ws, chunk_size, nrows):
+    """Recorre una hoja una sola vez: detecta la cabecera, mapea columnas y produce bloques"""
+    ws.reset_dimensions()
+    rows = ws.iter_rows(values_only=True)
+
+    header = None
+    for i, row in enumerate(rows):
+        if i >= HEADER_SCAN_ROWS:
+            return
+        if row and is_header_row([_convert_cell(v) for v in row]):
+            header = row
+            break
+    if header is None:
+        return
+
+    columns = _header_names([_convert_cell(v) for v in header])
+    mapping = map_columns(columns)
+    if not mapping:
+        return
+
+    # Solo se conservan las columnas mapeadas (en el orden de la hoja)
+    positions = [idx for idx, col in enumerate(columns) if col in mapping]
+    names = [mapping[columns[idx]] for idx in positions]
+
+    buffer = []
+    emitted = 0
+    for row in rows:
+        values = [_convert_cell(row[idx]) if idx < len(row) else None for idx in positions]
+        if all(v is None for v in values):
+            # Filas sin datos en las columnas mapeadas: no aportan registros
+            continue
+        buffer.append(values)
+        emitted += 1
+        if nrows is not None and emitted >= nrows:
+            break
+        if len(buffer) >= chunk_size:
+            yield pd.DataFrame.from_records(buffer, columns=names)
+            buffer = []
+
+    if buffer:
+        yield pd.DataFrame.from_records(buffer, columns=names)
+
+def _iter_mapped_chunks_pandas(fileobj, nrows=None):
+    """Ruta de respaldo para formatos que openpyxl no lee (.xls): lectura completa con pandas"""
+    xls = pd.ExcelFile(fileobj)
     for sheet_name in xls.sheet_names:
-        # Mini lectura para detectar si es una hoja de datos
-        df_detect = pd.read_excel(xls, sheet_name=sheet_name, header=None, nrows=30)
-        
+        df_detect = pd.read_excel(xls, sheet_name=sheet_name, header=None, nrows=HEADER_SCAN_ROWS)
+
         header_row = None
         for i in range(len(df_detect)):
-            row_text = " ".join([str(val).strip().upper() for val in df_detect.iloc[i] if pd.notna(val)])
-            if any(word in row_text for word in trigger_words):
-                if sum(1 for word in ['DNI', 'NOMBRE', 'DOCUMENTO', 'APELLIDO'] if word in row_text) >= 1:
-                    header_row = i
-                    break
-        
+            if is_header_row(list(df_detect.iloc[i])):
+                header_row = i
+                break
+
         if header_row is not None:
             df_sheet = pd.read_excel(xls, sheet_name=sheet_name, header=header_row, nrows=nrows)
-            
-            # Aplicar mapeo de columnas similar al anterior
-            alias_config = [
-                ('dni_madre', ['DNI MADRE', 'DNI DE LA MADRE', 'DOCUMENTO MADRE', 'DNI MAD']),
-                ('nombre_madre', ['NOMBRE MADRE', 'NOMBRE DE LA MADRE', 'NOMBRES MADRE', 'NOMBRE DE MADRE']),
-                ('celular_madre', ['CELULAR DE LA MADRE', 'CELULAR MADRE', 'TELEFONO MADRE', 'CELULAR MAD']),
-                ('actor_social', ['ACTOR SOCIAL', 'PROMOTOR', 'ACTOR_SOCIAL', 'NOMBRES DEL ACTOR SOCIAL']),
-                ('dni_nino', ['DOCUMENTO DEL NIÑO', 'DOCUMENTO DEL NINO', 'DNI NIÑO', 'DNI NINO', 'DNI', 'IDENTIDAD', 'DOC', 'NUMERO DE DOCUMENTO', 'Nro Documento', 'DOCUMENTO']),
-                ('nombres', ['NOMBRE DEL NIÑO', 'NOMBRE DEL NINO', 'NOMBRE', 'NOMBRES', 'PACIENTE', 'NIÑO', 'NIÑA', 'NOMBRES COMPLETOS', 'NOMBRE NIÑO', 'NOMBRE NIÑA']),
-                ('fecha_nacimiento', ['FECHA DE NACIMIENTO', 'NACIMIENTO', 'F. NAC', 'FECHA NAC', 'F_NACIMIENTO', 'F.NACIMIENTO', 'FEC.NAC']),
-                ('direccion', ['DIRECCION', 'DOMICILIO', 'DIRECCIÓN', 'ZONA', 'MANZANA', 'SECTOR', 'DIRECCION']),
-                ('establecimiento_asignado', ['EESS', 'ESTABLECIMIENTO', 'CENTRO DE SALUD', 'SALUD', 'ESTABLECIMIENTO_ASIGNADO', 'IPRESS', 'ESTABLECIMIENTO DE SALUD', 'E.E.S.S']),
-                ('historia_clinica', ['HISTORIA', 'H.C.', 'EXPEDIENTE', 'HC', 'HISTORIA CLINICA']),
-                ('estado', ['ESTADO', 'ESTADO VISITA', 'CONDICION', 'SITUACION', 'ESTADO DEL MES']),
-                ('observacion', ['OBSERVACION', 'OBSERVACIÓN', 'OBSERVACIONES', 'MOTIVO', 'COMENTARIO', 'OBS', 'OBSER']),
-                ('rango_edad', ['RANGO DE EDAD', 'EDAD', 'ETAPA DE VIDA', 'RANGO_EDAD']),
-                ('nro_visitas', ['NRO VISITA', 'NUMERO DE VISITA', 'VISITA', 'NRO_VISITA', 'TOTAL VISITAS', 'NUMERO DE VISITAS', 'VISITAS']),
-                ('establecimiento_atencion', ['ESTABLECIMIENTO DE ATENCION', 'EESS ATENCION', 'EESS DONDE SE ATIENDE', 'DONDE SE ATIENDE', 'LUGAR DE ATENCION'])
-            ]
-            
-            # Aplicar mapeo de columnas más inteligente
-            mapping = {}
-            used_cols = set()
-            
-            # 1. Primero intentar coincidencias exactas para mayor precisión
-            for std_name, aliases in alias_config:
-                for idx, col in enumerate(df_sheet.columns):
-                    if idx in used_cols: continue
-                    col_norm = normalize_text(col)
-                    if any(normalize_text(a) == col_norm for a in aliases):
-                        mapping[col] = std_name
-                        used_cols.add(idx)
-                        break
-            
-            # 2. Luego coincidencias parciales más inteligentes
-            for std_name, aliases in alias_config:
-                if std_name in [m for m in mapping.values()]: continue
-                
-                for idx, col in enumerate(df_sheet.columns):
-                    if idx in used_cols: continue
-                    col_norm = normalize_text(col)
-                    
-                    for a in aliases:
-                        a_norm = normalize_text(a)
-                        if len(a_norm) <= 4:
-                            is_match = a_norm == col_norm or f" {a_norm} " in f" {col_norm} " or col_norm.startswith(f"{a_norm} ") or col_norm.endswith(f" {a_norm}")
-                        else:
-                            is_match = a_norm in col_norm
-                            
-                        if is_match:
-                            if std_name in ['dni_nino', 'nombres'] and any(x in col_norm for x in ['MADRE', 'ACTOR', 'PADRE']): 
-                                continue
-                            if std_name == 'nro_visitas' and any(x in col_norm for x in ['FECHA', 'ESTADO', 'DNI', 'MADRE']):
-                                continue
-                                
-                            mapping[col] = std_name
-                            used_cols.add(idx)
-                            break
-                    if idx in used_cols: break
-            
+            mapping = map_columns(list(df_sheet.columns))
             if mapping:
                 df_sheet = df_sheet.rename(columns=mapping)
-                final_cols = [c for c in df_sheet.columns if c in mapping.values()]
-                df_sheet = df_sheet[final_cols]
-                all_dfs.append(df_sheet)
+                yield df_sheet[[c for c in df_sheet.columns if c in mapping.values()]]
 
-                
-        # Si es preview y ya tenemos algo, paramos para velocidad
-        if nrows and all_dfs: break
+def iter_mapped_chunks(source, chunk_size: int = EXCEL_CHUNK_ROWS, nrows=None):
+    """
+    Lee el Excel en streaming (openpyxl en modo solo lectura) y produce DataFrames mapeados
+    por bloques de `chunk_size` filas, recorriendo cada hoja una única vez.
+    `source` puede ser bytes, una ruta o un archivo abierto en modo binario.
+    """
+    fileobj = _open_source(source)
+    try:
+        if not zipfile.is_zipfile(fileobj):
+            fileobj.seek(0)
+            yield from _iter_mapped_chunks_pandas(fileobj, nrows=nrows)
+            return
+
+        fileobj.seek(0)
+        wb = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+        try:
+            for ws in wb.worksheets:
+                found = False
+                for chunk in _iter_sheet_chunks_openpyxl(ws, chunk_size, nrows):
+                    found = True
+                    yield chunk
+                # Si es preview y ya tenemos algo, paramos para velocidad
+                if nrows and found: break
+        finally:
+            wb.close()
+    finally:
+        if fileobj is not source:
+            fileobj.close()
 
+def get_mapped_dataframe(file_content, nrows=None):
+    """Función auxiliar para obtener el DataFrame mapeado y limpio de todas las hojas válidas"""
+    all_dfs = list(iter_mapped_chunks(file_content, nrows=nrows))
     if not all_dfs:
         return pd.DataFrame()
-        
+
     return pd.concat(all_dfs, ignore_index=True)
 
-def get_excel_preview(file_content: bytes):
+# Etapas de una carga y el porcentaje de avance con el que se reportan
+PROGRESS_STAGES = {
+    'lectura': 10, 'mapeo': 30, 'limpieza': 45, 'precarga': 60, 'escritura': 75, 'commit': 95
+}
+
+def report_progress(on_progress, etapa: str, filas: int):
+    """Notifica el avance (etapa, porcentaje, filas) sin que un fallo del callback detenga la carga"""
+    if on_progress is None:
+        return
     try:
-        # Cargamos todo el contenido para la vista previa según petición del usuario
-        df_preview = get_mapped_dataframe(file_content)
-        
-        unique_children = {}
-        
-        for _, row in df_preview.iterrows():
-            dni_val = row.get('dni_nino')
-            hc_val = row.get('historia_clinica')
-            
-            if (pd.isna(dni_val) or str(dni_val).strip() == ""):
-                if pd.notna(hc_val) and str(hc_val).strip() != "":
-                    dni = f"HC-{str(hc_val).strip()}"
-                else: continue
-            else:
-                dni = clean_document_value(dni_val)
-                if not dni: continue
-            
-            if dni in unique_children: continue
-
-            fecha_nac = '---'
-            if pd.notna(row.get('fecha_nacimiento')):
-                try:
-                    fecha_val = row.get('fecha_nacimiento')
-                    if isinstance(fecha_val, (int, float)):
-                        fecha_nac = pd.to_datetime(fecha_val, origin='1899-12-30', unit='D').strftime('%d/%m/%Y')
-                    else:
-                        fecha_nac = pd.to_datetime(str(fecha_val), dayfirst=True, errors='coerce').strftime('%d/%m/%Y')
-                except: pass
-
-            unique_children[dni] = {
-                'dni_nino': dni,
-                'nombres': str(row.get('nombres', 'SIN NOMBRE')).strip().upper()[:100],
-                'fecha_nacimiento': fecha_nac,
-                'direccion': str(row.get('direccion', ''))[:100] if pd.notna(row.get('direccion')) else '',
-                'dni_madre': str(row.get('dni_madre', ''))[:15] if pd.notna(row.get('dni_madre')) else '',
-                'nombre_madre': str(row.get('nombre_madre', ''))[:100] if pd.notna(row.get('nombre_madre')) else '',
-                'celular_madre': str(row.get('celular_madre', ''))[:15] if pd.notna(row.get('celular_madre')) else '',
-                'actor_social': str(row.get('actor_social', ''))[:50] if pd.notna(row.get('actor_social')) else '',
-                'establecimiento_asignado': normalize_eess_name(row.get('establecimiento_asignado'))[:50] if pd.notna(row.get('establecimiento_asignado')) else '',
-                'historia_clinica': str(row.get('historia_clinica', ''))[:50] if pd.notna(row.get('historia_clinica')) else '',
-                'rango_edad': str(row.get('rango_edad', ''))[:50] if pd.notna(row.get('rango_edad')) else '',
-                'estado': normalize_status(row.get('estado')).upper(),
-                'observacion': str(row.get('observacion', ''))[:150] if pd.notna(row.get('observacion')) else '',
-                'establecimiento_atencion': normalize_eess_name(row.get('establecimiento_atencion'))[:100] if pd.notna(row.get('establecimiento_atencion')) else ''
-            }
-        return list(unique_children.values())
+        on_progress(etapa, PROGRESS_STAGES[etapa], int(filas))
     except Exception as e:
-        print(f"Error en vista previa: {e}")
-        return []
+        logger.warning(f"No se pudo reportar el avance ({etapa}): {e}")
+
+def load_parsed_workbook(file_content, on_progress=None, key: str = None) -> ParsedWorkbook:
+    """
+    Devuelve los bloques mapeados del Excel, reutilizando la caché por hash si ya fue parseado.
+    `file_content` puede ser bytes, una ruta o un archivo abierto; `key` es su hash si ya se calculó.
+    """
+    key = key or file_hash(file_content)
+    entry = parse_cache.get(key)
+    if entry is not None:
+        logger.info(f"Excel {key[:12]} servido desde caché (sin re-parsear)")
+        report_progress(on_progress, 'mapeo', sum(len(c) for c in entry.mapped_chunks))
+        return entry
+
+    chunks = []
+    filas = 0
+    for chunk in iter_mapped_chunks(file_content):
+        chunks.append(chunk)
+        filas += len(chunk)
+        report_progress(on_progress, 'lectura', filas)
+    report_progress(on_progress, 'mapeo', filas)
+
+    entry = ParsedWorkbook(key, chunks)
+    parse_cache.put(key, entry)
+    return entry
+
+def get_cleaned_dataframe(entry: ParsedWorkbook, on_progress=None):
+    """DataFrame limpio (sin filtro de EESS) de un Excel parseado; se calcula una vez y se cachea"""
+    if entry.cleaned is None:
+        cleaned_chunks = [c for c in (clean_minsa_chunk(chunk.copy()) for chunk in entry.mapped_chunks) if not c.empty]
+        entry.cleaned = pd.concat(cleaned_chunks, ignore_index=True) if cleaned_chunks else pd.DataFrame()
+        # Re-contabilizar la memoria de la entrada ahora que incluye el DataFrame limpio
+        parse_cache.put(entry.key, entry)
+    report_progress(on_progress, 'limpieza', len(entry.cleaned))
+    return entry.cleaned
+
+def preview_rows(entry: ParsedWorkbook):
+    # Recorremos todo el contenido para la vista previa según petición del usuario,
+    # bloque a bloque para no materializar la hoja completa
+    unique_children = {}
+    for df_preview in entry.mapped_chunks:
+        _collect_preview_rows(df_preview, unique_children)
+    return list(unique_children.values())
+
+def get_excel_preview(file_content, key: str = None):
+    """Vista previa de un Excel; InvalidExcelError si el archivo no se puede leer"""
+    try:
+        entry = load_parsed_workbook(file_content, key=key)
+    except Exception as e:
+        logger.exception("Error leyendo el Excel de la vista previa")
+        raise InvalidExcelError(str(e)) from e
+    return preview_rows(entry)
+
+def parse_excel_preview(path: str, key: str):
+    """
+    Parseo y vista previa de un Excel en disco, para el pool de procesos (utils/executors.py).
+    Devuelve (registros, ParsedWorkbook): quien llama guarda el parseo en su propia caché.
+    Un archivo ilegible lanza InvalidExcelError; cualquier otra excepción es un fallo interno.
+    """
+    try:
+        entry = ParsedWorkbook(key, list(iter_mapped_chunks(path)))
+    except Exception as e:
+        logger.exception("Error leyendo el Excel de la vista previa")
+        raise InvalidExcelError(str(e)) from e
+    return preview_rows(entry), entry
+
+def parse_birth_dates(values):
+    """
+    Convierte la columna de fecha de nacimiento a Timestamps (NaT si no se puede).
+    Los números se interpretan como fecha serial de Excel y el texto como día/mes/año.
+    Se parsea una sola vez cada valor distinto.
+    """
+    s = values.astype(object)
+    parsed = {}
+    for val in pd.unique(s[s.notna()]):
+        try:
+            if isinstance(val, (int, float)):
+                parsed[val] = pd.to_datetime(val, origin='1899-12-30', unit='D')
+            else:
+                parsed[val] = pd.to_datetime(str(val), dayfirst=True, errors='coerce')
+        except Exception:
+            parsed[val] = pd.NaT
+    return s.map(lambda v: parsed.get(v, pd.NaT) if pd.notna(v) else pd.NaT)
+
+def _preview_text(df, col, length):
+    """Texto recortado para la vista previa ('' si la celda está vacía o la columna no existe)"""
+    if col not in df.columns:
+        return pd.Series('', index=df.index, dtype=object)
+    values = df[col]
+    return values.astype(object).astype(str).str.slice(0, length).where(values.notna(), '')
+
+def _collect_preview_rows(df_preview, unique_children):
+    """Agrega al diccionario los niños únicos de un bloque del Excel"""
+    df = df_preview.copy()
+    for col in ['dni_nino', 'historia_clinica', 'nombres', 'fecha_nacimiento', 'establecimiento_asignado',
+                'estado', 'establecimiento_atencion']:
+        if col not in df.columns:
+            df[col] = None
 
-def process_minsa_excel(file_content: bytes, db: Session, mes: int, anio: int, user_id: int, eess_filter: str = None):
+    # Clave del niño: documento limpio o, si la celda está vacía, la historia clínica
+    dni_raw = df['dni_nino']
+    dni_blank = dni_raw.isna() | (dni_raw.astype(object).astype(str).str.strip() == "")
+    hc = df['historia_clinica']
+    hc_txt = hc.astype(object).astype(str).str.strip()
+    hc_key = ("HC-" + hc_txt).where(hc.notna() & (hc_txt != ""), None)
+    key = clean_document_series(dni_raw).where(~dni_blank, hc_key)
+    df['dni_key'] = key
+    df = df[key.notna() & (key != "")].drop_duplicates(subset='dni_key', keep='first')
+    df = df[~df['dni_key'].isin(unique_children.keys())]
+    if df.empty:
+        return
+
+    fechas = parse_birth_dates(df['fecha_nacimiento'])
+    eess_asignado = normalize_eess_series(df['establecimiento_asignado']).fillna('').str.slice(0, 50)
+    eess_atencion = normalize_eess_series(df['establecimiento_atencion']).fillna('').str.slice(0, 100)
+    preview = pd.DataFrame({
+        'dni_nino': df['dni_key'],
+        'nombres': df['nombres'].astype(object).astype(str).str.strip().str.upper().str.slice(0, 100).where(df['nombres'].notna(), 'SIN NOMBRE'),
+        'fecha_nacimiento': fechas.map(lambda f: f.strftime('%d/%m/%Y') if pd.notna(f) else '---'),
+        'direccion': _preview_text(df, 'direccion', 100),
+        'dni_madre': _preview_text(df, 'dni_madre', 15),
+        'nombre_madre': _preview_text(df, 'nombre_madre', 100),
+        'celular_madre': _preview_text(df, 'celular_madre', 15),
+        'actor_social': _preview_text(df, 'actor_social', 50),
+        'establecimiento_asignado': eess_asignado.where(df['establecimiento_asignado'].notna(), ''),
+        'historia_clinica': _preview_text(df, 'historia_clinica', 50),
+        'rango_edad': _preview_text(df, 'rango_edad', 50),
+        'estado': normalize_status_series(df['estado']).str.upper(),
+        'observacion': _preview_text(df, 'observacion', 150),
+        'establecimiento_atencion': eess_atencion.where(df['establecimiento_atencion'].notna(), '')
+    })
+    for record in preview.to_dict('records'):
+        unique_children[record['dni_nino']] = record
+
+def dni_final_series(df):
+    """DNI del niño limpio o, si no lo tiene, 'HC-<historia clínica>' (None si no hay ninguno)"""
+    dni = clean_document_series(df['dni_nino'])
+    hc_key = map_unique_text(
+        df['historia_clinica'], lambda t: f"HC-{t.strip()}" if t.strip() != "" else None,
+        df['historia_clinica'].isna().to_numpy(), None
+    )
+    return dni.where(dni.notna() & (dni != ""), hc_key)
+
+def clip_text_series(values, length, fill='', upper=False):
+    """fillna(fill).astype(str)[:length] (opcionalmente strip().upper()) evaluado por valor distinto"""
+    if upper:
+        func = lambda t: t.strip().upper()[:length]
+    else:
+        func = lambda t: t[:length]
+    return map_unique_text(values, func, values.isna().to_numpy(), func(fill) if fill is not None else None)
+
+def clean_minsa_chunk(df):
+    """Limpieza vectorizada de un bloque mapeado: garantiza columnas, calcula el DNI final y normaliza textos"""
+    if df.empty:
+        return df
+
+    # Garantizar que las columnas mínimas existen para evitar KeyErrors
+    expected_cols = [
+        'nombres', 'direccion', 'dni_madre', 'nombre_madre', 
+        'celular_madre', 'rango_edad', 'historia_clinica', 
+        'establecimiento_asignado', 'estado', 'observacion', 
+        'actor_social', 'establecimiento_atencion', 'dni_nino'
+    ]
+    for col in expected_cols:
+        if col not in df.columns:
+            df[col] = None
+
+    # Crear columna DNI final sobre la columna completa
+    df['dni_final'] = dni_final_series(df)
+    df = df.dropna(subset=['dni_final'])
+    
+    if df.empty:
+        return df
+
+    # Normalizaciones masivas de forma segura
+    df['nombres'] = clip_text_series(df['nombres'], 150, fill='SIN NOMBRE', upper=True)
+    df['direccion'] = clip_text_series(df['direccion'], 250)
+    df['dni_madre'] = clean_document_series(df['dni_madre']).str.slice(0, 15)
+    df['nombre_madre'] = clip_text_series(df['nombre_madre'], 150)
+    df['celular_madre'] = clean_document_series(df['celular_madre']).str.slice(0, 15)
+    df['rango_edad'] = clip_text_series(df['rango_edad'], 50)
+    df['historia_clinica'] = clip_text_series(df['historia_clinica'], 50)
+
+    # Columnas normalizadas que antes se calculaban fila a fila dentro del bucle por niño
+    df['eess_asignado_norm'] = normalize_eess_series(df['establecimiento_asignado'])
+    df['eess_atencion_norm'] = normalize_eess_series(df['establecimiento_atencion'])
+    df['estado_norm'] = normalize_status_series(df['estado'])
+    return df
+
+def process_minsa_excel(file_content, db: Session, mes: int, anio: int, user_id: int, eess_filter: str = None,
+                        on_progress=None):
+    """
+    Procesa el Excel del MINSA (bytes, ruta o archivo abierto) y registra niños y visitas del mes.
+    `on_progress(etapa, porcentaje, filas)` se llama al avanzar por cada etapa (ver PROGRESS_STAGES).
+    """
     try:
         print(f"--- Iniciando procesamiento Excel: {mes}/{anio} ---")
-        df = get_mapped_dataframe(file_content)
-        if df.empty:
-            return 0, 0, 0
-            
-        # 1. Limpieza Vectorizada y Garantía de Columnas
-        def clean_dni_val(val):
-            return clean_document_value(val)
-
-        # Garantizar que las columnas mínimas existen para evitar KeyErrors
-        expected_cols = [
-            'nombres', 'direccion', 'dni_madre', 'nombre_madre', 
-            'celular_madre', 'rango_edad', 'historia_clinica', 
-            'establecimiento_asignado', 'estado', 'observacion', 
-            'actor_social', 'establecimiento_atencion', 'dni_nino'
-        ]
-        for col in expected_cols:
-            if col not in df.columns:
-                df[col] = None
-
-        # Crear columna DNI final de forma eficiente
-        df['dni_final'] = df.apply(lambda r: clean_dni_val(r.get('dni_nino')) or 
-                                 (f"HC-{str(r.get('historia_clinica')).strip()}" if pd.notna(r.get('historia_clinica')) and str(r.get('historia_clinica')).strip() != "" else None), axis=1)
-        df = df.dropna(subset=['dni_final'])
-        
+        # 1. Lectura en streaming y limpieza por bloques (reutiliza la caché si el archivo ya pasó por la vista previa)
+        df = get_cleaned_dataframe(load_parsed_workbook(file_content, on_progress), on_progress)
         if df.empty:
             return 0, 0, 0
-
-        # Normalizaciones masivas de forma segura
-        df['nombres'] = df['nombres'].fillna('SIN NOMBRE').astype(str).str.strip().str.upper().str.slice(0, 150)
-        df['direccion'] = df['direccion'].fillna('').astype(str).str.slice(0, 250)
-        df['dni_madre'] = df['dni_madre'].apply(clean_dni_val).str.slice(0, 15)
-        df['nombre_madre'] = df['nombre_madre'].fillna('').astype(str).str.slice(0, 150)
-        df['celular_madre'] = df['celular_madre'].apply(clean_dni_val).str.slice(0, 15)
-        df['rango_edad'] = df['rango_edad'].fillna('').astype(str).str.slice(0, 50)
-        df['historia_clinica'] = df['historia_clinica'].fillna('').astype(str).str.slice(0, 50)
         
         # Aplicar filtro de EESS si existe
         if eess_filter:
-            df['establecimiento_normalizado'] = df['establecimiento_asignado'].apply(
-                lambda x: normalize_eess_name(x) if pd.notna(x) else None
-            )
             eess_filter_normalizado = normalize_eess_name(eess_filter)
-            df = df[df['establecimiento_normalizado'] == eess_filter_normalizado]
-            df = df.drop(columns=['establecimiento_normalizado'])
+            df = df[df['eess_asignado_norm'] == eess_filter_normalizado]
             
             if df.empty:
                 print(f"No se encontraron registros para el EESS: {eess_filter}")
                 return 0, 0, 0
         
-        # 2. Precargar Datos de la DB (Solo del usuario actual)
-        unique_dnis = df['dni_final'].unique().tolist()
-        existing_kids = {k.dni_nino: k for k in db.query(models.Nino).filter(models.Nino.dni_nino.in_(unique_dnis), models.Nino.user_id == user_id).all()}
-        
-        v_date = date(anio, mes, 1)
-        
-        # 3. Precargar Visitas existentes para los niños identificados (SOLO EN EL MES/AÑO)
-        # Esto evita el NameError y optimiza el proceso
-        existing_visits_list = db.query(models.Visita).filter(
-            models.Visita.nino_id.in_([k.id for k in existing_kids.values()]),
-            models.Visita.fecha_visita == v_date
-        ).all()
-        
-        # Organizar por nino_id para acceso rápido
-        existing_visits = {}
-        for ev in existing_visits_list:
-            if ev.nino_id not in existing_visits:
-                existing_visits[ev.nino_id] = []
-            existing_visits[ev.nino_id].append(ev)
-
-        # 4. Preparar estructuras para Bulk Operations
-        ninos_to_update = []
-        ninos_to_create = []
-        visitas_to_create = []
-        visitas_to_update = []
-        
-        # Estructura local para visitas de niños nuevos (evita fugas de estado global)
-        pending_visits_new_kids = []
+        # 2. Plan por niño (columnar): una fila por DNI con sus datos y las visitas que le corresponden
+        plan = build_visit_plan(df)
+        report_progress(on_progress, 'precarga', len(plan))
 
-        nuevos_ninos_cnt = 0
-        repetidos_ninos_cnt = 0
-        total_visitas_procesadas = 0
+        # 3. Escritura: COPY + merge por conjuntos en PostgreSQL, operaciones bulk del ORM en el resto
+        v_date = date(anio, mes, 1)
+        copy_mode = use_copy_mode(db)
+        # Bloqueo por usuario antes de escribir (ver resumen_service.lock_user): una edición
+        # concurrente espera a que termine la carga en vez de cruzarse con ella
+        lock_user(db, user_id)
+        if copy_mode:
+            total_visitas_procesadas, repetidos_ninos_cnt, nuevos_ninos_cnt = _merge_plan_copy(db, plan, v_date, user_id, on_progress)
+        else:
+            total_visitas_procesadas, repetidos_ninos_cnt, nuevos_ninos_cnt = _merge_plan_orm(db, plan, v_date, user_id, on_progress)
 
-        grouped = df.groupby('dni_final')
-        
-        for dni, group in grouped:
-            main_row = group.iloc[0]
-            db_nino = existing_kids.get(dni)
-            
-            nino_fields = {
-                'dni_nino': dni, 
-                'nombres': main_row.get('nombres', 'SIN NOMBRE'), 
-                'direccion': main_row.get('direccion', ''),
-                'dni_madre': main_row.get('dni_madre'), 
-                'nombre_madre': main_row.get('nombre_madre', ''),
-                'celular_madre': main_row.get('celular_madre'), 
-                'establecimiento_asignado': normalize_eess_name(main_row.get('establecimiento_asignado'))[:150] if pd.notna(main_row.get('establecimiento_asignado', None)) else None,
-                'historia_clinica': main_row.get('historia_clinica', ''), 
-                'rango_edad': main_row.get('rango_edad', ''),
-                'user_id': user_id
-            }
-            
-            if pd.notna(main_row.get('fecha_nacimiento')):
-                try:
-                    f_val = main_row['fecha_nacimiento']
-                    if isinstance(f_val, (int, float)): 
-                        nino_fields['fecha_nacimiento'] = pd.to_datetime(f_val, origin='1899-12-30', unit='D').date()
-                    else: 
-                        # Intentar parsear formato estándar día/mes/año primero
-                        nino_fields['fecha_nacimiento'] = pd.to_datetime(str(f_val), dayfirst=True, errors='coerce').date()
-                except: pass
-
-            if db_nino:
-                repetidos_ninos_cnt += 1
-                update_data = {'id': db_nino.id}
-                for k, v in nino_fields.items():
-                    if v and str(v).lower() not in ["", "nan", "none", "---"]:
-                        update_data[k] = v
-                ninos_to_update.append(update_data)
-                target_nino_id = db_nino.id
-            else:
-                nuevos_ninos_cnt += 1
-                # Guardamos fields para crear después
-                nino_to_create_obj = models.Nino(**nino_fields)
-                ninos_to_create.append(nino_to_create_obj)
-                target_nino_id = None 
-
-            # Lógica de Visitas
-            nro_v_max = len(group)
-            if 'nro_visitas' in group.columns:
-                try:
-                    v_col_max = int(pd.to_numeric(group['nro_visitas'], errors='coerce').max() or 1)
-                    nro_v_max = max(nro_v_max, v_col_max)
-                except: pass
-            
-            if nro_v_max > 10: nro_v_max = 1
-
-            estado_final = normalize_status(main_row.get('estado'))
-            obs_val = str(main_row.get('observacion'))[:500] if pd.notna(main_row.get('observacion')) else None
-            eess_at_val = normalize_eess_name(main_row.get('establecimiento_atencion'))[:150] if pd.notna(main_row.get('establecimiento_atencion')) else None
-            actor_val = str(main_row.get('actor_social'))[:150] if pd.notna(main_row.get('actor_social')) else None
-
-            # Si el niño ya existe, podemos preparar las visitas ahora
-            if target_nino_id:
-                v_est = existing_visits.get(target_nino_id, [])
-                for i in range(nro_v_max):
-                    v_data = {
-                        'nino_id': target_nino_id,
-                        'estado': estado_final,
-                        'observacion': obs_val,
-                        'fecha_visita': v_date,
-                        'establecimiento_atencion': eess_at_val,
-                        'actor_social': actor_val,
-                        'user_id': user_id
-                    }
-                    if i < len(v_est):
-                        v_data['id'] = v_est[i].id
-                        visitas_to_update.append(v_data)
-                    else:
-                        visitas_to_create.append(v_data)
-            else:
-                # Para niños nuevos, guardamos la info para procesar tras el flush
-                pending_visits_new_kids.append({
-                    'dni': dni,
-                    'nro_v_max': nro_v_max,
-                    'estado': estado_final,
-                    'obs': obs_val,
-                    'eess_at': eess_at_val,
-                    'actor': actor_val
-                })
-
-            total_visitas_procesadas += nro_v_max
-
-        # 5. Ejecutar Bulk Operations en orden
-        if ninos_to_update:
-            db.bulk_update_mappings(models.Nino, ninos_to_update)
-        
-        if ninos_to_create:
-            for nino_obj in ninos_to_create:
-                db.add(nino_obj)
-            db.flush() # Genera IDs para los nuevos niños
-            
-            # Ahora procesar visitas pendientes de niños nuevos
-            # Mapeamos los DNIs a los nuevos IDs generados
-            new_kids_map = {k.dni_nino: k.id for k in ninos_to_create}
-            
-            for p in pending_visits_new_kids:
-                kid_id = new_kids_map.get(p['dni'])
-                if kid_id:
-                    for _ in range(p['nro_v_max']):
-                        visitas_to_create.append({
-                            'nino_id': kid_id,
-                            'estado': p['estado'],
-                            'observacion': p['obs'],
-                            'fecha_visita': v_date,
-                            'establecimiento_atencion': p['eess_at'],
-                            'actor_social': p['actor'],
-                            'user_id': user_id
-                        })
-
-        if visitas_to_update:
-            db.bulk_update_mappings(models.Visita, visitas_to_update)
-        
-        if visitas_to_create:
-            db.bulk_insert_mappings(models.Visita, visitas_to_create)
+        # Totales del mes en resumen_mensual, resumen de visitas y columna de búsqueda de los niños
+        # cargados (misma transacción; la escritura bulk no dispara los eventos del ORM)
+        from .busqueda_service import refresh_busqueda
+        refresh_month(db, user_id, anio, mes)
+        refresh_ninos(db, user_id, fecha=v_date)
+        refresh_busqueda(db, user_id, fecha=v_date)
+        bump_version(db, user_id)
 
         print(f"--- Commit de {total_visitas_procesadas} registros finalizado ---")
         db.commit()
+        report_progress(on_progress, 'commit', total_visitas_procesadas)
         return total_visitas_procesadas, repetidos_ninos_cnt, nuevos_ninos_cnt
         
     except Exception as e:
@@ -461,39 +597,268 @@ def process_minsa_excel(file_content: bytes, db: Session, mes: int, anio: int, u
         db.rollback()
         raise e
 
-def process_excel_async(carga_id: int, file_content: bytes, mes: int, anio: int, user_id: int):
-    """Tarea de fondo para procesar el Excel sin bloquear el servidor"""
-    logger.info(f"Iniciando tarea asíncrona para carga {carga_id} (Mes: {mes}, Año: {anio})")
-    db = SessionLocal()
+def build_visit_plan(df):
+    """
+    Agrega el DataFrame limpio a una fila por niño (ordenada por DNI) con los campos del niño,
+    la fecha de nacimiento ya parseada, el número de visitas del mes y los datos de la visita.
+    Los datos se toman de la primera fila de cada DNI, igual que el antiguo bucle por grupo.
+    """
+    first = df.drop_duplicates(subset='dni_final', keep='first').set_index('dni_final').sort_index()
+
+    # Visitas: el máximo entre las filas del niño y la columna "nro visitas" (más de 10 se toma como 1)
+    filas = df.groupby('dni_final').size().reindex(first.index).to_numpy(dtype='int64')
+    nro_visitas = filas
+    if 'nro_visitas' in df.columns:
+        v_col_max = pd.to_numeric(df['nro_visitas'], errors='coerce').groupby(df['dni_final']).max()
+        v_col_max = v_col_max.reindex(first.index).to_numpy(dtype=float)
+        v_col_max[v_col_max == 0] = 1
+        valid = np.isfinite(v_col_max)
+        nro_visitas = np.where(valid, np.maximum(filas, np.trunc(np.where(valid, v_col_max, 0))), filas)
+    nro_visitas = np.where(nro_visitas > 10, 1, nro_visitas).astype('int64')
+
+    fechas = parse_birth_dates(first['fecha_nacimiento']) if 'fecha_nacimiento' in first.columns \
+        else pd.Series(pd.NaT, index=first.index)
+
+    def eess(norm_col, raw_col):
+        return first[norm_col].str.slice(0, 150).where(first[raw_col].notna(), None)
+
+    plan = pd.DataFrame({
+        'dni_nino': first.index,
+        'nombres': first['nombres'],
+        'direccion': first['direccion'],
+        'dni_madre': first['dni_madre'],
+        'nombre_madre': first['nombre_madre'],
+        'celular_madre': first['celular_madre'],
+        'establecimiento_asignado': eess('eess_asignado_norm', 'establecimiento_asignado'),
+        'historia_clinica': first['historia_clinica'],
+        'rango_edad': first['rango_edad'],
+        'fecha_nacimiento': fechas.map(lambda f: f.date() if pd.notna(f) else None).astype(object),
+        'nro_visitas': nro_visitas,
+        'estado': first['estado_norm'],
+        'observacion': clip_text_series(first['observacion'], 500, fill=None),
+        'establecimiento_atencion': eess('eess_atencion_norm', 'establecimiento_atencion'),
+        'actor_social': clip_text_series(first['actor_social'], 150, fill=None),
+    }).reset_index(drop=True)
+    return plan.astype(object).where(plan.notna(), None).astype({'nro_visitas': 'int64'})
+
+def use_copy_mode(db: Session) -> bool:
+    """
+    Decide si la carga usa COPY + tabla de staging. Requiere PostgreSQL con psycopg2
+    (cursor.copy_expert); EXCEL_BULK_MODE=copy con otro driver es un error de configuración.
+    """
+    if EXCEL_BULK_MODE not in ("auto", "copy", "orm"):
+        raise RuntimeError(f"EXCEL_BULK_MODE inválido: '{EXCEL_BULK_MODE}' (use auto, copy u orm)")
+    if EXCEL_BULK_MODE == "orm":
+        return False
+    dialect = db.get_bind().dialect
+    supports_copy = dialect.name == "postgresql" and dialect.driver == "psycopg2"
+    if EXCEL_BULK_MODE == "copy" and not supports_copy:
+        raise RuntimeError(
+            f"EXCEL_BULK_MODE=copy requiere PostgreSQL con psycopg2 (driver actual: {dialect.name}+{dialect.driver})"
+        )
+    return supports_copy
+
+# Campos del niño que se escriben en la tabla ninos (el resto del plan son datos de la visita)
+NINO_PLAN_COLUMNS = [
+    'dni_nino', 'nombres', 'direccion', 'dni_madre', 'nombre_madre', 'celular_madre',
+    'establecimiento_asignado', 'historia_clinica', 'rango_edad', 'fecha_nacimiento'
+]
+VISITA_PLAN_COLUMNS = ['estado', 'observacion', 'establecimiento_atencion', 'actor_social']
+
+def _keep_for_update(values):
+    """Máscara de valores que sí actualizan al niño existente (los vacíos conservan el dato actual)"""
+    lowered = values.map(lambda v: str(v).lower() if v else "")
+    return values.notna() & ~lowered.isin(["", "nan", "none", "---"])
+
+def _merge_plan_orm(db: Session, plan, v_date: date, user_id: int, on_progress=None):
+    """Escribe el plan con operaciones bulk del ORM. Devuelve (total_visitas, repetidos, nuevos)"""
+    # Precargar Datos de la DB (Solo del usuario actual): DNI -> id
+    unique_dnis = plan['dni_nino'].tolist()
+    existing_kids = pd.DataFrame(
+        db.query(models.Nino.dni_nino, models.Nino.id).filter(
+            models.Nino.dni_nino.in_(unique_dnis), models.Nino.user_id == user_id
+        ).all(),
+        columns=['dni_nino', 'nino_id']
+    )
+    plan = plan.merge(existing_kids, on='dni_nino', how='left')
+    is_existing = plan['nino_id'].notna()
+    repetidos_ninos_cnt = int(is_existing.sum())
+    nuevos_ninos_cnt = len(plan) - repetidos_ninos_cnt
+    total_visitas_procesadas = int(plan['nro_visitas'].sum())
+    report_progress(on_progress, 'escritura', total_visitas_procesadas)
+
+    # Niños existentes: solo se actualizan los campos que vienen con dato
+    existentes = plan[is_existing]
+    if not existentes.empty:
+        fields = pd.concat([existentes[NINO_PLAN_COLUMNS], pd.Series(user_id, index=existentes.index, name='user_id')], axis=1)
+        fields = fields.astype(object).where(fields.apply(_keep_for_update), None)
+        fields.insert(0, 'id', existentes['nino_id'].astype('int64'))
+        ninos_to_update = [
+            {k: v for k, v in row.items() if v is not None}
+            for row in fields.to_dict('records')
+        ]
+        db.bulk_update_mappings(models.Nino, ninos_to_update)
+
+    # Niños nuevos: un solo INSERT ... RETURNING para conocer sus ids
+    nuevos = plan[~is_existing]
+    if not nuevos.empty:
+        records = nuevos[NINO_PLAN_COLUMNS].assign(user_id=user_id).to_dict('records')
+        returned = db.execute(
+            insert(models.Nino).returning(models.Nino.dni_nino, models.Nino.id, sort_by_parameter_order=True),
+            records
+        ).all()
+        new_ids = dict(returned)
+        plan.loc[~is_existing, 'nino_id'] = nuevos['dni_nino'].map(new_ids)
+    plan['nino_id'] = plan['nino_id'].astype('int64')
+
+    # Visitas del plan: nro_visitas filas por niño numeradas 0..n-1
+    visitas = plan.loc[plan.index.repeat(plan['nro_visitas']), ['nino_id'] + VISITA_PLAN_COLUMNS].reset_index(drop=True)
+    visitas['rn'] = visitas.groupby('nino_id').cumcount()
+
+    # Visitas existentes del mes (SOLO de los niños ya registrados), emparejadas por orden de id
+    existing_ids = existentes['nino_id'].astype('int64').tolist()
+    actuales = pd.DataFrame(
+        db.query(models.Visita.id, models.Visita.nino_id).filter(
+            models.Visita.nino_id.in_(existing_ids),
+            models.Visita.fecha_visita == v_date
+        ).order_by(models.Visita.id).all() if existing_ids else [],
+        columns=['id', 'nino_id']
+    )
+    actuales['rn'] = actuales.groupby('nino_id').cumcount()
+    visitas = visitas.merge(actuales.astype({'nino_id': 'int64'}), on=['nino_id', 'rn'], how='left').drop(columns='rn')
+    visitas = visitas.astype(object).where(visitas.notna(), None)
+    visitas['fecha_visita'] = v_date
+    visitas['user_id'] = user_id
+
+    has_id = visitas['id'].notna()
+    visitas_to_update = visitas[has_id].astype({'id': 'int64'}).to_dict('records')
+    visitas_to_create = visitas[~has_id].drop(columns='id').sort_values('nino_id', kind='stable').to_dict('records')
+
+    if visitas_to_update:
+        db.bulk_update_mappings(models.Visita, visitas_to_update)
+    
+    if visitas_to_create:
+        db.bulk_insert_mappings(models.Visita, visitas_to_create)
+
+    return total_visitas_procesadas, repetidos_ninos_cnt, nuevos_ninos_cnt
+
+# Columnas de la tabla temporal de staging (mismo orden que el CSV enviado por COPY)
+STAGING_COLUMNS = [
+    'dni_nino', 'nombres', 'direccion', 'dni_madre', 'nombre_madre', 'celular_madre',
+    'establecimiento_asignado', 'historia_clinica', 'rango_edad', 'fecha_nacimiento',
+    'nro_visitas', 'estado', 'observacion', 'establecimiento_atencion', 'actor_social'
+]
+
+def _sql_keep_if_empty(col):
+    """Expresión SQL del merge: conserva el valor actual si el nuevo viene vacío (misma regla que la ruta ORM)"""
+    return (f"{col} = CASE WHEN EXCLUDED.{col} IS NULL OR lower(EXCLUDED.{col}) IN ('', 'nan', 'none', '---') "
+            f"THEN ninos.{col} ELSE EXCLUDED.{col} END")
+
+def _merge_plan_copy(db: Session, plan, v_date: date, user_id: int, on_progress=None):
+    """
+    Carga masiva para PostgreSQL: COPY del plan a una tabla temporal y merge por conjuntos
+    (INSERT ... ON CONFLICT para niños, UPDATE ... FROM / INSERT ... SELECT para visitas).
+    Devuelve (total_visitas, repetidos, nuevos) igual que la ruta ORM.
+    """
+    conn = db.connection()
+    conn.exec_driver_sql("""
+        CREATE TEMP TABLE stg_minsa (
+            dni_nino VARCHAR(50) PRIMARY KEY,
+            nombres VARCHAR(150),
+            direccion VARCHAR,
+            dni_madre VARCHAR(50),
+            nombre_madre VARCHAR(200),
+            celular_madre VARCHAR(50),
+            establecimiento_asignado VARCHAR(255),
+            historia_clinica VARCHAR(100),
+            rango_edad VARCHAR(100),
+            fecha_nacimiento DATE,
+            nro_visitas INTEGER NOT NULL,
+            estado VARCHAR(20),
+            observacion VARCHAR,
+            establecimiento_atencion VARCHAR(150),
+            actor_social VARCHAR(150)
+        ) ON COMMIT DROP
+    """)
+
+    staging = plan[STAGING_COLUMNS]
+    buffer = io.StringIO()
+    staging.to_csv(buffer, index=False, header=False, na_rep='\\N')
+    buffer.seek(0)
+
+    cursor = conn.connection.cursor()
     try:
-        # 1. Actualizar estado a 'procesando'
-        carga = db.query(models.CargaExcel).filter(models.CargaExcel.id == carga_id).first()
-        if not carga: 
-            logger.error(f"No se encontró el registro de carga {carga_id}")
-            return
-        
-        carga.estado = "procesando"
-        db.commit()
-        
-        # 2. Procesar el Excel
-        total_visitas, repetidos, nuevos = process_minsa_excel(file_content, db, mes, anio, user_id)
-        
-        # 3. Actualizar con resultados finales
-        carga.estado = "completado"
-        carga.total_registros = total_visitas
-        carga.total_repetidos = repetidos
-        db.commit()
-        logger.info(f"Carga {carga_id} completada exitosamente. Total visitas: {total_visitas}")
-        
-    except Exception as e:
-        logger.error(f"Error crítico en carga {carga_id}: {str(e)}")
-        traceback.print_exc()
-        db.rollback()
-        # Registrar el error en la carga
-        carga = db.query(models.CargaExcel).filter(models.CargaExcel.id == carga_id).first()
-        if carga:
-            carga.estado = "error"
-            carga.mensaje_error = f"Error en procesamiento: {str(e)[:450]}"
-            db.commit()
+        cursor.copy_expert(
+            f"COPY stg_minsa ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer
+        )
     finally:
-        db.close()
+        cursor.close()
+    conn.exec_driver_sql("ANALYZE stg_minsa")
+
+    params = {"uid": user_id, "fecha": v_date, "periodo": periodo_of(v_date), "ahora": datetime.now()}
+
+    repetidos = conn.execute(text("""
+        SELECT count(*) FROM stg_minsa s
+        JOIN ninos n ON n.dni_nino = s.dni_nino AND n.user_id = :uid
+    """), params).scalar() or 0
+    total_visitas = int(staging['nro_visitas'].sum())
+    report_progress(on_progress, 'escritura', total_visitas)
+
+    # Niños: alta de nuevos y actualización de existentes en una sola sentencia
+    updatable = ['nombres', 'direccion', 'dni_madre', 'nombre_madre', 'celular_madre',
+                 'establecimiento_asignado', 'historia_clinica', 'rango_edad']
+    conn.execute(text(f"""
+        INSERT INTO ninos (user_id, dni_nino, nombres, fecha_nacimiento, direccion, dni_madre, nombre_madre,
+                           celular_madre, rango_edad, historia_clinica, establecimiento_asignado, created_at, updated_at)
+        SELECT :uid, dni_nino, nombres, fecha_nacimiento, direccion, dni_madre, nombre_madre,
+               celular_madre, rango_edad, historia_clinica, establecimiento_asignado, :ahora, :ahora
+        FROM stg_minsa
+        ON CONFLICT ON CONSTRAINT _dni_user_uc DO UPDATE SET
+            {", ".join(_sql_keep_if_empty(c) for c in updatable)},
+            fecha_nacimiento = COALESCE(EXCLUDED.fecha_nacimiento, ninos.fecha_nacimiento),
+            updated_at = EXCLUDED.updated_at
+    """), params)
+
+    # Visitas del mes: se expanden nro_visitas filas por niño y se emparejan por orden con las existentes
+    plan_cte = """
+        plan AS (
+            SELECT n.id AS nino_id, g.rn, s.estado, s.observacion, s.establecimiento_atencion, s.actor_social
+            FROM stg_minsa s
+            JOIN ninos n ON n.dni_nino = s.dni_nino AND n.user_id = :uid
+            CROSS JOIN LATERAL generate_series(1, s.nro_visitas) AS g(rn)
+        )
+    """
+    conn.execute(text(f"""
+        WITH {plan_cte},
+        actuales AS (
+            SELECT v.id, v.nino_id, row_number() OVER (PARTITION BY v.nino_id ORDER BY v.id) AS rn
+            FROM visitas v
+            WHERE v.fecha_visita = :fecha AND v.nino_id IN (SELECT nino_id FROM plan)
+        )
+        UPDATE visitas v SET
+            estado = p.estado, observacion = p.observacion, establecimiento_atencion = p.establecimiento_atencion,
+            actor_social = p.actor_social, user_id = :uid, updated_at = :ahora
+        FROM actuales a
+        JOIN plan p ON p.nino_id = a.nino_id AND p.rn = a.rn
+        WHERE v.id = a.id
+    """), params)
+    conn.execute(text(f"""
+        WITH {plan_cte},
+        actuales AS (
+            SELECT v.nino_id, count(*) AS n
+            FROM visitas v
+            WHERE v.fecha_visita = :fecha AND v.nino_id IN (SELECT nino_id FROM plan)
+            GROUP BY v.nino_id
+        )
+        INSERT INTO visitas (nino_id, estado, observacion, fecha_visita, periodo, establecimiento_atencion,
+                             actor_social, user_id, created_at, updated_at)
+        SELECT p.nino_id, p.estado, p.observacion, :fecha, :periodo, p.establecimiento_atencion,
+               p.actor_social, :uid, :ahora, :ahora
+        FROM plan p
+        LEFT JOIN actuales a ON a.nino_id = p.nino_id
+        WHERE p.rn > COALESCE(a.n, 0)
+        ORDER BY p.nino_id, p.rn
+    """), params)
+
+    return total_visitas, repetidos, len(plan) - repetidos
@@ -0,0 +1,151 @@
+"""
+Exportación del reporte mensual a Excel en streaming.
+
+El reporte se agrega en SQL (una fila por niño), se lee por lotes (yield_per, cursor del
+lado del servidor en PostgreSQL) y se escribe fila por fila con xlsxwriter en modo
+constant_memory hacia un archivo temporal, así la memoria usada no depende del número
+de filas del reporte.
+"""
+import logging
+import os
+import tempfile
+import xlsxwriter
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from ..models import models
+from ..utils.periodo import month_filter, periodo_filter
+from .busqueda_service import search_condition
+
+logger = logging.getLogger("AlyAPI.Export")
+
+# Configuración leída desde .env
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+MAX_COLUMN_WIDTH = 50
+REPORT_SHEET_NAME = 'Reporte Filtrado'
+REPORT_HEADERS = [
+    "DNI Niño", "Nombres y Apellidos", "Fecha Nacimiento", "Rango de Edad", "Dirección",
+    "DNI Madre", "Nombre Madre", "Celular Madre", "Actor Social", "Historia Clinica",
+    "EESS Asignado", "EESS Atención", "Estado", "Visitas en el Mes"
+]
+
+def build_report_query(db: Session, anio: int, mes: int, user_id: int, search: str = None,
+                       eess: str = None, estado: str = None, solo_nuevos: bool = False):
+    """
+    Consulta del reporte: una fila por niño, ya agregada en SQL. Las visitas del periodo se
+    agrupan por niño (número de visitas y la última por id) y se unen con el niño y esa última
+    visita, de donde salen el estado, el actor social y el EESS de atención.
+    """
+    # 1. Visitas del periodo agrupadas por niño (índice idx_visita_user_periodo)
+    por_nino = db.query(
+        models.Visita.nino_id.label("nino_id"),
+        func.count(models.Visita.id).label("visitas_mes"),
+        func.max(models.Visita.id).label("ultima_id")
+    ).filter(
+        periodo_filter(models.Visita.periodo, anio, mes),
+        models.Visita.user_id == user_id
+    )
+    if estado:
+        por_nino = por_nino.filter(models.Visita.estado == estado.lower())
+    por_nino = por_nino.group_by(models.Visita.nino_id).subquery()
+
+    query = db.query(
+        models.Nino.dni_nino,
+        models.Nino.nombres,
+        models.Nino.fecha_nacimiento,
+        models.Nino.rango_edad,
+        models.Nino.direccion,
+        models.Nino.dni_madre,
+        models.Nino.nombre_madre,
+        models.Nino.celular_madre,
+        models.Visita.actor_social,
+        models.Nino.historia_clinica,
+        models.Nino.establecimiento_asignado,
+        models.Visita.establecimiento_atencion,
+        models.Visita.estado,
+        por_nino.c.visitas_mes
+    ).select_from(por_nino)\
+     .join(models.Nino, models.Nino.id == por_nino.c.nino_id)\
+     .join(models.Visita, models.Visita.id == por_nino.c.ultima_id)
+
+    # 2. Filtro de Niños Nuevos: su primera visita es de este mes (índice idx_nino_user_primera)
+    if solo_nuevos:
+        query = query.filter(
+            models.Nino.user_id == user_id,
+            month_filter(models.Nino.primera_visita, anio, mes)
+        )
+
+    # 3. Filtros sobre el niño (misma lógica que en el listado)
+    if search:
+        query = query.filter(search_condition(search))
+    if eess:
+        query = query.filter(models.Nino.establecimiento_asignado == eess)
+
+    return query.order_by(models.Nino.nombres, models.Nino.id)
+
+def iter_report_rows(query):
+    """Filas del reporte listas para escribir, leídas por lotes"""
+    for r in query.yield_per(EXPORT_BATCH_SIZE):
+        yield [
+            r.dni_nino,
+            r.nombres,
+            r.fecha_nacimiento.strftime('%d/%m/%Y') if r.fecha_nacimiento else '---',
+            r.rango_edad or '---',
+            r.direccion or '---',
+            r.dni_madre or '---',
+            r.nombre_madre or '---',
+            r.celular_madre or '---',
+            r.actor_social or '---',
+            r.historia_clinica or '---',
+            r.establecimiento_asignado or '---',
+            r.establecimiento_atencion or '---',
+            (r.estado or "pendiente").capitalize(),
+            r.visitas_mes
+        ]
+
+def write_report_xlsx(rows, path: str, headers: list = REPORT_HEADERS, sheet_name: str = REPORT_SHEET_NAME) -> int:
+    """Escribe las filas en `path` sin mantenerlas en memoria. Devuelve cuántas filas se escribieron"""
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    try:
+        worksheet = workbook.add_worksheet(sheet_name)
+        header_format = workbook.add_format({
+            'bold': True,
+            'bg_color': '#FCE7F3',
+            'border': 1
+        })
+        worksheet.write_row(0, 0, headers, header_format)
+
+        # Ancho de cada columna: máximo acumulado mientras se escriben las filas
+        widths = [len(h) for h in headers]
+        count = 0
+        write_string = worksheet.write_string
+        write_number = worksheet.write_number
+        for row in rows:
+            count += 1
+            for i, value in enumerate(row):
+                # Escritura directa según el tipo (evita la detección genérica de write())
+                if isinstance(value, str):
+                    write_string(count, i, value)
+                elif value is not None:
+                    write_number(count, i, value)
+                length = len(str(value))
+                if length > widths[i]:
+                    widths[i] = length
+
+        for col_num, width in enumerate(widths):
+            worksheet.set_column(col_num, col_num, min(width + 2, MAX_COLUMN_WIDTH))
+    finally:
+        workbook.close()
+    return count
+
+def export_report_to_tempfile(query) -> tuple:
+    """Genera el reporte en un archivo temporal. Devuelve (ruta, filas); quien llama borra el archivo"""
+    fd, path = tempfile.mkstemp(suffix=".xlsx", prefix="reporte_")
+    os.close(fd)
+    try:
+        count = write_report_xlsx(iter_report_rows(query), path)
+    except Exception:
+        os.remove(path)
+        raise
+    logger.info(f"Reporte exportado: {count} filas")
+    return path, count
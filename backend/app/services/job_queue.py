@@ -0,0 +1,464 @@
+"""
+Cola de cargas de Excel persistida en la tabla cargas_excel.
+
+/excel/upload guarda el archivo en disco (UPLOAD_SPOOL_DIR) y crea la carga en estado
+'pendiente'; un pool de procesos trabajadores la reclama con FOR UPDATE SKIP LOCKED y la
+procesa fuera del servidor web. Como todo el estado vive en la base de datos y en disco,
+las cargas pendientes sobreviven a un reinicio y las que quedaron a medias se re-encolan.
+
+La misma cola ejecuta la limpieza de niños sin visitas tras borrar un reporte mensual
+(tipo 'purga', enqueue_orphan_purge), con el mismo estado, avance y stream de eventos.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+import datetime
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+from ..database import SessionLocal
+from ..models import models
+from .excel_service import process_minsa_excel
+from . import read_cache
+
+logger = logging.getLogger("AlyAPI.Jobs")
+
+# Configuración leída desde .env
+EXCEL_WORKERS = int(os.getenv("EXCEL_WORKERS", 2))
+EXCEL_MAX_JOBS_PER_USER = int(os.getenv("EXCEL_MAX_JOBS_PER_USER", 1))
+EXCEL_JOB_POLL_SECONDS = float(os.getenv("EXCEL_JOB_POLL_SECONDS", 1.0))
+EXCEL_JOB_STALE_SECONDS = int(os.getenv("EXCEL_JOB_STALE_SECONDS", 300))
+EXCEL_JOB_MAX_ATTEMPTS = int(os.getenv("EXCEL_JOB_MAX_ATTEMPTS", 3))
+# Una carga sin avance durante este tiempo se marca como atascada en el historial
+EXCEL_JOB_STUCK_SECONDS = int(os.getenv("EXCEL_JOB_STUCK_SECONDS", 120))
+# Intervalo mínimo entre escrituras de avance de una misma etapa
+EXCEL_PROGRESS_MIN_INTERVAL = float(os.getenv("EXCEL_PROGRESS_MIN_INTERVAL", 0.5))
+# Directorio privado de la aplicación (0700) con los archivos de las cargas en cola
+UPLOAD_SPOOL_DIR = os.getenv(
+    "UPLOAD_SPOOL_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "spool")
+)
+
+# Estados de una carga
+PENDIENTE = "pendiente"
+PROCESANDO = "procesando"
+COMPLETADO = "completado"
+ERROR = "error"
+ACTIVE_STATES = (PENDIENTE, PROCESANDO)
+
+# Tipos de trabajo
+TIPO_EXCEL = "excel"
+TIPO_PURGA = "purga"
+
+# Espacio de nombres del advisory lock por usuario (PostgreSQL)
+_USER_LOCK_NAMESPACE = 42017
+
+def ensure_spool_dir() -> str:
+    """Crea UPLOAD_SPOOL_DIR solo accesible para este usuario y rechaza uno que pertenezca a otro"""
+    os.makedirs(UPLOAD_SPOOL_DIR, mode=0o700, exist_ok=True)
+    if hasattr(os, "getuid"):
+        info = os.stat(UPLOAD_SPOOL_DIR)
+        if info.st_uid != os.getuid():
+            raise RuntimeError(f"UPLOAD_SPOOL_DIR ({UPLOAD_SPOOL_DIR}) pertenece a otro usuario del sistema")
+        if info.st_mode & 0o077:
+            os.chmod(UPLOAD_SPOOL_DIR, 0o700)
+    return UPLOAD_SPOOL_DIR
+
+def new_spool_path(filename: str) -> str:
+    """Ruta única en UPLOAD_SPOOL_DIR donde se guarda el archivo de una carga"""
+    ensure_spool_dir()
+    extension = os.path.splitext(filename or "")[1].lower() or ".xlsx"
+    return os.path.join(UPLOAD_SPOOL_DIR, f"{uuid.uuid4().hex}{extension}")
+
+def enqueue_upload(db: Session, ruta: str, filename: str, mes: int, anio: int,
+                   user_id: int, eess_filter: str = None) -> models.CargaExcel:
+    """
+    Registra como pendiente la carga de un archivo ya guardado en `ruta` (ver new_spool_path).
+    El trabajador lee ese archivo original; el parseo de la vista previa solo se reutiliza si está
+    en la caché por hash de su propio proceso (nunca se deserializa nada desde el disco).
+    """
+    carga = models.CargaExcel(
+        nombre_archivo=filename,
+        mes=mes,
+        anio=anio,
+        total_registros=0,
+        total_repetidos=0,
+        total_nuevos=0,
+        user_id=user_id,
+        estado=PENDIENTE,
+        eess_filter=eess_filter,
+        ruta_archivo=ruta,
+        intentos=0,
+        etapa="en cola",
+        progreso=0,
+        filas_procesadas=0
+    )
+    db.add(carga)
+    read_cache.bump_version(db, user_id)
+    db.commit()
+    db.refresh(carga)
+    return carga
+
+def enqueue_orphan_purge(db: Session, user_id: int, anio: int, mes: int) -> models.CargaExcel:
+    """Encola la limpieza de niños sin visitas tras borrar el reporte de un mes. No hace commit."""
+    carga = models.CargaExcel(
+        tipo=TIPO_PURGA,
+        nombre_archivo=f"Limpieza de niños sin visitas ({mes}/{anio})",
+        mes=mes,
+        anio=anio,
+        total_registros=0,
+        total_repetidos=0,
+        total_nuevos=0,
+        user_id=user_id,
+        estado=PENDIENTE,
+        intentos=0,
+        etapa="en cola",
+        progreso=0,
+        filas_procesadas=0
+    )
+    db.add(carga)
+    db.flush()
+    return carga
+
+def _saturated_users(db: Session):
+    """Subconsulta de usuarios que ya tienen el máximo de cargas en proceso"""
+    return db.query(models.CargaExcel.user_id).filter(
+        models.CargaExcel.estado == PROCESANDO,
+        models.CargaExcel.user_id.isnot(None)
+    ).group_by(models.CargaExcel.user_id).having(func.count(models.CargaExcel.id) >= EXCEL_MAX_JOBS_PER_USER)
+
+def claim_next_job(db: Session):
+    """
+    Reclama la carga pendiente más antigua de un usuario que no haya llegado a su límite.
+    Devuelve el id de la carga o None si no hay trabajo disponible.
+    """
+    is_postgres = db.get_bind().dialect.name == "postgresql"
+    query = db.query(models.CargaExcel.id, models.CargaExcel.user_id).filter(
+        models.CargaExcel.estado == PENDIENTE,
+        models.CargaExcel.user_id.notin_(_saturated_users(db))
+    ).order_by(models.CargaExcel.created_at, models.CargaExcel.id)
+    if is_postgres:
+        query = query.with_for_update(skip_locked=True, of=models.CargaExcel)
+
+    candidate = query.first()
+    if candidate is None:
+        db.rollback()
+        return None
+    job_id, user_id = candidate
+
+    if is_postgres:
+        # Serializa los reclamos del mismo usuario para respetar el límite entre procesos
+        db.execute(text("SELECT pg_advisory_xact_lock(:ns, :uid)"), {"ns": _USER_LOCK_NAMESPACE, "uid": user_id or 0})
+        en_proceso = db.query(func.count(models.CargaExcel.id)).filter(
+            models.CargaExcel.user_id == user_id, models.CargaExcel.estado == PROCESANDO
+        ).scalar()
+        if en_proceso >= EXCEL_MAX_JOBS_PER_USER:
+            db.rollback()
+            return None
+
+    # UPDATE condicionado al estado: si otro proceso la tomó primero no se afecta ninguna fila
+    ahora = datetime.datetime.now()
+    claimed = db.query(models.CargaExcel).filter(
+        models.CargaExcel.id == job_id, models.CargaExcel.estado == PENDIENTE
+    ).update({
+        models.CargaExcel.estado: PROCESANDO,
+        models.CargaExcel.iniciado_en: ahora,
+        models.CargaExcel.updated_at: ahora,
+        models.CargaExcel.etapa: "inicio",
+        models.CargaExcel.progreso: 0,
+        models.CargaExcel.filas_procesadas: 0,
+        models.CargaExcel.progreso_en: ahora,
+        models.CargaExcel.intentos: func.coalesce(models.CargaExcel.intentos, 0) + 1
+    }, synchronize_session=False)
+    db.commit()
+    return job_id if claimed else None
+
+def requeue_stale_jobs(db: Session) -> int:
+    """
+    Re-encola las cargas 'procesando' sin actividad reciente (el proceso que las tenía murió
+    o el servidor se reinició). Tras EXCEL_JOB_MAX_ATTEMPTS intentos se marcan como error.
+    """
+    limite = datetime.datetime.now() - datetime.timedelta(seconds=EXCEL_JOB_STALE_SECONDS)
+    stale = db.query(models.CargaExcel).filter(
+        models.CargaExcel.estado == PROCESANDO,
+        func.coalesce(models.CargaExcel.updated_at, models.CargaExcel.created_at) < limite
+    ).all()
+    for carga in stale:
+        reanudable = carga.ruta_archivo or carga.tipo == TIPO_PURGA
+        if reanudable and (carga.intentos or 0) < EXCEL_JOB_MAX_ATTEMPTS:
+            carga.estado = PENDIENTE
+            logger.warning(f"Carga {carga.id} sin actividad desde {carga.updated_at}; se re-encola")
+        else:
+            carga.estado = ERROR
+            carga.mensaje_error = "La carga se interrumpió y superó el número máximo de intentos"
+            carga.finalizado_en = datetime.datetime.now()
+            _remove_spool(carga)
+    db.commit()
+    return len(stale)
+
+def _remove_spool(carga: models.CargaExcel):
+    if not carga.ruta_archivo:
+        return
+    try:
+        os.remove(carga.ruta_archivo)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"No se pudo borrar {carga.ruta_archivo}: {e}")
+
+def _heartbeat(carga_id: int, stop: threading.Event):
+    """Marca la carga como viva mientras se procesa (evita que se re-encole por inactividad)"""
+    interval = max(EXCEL_JOB_STALE_SECONDS / 3, 1)
+    while not stop.wait(interval):
+        db = SessionLocal()
+        try:
+            db.query(models.CargaExcel).filter(
+                models.CargaExcel.id == carga_id, models.CargaExcel.estado == PROCESANDO
+            ).update({models.CargaExcel.updated_at: datetime.datetime.now()}, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            logger.warning(f"Heartbeat de la carga {carga_id} falló: {e}")
+        finally:
+            db.close()
+
+def _progress_writer(carga_id: int):
+    """
+    Callback de avance para process_minsa_excel: guarda etapa, porcentaje y filas en la carga
+    usando su propia sesión (la del procesamiento tiene la transacción abierta hasta el commit).
+    """
+    last = {"etapa": None, "t": 0.0}
+
+    def on_progress(etapa: str, progreso: int, filas: int):
+        now = time.monotonic()
+        if etapa == last["etapa"] and now - last["t"] < EXCEL_PROGRESS_MIN_INTERVAL:
+            return
+        last.update(etapa=etapa, t=now)
+        db = SessionLocal()
+        try:
+            ahora = datetime.datetime.now()
+            db.query(models.CargaExcel).filter(models.CargaExcel.id == carga_id).update({
+                models.CargaExcel.etapa: etapa,
+                models.CargaExcel.progreso: progreso,
+                models.CargaExcel.filas_procesadas: filas,
+                models.CargaExcel.progreso_en: ahora,
+                models.CargaExcel.updated_at: ahora
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    return on_progress
+
+def is_stuck(carga: models.CargaExcel) -> bool:
+    """Carga en proceso que no reporta avance desde hace más de EXCEL_JOB_STUCK_SECONDS"""
+    if carga.estado != PROCESANDO:
+        return False
+    ultimo = carga.progreso_en or carga.iniciado_en or carga.updated_at or carga.created_at
+    return ultimo is not None and (datetime.datetime.now() - ultimo).total_seconds() > EXCEL_JOB_STUCK_SECONDS
+
+def queue_position(db: Session, carga: models.CargaExcel):
+    if carga.estado != PENDIENTE:
+        return None
+    return db.query(models.CargaExcel).filter(
+        models.CargaExcel.estado == PENDIENTE,
+        models.CargaExcel.id <= carga.id
+    ).count()
+
+def job_status(carga: models.CargaExcel, posicion: int = None) -> dict:
+    """Estado de una carga tal como lo ven /excel/jobs/{id} y su stream de eventos"""
+    return {
+        "job_id": carga.id,
+        "tipo": carga.tipo,
+        "archivo": carga.nombre_archivo,
+        "mes": carga.mes,
+        "anio": carga.anio,
+        "estado": carga.estado,
+        "etapa": carga.etapa,
+        "progreso": carga.progreso or 0,
+        "filas_procesadas": carga.filas_procesadas or 0,
+        "atascada": is_stuck(carga),
+        "posicion_en_cola": posicion,
+        "total_registros": carga.total_registros or 0,
+        "nuevos": carga.total_nuevos or 0,
+        "existentes": carga.total_repetidos or 0,
+        "filter_received": carga.eess_filter,
+        "mensaje_error": carga.mensaje_error,
+        "intentos": carga.intentos or 0,
+        "created_at": carga.created_at,
+        "iniciado_en": carga.iniciado_en,
+        "finalizado_en": carga.finalizado_en,
+        "progreso_en": carga.progreso_en
+    }
+
+def history_item(carga: models.CargaExcel) -> dict:
+    """Fila del historial: columnas de la carga (sin la ruta interna del archivo) y si está atascada"""
+    item = {c.name: getattr(carga, c.name) for c in models.CargaExcel.__table__.columns if c.name != "ruta_archivo"}
+    item["atascada"] = is_stuck(carga)
+    return item
+
+def load_job_status(job_id: int):
+    """job_status leído con una sesión propia (para los streams de eventos)"""
+    db = SessionLocal()
+    try:
+        carga = db.query(models.CargaExcel).filter(models.CargaExcel.id == job_id).first()
+        return job_status(carga, queue_position(db, carga)) if carga else None
+    finally:
+        db.close()
+
+def load_active_jobs(user_id: int) -> list:
+    """Cargas pendientes o en proceso de un usuario, con su avance"""
+    db = SessionLocal()
+    try:
+        cargas = db.query(models.CargaExcel).filter(
+            models.CargaExcel.user_id == user_id,
+            models.CargaExcel.estado.in_(ACTIVE_STATES)
+        ).order_by(models.CargaExcel.id).all()
+        return [job_status(c, queue_position(db, c)) for c in cargas]
+    finally:
+        db.close()
+
+def run_job(carga_id: int):
+    """Procesa una carga ya reclamada y guarda el resultado (o el error) en cargas_excel"""
+    db = SessionLocal()
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(carga_id, stop), daemon=True)
+    try:
+        carga = db.query(models.CargaExcel).filter(models.CargaExcel.id == carga_id).first()
+        if not carga:
+            logger.error(f"No se encontró el registro de carga {carga_id}")
+            return
+        heartbeat.start()
+        logger.info(f"Procesando {carga.tipo} {carga_id} (Mes: {carga.mes}, Año: {carga.anio}, intento {carga.intentos})")
+
+        if carga.tipo == TIPO_PURGA:
+            from .purge_service import purge_orphan_ninos_batched
+            on_progress = _progress_writer(carga_id)
+            total_visitas = purge_orphan_ninos_batched(
+                db, carga.user_id, on_progress=lambda progreso, filas: on_progress("purga", progreso, filas)
+            )
+            repetidos = nuevos = 0
+        else:
+            # El parser lee directamente del archivo en disco (sin cargarlo entero en memoria)
+            # o lo toma de parse_cache si este proceso ya parseó el mismo contenido
+            total_visitas, repetidos, nuevos = process_minsa_excel(
+                carga.ruta_archivo, db, carga.mes, carga.anio, carga.user_id, carga.eess_filter,
+                on_progress=_progress_writer(carga_id)
+            )
+
+        carga.estado = COMPLETADO
+        carga.etapa = COMPLETADO
+        carga.progreso = 100
+        carga.total_registros = total_visitas
+        carga.total_repetidos = repetidos
+        carga.total_nuevos = nuevos
+        carga.mensaje_error = None
+        carga.finalizado_en = datetime.datetime.now()
+        db.commit()
+        _remove_spool(carga)
+        logger.info(f"Carga {carga_id} ({carga.tipo}) completada exitosamente. Total registros: {total_visitas}")
+
+    except Exception as e:
+        logger.error(f"Error crítico en carga {carga_id}: {str(e)}")
+        db.rollback()
+        carga = db.query(models.CargaExcel).filter(models.CargaExcel.id == carga_id).first()
+        if carga:
+            carga.estado = ERROR
+            carga.mensaje_error = f"Error procesando datos: {str(e)}"[:450]
+            carga.finalizado_en = datetime.datetime.now()
+            db.commit()
+            _remove_spool(carga)
+    finally:
+        stop.set()
+        db.close()
+
+def run_pending_jobs(max_jobs: int = None) -> int:
+    """Reclama y procesa cargas pendientes en el proceso actual hasta vaciar la cola"""
+    procesadas = 0
+    while max_jobs is None or procesadas < max_jobs:
+        db = SessionLocal()
+        try:
+            job_id = claim_next_job(db)
+        finally:
+            db.close()
+        if job_id is None:
+            break
+        run_job(job_id)
+        procesadas += 1
+    return procesadas
+
+def _worker_main(worker_num: int, stop_event):
+    """Bucle de un proceso trabajador: re-encola cargas colgadas y procesa las pendientes"""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    logger.info(f"Trabajador de Excel #{worker_num} iniciado (pid {os.getpid()})")
+    last_reap = 0.0
+    while not stop_event.is_set():
+        try:
+            if time.monotonic() - last_reap > EXCEL_JOB_STALE_SECONDS / 3:
+                db = SessionLocal()
+                try:
+                    requeue_stale_jobs(db)
+                finally:
+                    db.close()
+                last_reap = time.monotonic()
+
+            if run_pending_jobs(max_jobs=1) == 0:
+                stop_event.wait(EXCEL_JOB_POLL_SECONDS)
+        except Exception as e:
+            logger.error(f"Trabajador #{worker_num}: {e}")
+            stop_event.wait(EXCEL_JOB_POLL_SECONDS)
+
+class WorkerPool:
+    """Pool de procesos trabajadores (se usa 'spawn' para no heredar conexiones de la base de datos)"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._ctx = multiprocessing.get_context("spawn")
+        self._stop = None
+        self._processes = []
+
+    def start(self):
+        if self.size <= 0 or self._processes:
+            return
+        self._stop = self._ctx.Event()
+        for n in range(self.size):
+            p = self._ctx.Process(target=_worker_main, args=(n + 1, self._stop), name=f"excel-worker-{n + 1}", daemon=True)
+            p.start()
+            self._processes.append(p)
+        logger.info(f"{self.size} trabajadores de Excel en marcha")
+
+    def stop(self, timeout: float = 10):
+        if not self._processes:
+            return
+        self._stop.set()
+        for p in self._processes:
+            p.join(timeout)
+            if p.is_alive():
+                p.terminate()
+        self._processes = []
+
+    def alive(self) -> int:
+        return sum(1 for p in self._processes if p.is_alive())
+
+worker_pool = WorkerPool(EXCEL_WORKERS)
+
+def start_job_queue():
+    """Al arrancar el servidor: re-encola cargas colgadas y pone a trabajar la cola"""
+    db = SessionLocal()
+    try:
+        requeue_stale_jobs(db)
+    except Exception as e:
+        logger.error(f"No se pudo revisar la cola de cargas: {e}")
+    finally:
+        db.close()
+
+    if EXCEL_WORKERS > 0:
+        worker_pool.start()
+    else:
+        # Sin procesos trabajadores las cargas se procesan en este proceso (hilo de fondo)
+        threading.Thread(target=run_pending_jobs, name="excel-jobs", daemon=True).start()
+
+def stop_job_queue():
+    worker_pool.stop()
@@ -0,0 +1,138 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("AlyAPI.ParseCache")
+
+# Configuración leída desde .env
+PARSE_CACHE_MAX_ENTRIES = int(os.getenv("PARSE_CACHE_MAX_ENTRIES", 8))
+PARSE_CACHE_TTL_SECONDS = int(os.getenv("PARSE_CACHE_TTL_SECONDS", 900))
+PARSE_CACHE_MAX_MB = int(os.getenv("PARSE_CACHE_MAX_MB", 256))
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def file_hash(source) -> str:
+    """Hash SHA-256 del contenido del archivo (clave de la caché); acepta bytes, una ruta o un archivo abierto"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(source).hexdigest()
+
+    digest = hashlib.sha256()
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+    else:
+        source.seek(0)
+        for block in iter(lambda: source.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+        source.seek(0)
+    return digest.hexdigest()
+
+def frame_nbytes(df) -> int:
+    """Memoria aproximada ocupada por un DataFrame (incluye los objetos str)"""
+    if df is None:
+        return 0
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+class ParsedWorkbook:
+    """Resultado del parseo de un Excel: bloques mapeados y, bajo demanda, el DataFrame limpio"""
+
+    def __init__(self, key: str, mapped_chunks: list):
+        self.key = key
+        self.mapped_chunks = mapped_chunks
+        self.cleaned = None
+
+    @property
+    def nbytes(self) -> int:
+        return sum(frame_nbytes(c) for c in self.mapped_chunks) + frame_nbytes(self.cleaned)
+
+class ParseCache:
+    """
+    Caché LRU con expiración (TTL) y tope de memoria para Excels ya parseados.
+    Evita que /excel/preview y /excel/upload parseen dos veces el mismo archivo.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expira_en, nbytes, ParsedWorkbook)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, nbytes, entry = item
+            if expires_at < time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, entry: ParsedWorkbook):
+        """Guarda (o re-contabiliza) una entrada; si no cabe en el tope de memoria no se cachea"""
+        nbytes = entry.nbytes
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if nbytes > self.max_bytes or self.max_entries <= 0:
+                logger.info(f"Excel {key[:12]} no se cachea ({nbytes // 1024} KB supera el tope)")
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, nbytes, entry)
+            self._bytes += nbytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+    def _drop(self, key: str):
+        _, nbytes, _ = self._entries.pop(key)
+        self._bytes -= nbytes
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [k for k, (exp, _, _) in self._entries.items() if exp < now]:
+            self._drop(key)
+            self.expirations += 1
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+parse_cache = ParseCache(
+    max_entries=PARSE_CACHE_MAX_ENTRIES,
+    ttl_seconds=PARSE_CACHE_TTL_SECONDS,
+    max_bytes=PARSE_CACHE_MAX_MB * 1024 * 1024,
+)
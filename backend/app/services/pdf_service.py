@@ -1,6 +1,7 @@
 from fpdf import FPDF
 from datetime import datetime
 import io
+from types import SimpleNamespace
 
 class ChronicHistoryPDF(FPDF):
     def header(self):
@@ -124,3 +125,10 @@ def generate_child_history_pdf(nino, visitas):
 
     # Retornar como bytes
     return bytes(pdf.output())
+
+def render_child_history_pdf(nino: dict, visitas: list):
+    """
+    generate_child_history_pdf a partir de las columnas del niño y de sus visitas (diccionarios),
+    para ejecutarse en el pool de procesos (utils/executors.py), donde no hay sesión de base de datos.
+    """
+    return generate_child_history_pdf(SimpleNamespace(**nino), [SimpleNamespace(**v) for v in visitas])
@@ -0,0 +1,91 @@
+"""
+Eliminación de un reporte mensual y limpieza de niños huérfanos con sentencias por conjuntos.
+
+delete_month borra las visitas del mes con un solo DELETE por periodo (índice
+idx_visita_user_periodo) y recalcula solo los datos derivados afectados; se rechaza mientras haya
+una carga de Excel del mismo mes en la cola (ActiveUploadError). purge_orphan_ninos
+borra con un solo DELETE ... WHERE NOT EXISTS los niños del usuario que ya no tienen visitas
+en la misma transacción; purge_orphan_ninos_batched hace lo mismo por lotes con avance, como
+trabajo 'purga' de la cola de cargas (job_queue.enqueue_orphan_purge).
+"""
+import logging
+import os
+from sqlalchemy import delete, exists, func, select
+from sqlalchemy.orm import Session
+from ..models import models
+from ..utils.periodo import periodo_filter
+from . import resumen_service, read_cache, job_queue
+
+logger = logging.getLogger("AlyAPI.Purge")
+
+# Niños borrados por transacción en la limpieza en segundo plano
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", 5000))
+
+class ActiveUploadError(RuntimeError):
+    """El mes tiene una carga de Excel pendiente o en proceso"""
+
+def delete_month(db: Session, user_id: int, anio: int, mes: int) -> int:
+    """Borra las visitas y las cargas del mes y actualiza resumen y niños. Devuelve las visitas borradas; no hace commit."""
+    V, C = models.Visita, models.CargaExcel
+    resumen_service.lock_user(db, user_id)
+    # Una carga en cola o en proceso volvería a llenar el mes (y perdería su registro y su archivo)
+    activa = db.query(C.id).filter(
+        C.user_id == user_id, C.anio == anio, C.mes == mes,
+        C.tipo == job_queue.TIPO_EXCEL, C.estado.in_(job_queue.ACTIVE_STATES)
+    ).first()
+    if activa is not None:
+        raise ActiveUploadError(f"La carga {activa.id} del mes {mes}/{anio} aún se está procesando")
+
+    borradas = db.execute(
+        delete(V).where(V.user_id == user_id, periodo_filter(V.periodo, anio, mes))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    resumen_service.refresh_month(db, user_id, anio, mes)
+    resumen_service.refresh_ninos(db, user_id, mes_borrado=(anio, mes))
+
+    # Historial de cargas excel del mes (ya todas terminadas)
+    db.execute(
+        delete(C).where(C.user_id == user_id, C.anio == anio, C.mes == mes, C.tipo == job_queue.TIPO_EXCEL)
+        .execution_options(synchronize_session=False)
+    )
+    read_cache.bump_version(db, user_id)
+    return borradas
+
+def purge_orphan_ninos(db: Session, user_id: int) -> int:
+    """Borra los niños del usuario sin ninguna visita. Devuelve cuántos; no hace commit."""
+    N, V = models.Nino, models.Visita
+    # Filtrar por user_id para no afectar a otros usuarios
+    total = db.execute(
+        delete(N).where(N.user_id == user_id, ~exists().where(V.nino_id == N.id))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if total:
+        read_cache.bump_version(db, user_id)
+    return total
+
+def purge_orphan_ninos_batched(db: Session, user_id: int, on_progress=None) -> int:
+    """
+    purge_orphan_ninos por lotes de PURGE_BATCH_SIZE con un commit por lote (transacciones cortas).
+    `on_progress(porcentaje, filas)` se llama tras cada lote. Devuelve los niños borrados.
+    """
+    N, V = models.Nino, models.Visita
+    sin_visitas = ~exists().where(V.nino_id == N.id)
+    total = db.query(func.count(N.id)).filter(N.user_id == user_id, sin_visitas).scalar()
+    borrados = 0
+    while True:
+        # Mismo orden de bloqueo que las cargas: una carga concurrente no pierde a sus niños
+        resumen_service.lock_user(db, user_id)
+        lote = select(N.id).where(N.user_id == user_id, sin_visitas).limit(PURGE_BATCH_SIZE)
+        n = db.execute(
+            delete(N).where(N.id.in_(lote)).execution_options(synchronize_session=False)
+        ).rowcount
+        if not n:
+            db.rollback()
+            break
+        read_cache.bump_version(db, user_id)
+        db.commit()
+        borrados += n
+        if on_progress is not None:
+            on_progress(min(borrados * 100 // max(total, 1), 99), borrados)
+    logger.info(f"Usuario {user_id}: {borrados} niños huérfanos eliminados")
+    return borrados
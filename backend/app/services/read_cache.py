@@ -0,0 +1,183 @@
+"""
+Caché de lecturas del dashboard por usuario, invalidada por versión.
+
+Cada usuario tiene un contador Usuario.data_version que las escrituras incrementan con
+bump_version dentro de su propia transacción (carga de Excel, CRUD de visitas y niños,
+borrado de un mes). Las respuestas se guardan bajo la clave (usuario, versión, endpoint,
+parámetros): al escribir, la versión cambia y las entradas viejas dejan de usarse sin
+tener que borrarlas.
+
+data_version también se guarda en el backend (clave version:<usuario>, READ_CACHE_VERSION_TTL_SECONDS),
+así el ETag y las lecturas en caché no consultan la base: el commit de una escritura borra esa
+entrada y la siguiente lectura vuelve a leer la versión por clave primaria. Con Redis el borrado
+lo ven todos los procesos al momento; con el backend en memoria cada proceso (worker de gunicorn,
+trabajador de la cola) tiene su copia, y una escritura hecha en otro proceso se ve como mucho
+tras READ_CACHE_VERSION_TTL_SECONDS.
+
+El mismo backend publica el auth_version de las cuentas editadas o eliminadas, con el que
+get_current_user (auth.py) descarta los usuarios que tiene en caché sin consultar la base.
+
+Backends (READ_CACHE_BACKEND):
+- 'memory' (por defecto): LRU con expiración dentro del proceso.
+- 'redis': compartido entre workers (READ_CACHE_URL); requiere el paquete redis. Si no está
+  instalado se usa 'memory', y si Redis falla la lectura se trata como un fallo de caché.
+- 'off': sin caché.
+"""
+import json
+import logging
+import os
+from contextvars import ContextVar
+from typing import Optional
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+from ..models import models
+from ..utils.ttl_cache import TTLCache
+
+logger = logging.getLogger("AlyAPI.ReadCache")
+
+# Configuración leída desde .env
+READ_CACHE_BACKEND = os.getenv("READ_CACHE_BACKEND", "memory").lower()
+READ_CACHE_URL = os.getenv("READ_CACHE_URL", "redis://localhost:6379/0")
+READ_CACHE_MAX_ENTRIES = int(os.getenv("READ_CACHE_MAX_ENTRIES", 2048))
+READ_CACHE_TTL_SECONDS = int(os.getenv("READ_CACHE_TTL_SECONDS", 600))
+READ_CACHE_VERSION_TTL_SECONDS = int(os.getenv("READ_CACHE_VERSION_TTL_SECONDS", 5))
+
+_MISSING = object()
+
+class MemoryBackend:
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self._cache = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+    def get(self, key: str):
+        return self._cache.get(key, _MISSING)
+
+    def set(self, key: str, value, ttl_seconds: int = None):
+        self._cache.set(key, value, ttl_seconds)
+
+    def delete(self, key: str):
+        self._cache.delete(key)
+
+class RedisBackend:
+    """Valores serializados como JSON con expiración en Redis"""
+
+    def __init__(self, url: str, ttl_seconds: int):
+        import redis
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key: str):
+        try:
+            raw = self._client.get(f"aly:read:{key}")
+        except Exception as e:
+            logger.warning(f"Caché Redis no disponible (lectura): {e}")
+            return _MISSING
+        return _MISSING if raw is None else json.loads(raw)
+
+    def set(self, key: str, value, ttl_seconds: int = None):
+        try:
+            self._client.set(f"aly:read:{key}", json.dumps(value), ex=ttl_seconds or self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Caché Redis no disponible (escritura): {e}")
+
+    def delete(self, key: str):
+        try:
+            self._client.delete(f"aly:read:{key}")
+        except Exception as e:
+            logger.warning(f"Caché Redis no disponible (borrado): {e}")
+
+class NullBackend:
+    def get(self, key: str):
+        return _MISSING
+
+    def set(self, key: str, value, ttl_seconds: int = None):
+        pass
+
+    def delete(self, key: str):
+        pass
+
+def _create_backend():
+    if READ_CACHE_BACKEND == "off":
+        return NullBackend()
+    if READ_CACHE_BACKEND == "redis":
+        try:
+            return RedisBackend(READ_CACHE_URL, READ_CACHE_TTL_SECONDS)
+        except ImportError:
+            logger.warning("READ_CACHE_BACKEND=redis pero el paquete redis no está instalado; se usa la caché en memoria")
+    return MemoryBackend(READ_CACHE_MAX_ENTRIES, READ_CACHE_TTL_SECONDS)
+
+backend = _create_backend()
+
+# Versiones ya leídas en la petición en curso (contextvar, igual que utils/request_metrics.py): las
+# comparten todas sus sesiones, la síncrona de get_db y la AsyncSession de get_read_db con ASYNC_DB
+_request_versions: ContextVar[Optional[dict]] = ContextVar("read_cache_versions", default=None)
+
+def start_request():
+    """Memo vacío de versiones para la petición que empieza (middleware de main.py)"""
+    _request_versions.set({})
+
+def _versions(db: Session) -> dict:
+    # Fuera de una petición (cola de cargas, scripts) el memo es el de la sesión
+    memo = _request_versions.get()
+    return memo if memo is not None else db.info
+
+def data_version(db: Session, user_id: int) -> int:
+    """Versión actual de los datos del usuario: una vez por petición, del backend si está"""
+    key = ("data_version", user_id)
+    memo = _versions(db)
+    if key not in memo:
+        version = _MISSING
+        # Con una escritura sin confirmar en la sesión, la del backend ya no es la vigente
+        if user_id not in db.info.get("version_bumps", ()):
+            version = backend.get(f"version:{user_id}")
+        if version is _MISSING:
+            version = db.query(models.Usuario.data_version).filter(models.Usuario.id == user_id).scalar() or 0
+            backend.set(f"version:{user_id}", version, READ_CACHE_VERSION_TTL_SECONDS)
+        memo[key] = version
+    return memo[key]
+
+def publish_auth_version(usuario: str, auth_version: int):
+    """Anuncia el auth_version vigente de una cuenta a todos los procesos que comparten el backend"""
+    backend.set(f"auth:{usuario}", auth_version)
+
+def published_auth_version(usuario: str):
+    """auth_version publicado para la cuenta, o None si no se editó en los últimos READ_CACHE_TTL_SECONDS"""
+    value = backend.get(f"auth:{usuario}")
+    return None if value is _MISSING else value
+
+def bump_version(db: Session, user_id: int):
+    """Invalida las lecturas en caché del usuario. Va en la misma transacción que la escritura; no hace commit."""
+    if user_id is None:
+        return
+    _versions(db).pop(("data_version", user_id), None)
+    db.info.setdefault("version_bumps", set()).add(user_id)
+    db.execute(
+        update(models.Usuario).where(models.Usuario.id == user_id)
+        .values(data_version=models.Usuario.data_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+@event.listens_for(Session, "after_commit")
+def _forget_committed_versions(session):
+    # La versión nueva ya es visible: la próxima lectura la toma de la base
+    for user_id in session.info.pop("version_bumps", ()):
+        backend.delete(f"version:{user_id}")
+
+@event.listens_for(Session, "after_rollback")
+def _discard_versions(session):
+    session.info.pop("version_bumps", None)
+
+def cached(db: Session, user: models.Usuario, name: str, params: tuple, compute, store_if=None):
+    """
+    Respuesta de `compute()` para el usuario y su versión actual, desde la caché si ya se calculó.
+    El valor se guarda ya convertido a JSON (jsonable_encoder), igual que lo devolvería la ruta.
+    `store_if(valor)` permite no guardar respuestas que cambian sin escrituras (cargas en curso).
+    """
+    key = f"{user.id}:{data_version(db, user.id)}:{name}:{json.dumps(jsonable_encoder(params))}"
+    value = backend.get(key)
+    if value is not _MISSING:
+        return value
+    value = jsonable_encoder(compute())
+    if store_if is None or store_if(value):
+        backend.set(key, value)
+    return value
@@ -0,0 +1,190 @@
+"""
+Datos derivados de las visitas que se mantienen al escribir.
+
+- Tabla resumen_mensual: por (user_id, anio, mes) el total de visitas y los niños únicos por
+  estado, para que el dashboard (/visitas/resumen, /ninos/stats) lea unas pocas filas por
+  clave primaria en vez de agrupar todo el historial. refresh_month/refresh_months recalculan
+  un mes usando solo sus visitas (índice idx_visita_user_periodo).
+- Columnas de Nino primera_visita, ultima_visita, ultimo_estado (estado de la visita con
+  mayor id) y visitas_count, usadas por el flag es_nuevo, el filtro "solo nuevos" y el
+  listado de niños. refresh_ninos las recalcula para los niños indicados.
+
+Cada ruta que modifica visitas llama a estas funciones dentro de su misma transacción.
+
+Reconstrucción completa (por ejemplo tras cargar datos a mano en la base):
+    python -m app.services.resumen_service [--user-id ID]
+"""
+import logging
+from datetime import date, datetime
+from sqlalchemy import func, case, exists, insert, literal, select, update
+from sqlalchemy.orm import Session
+from ..models import models
+from ..utils.periodo import month_range, periodo_filter
+
+logger = logging.getLogger("AlyAPI.Resumen")
+
+def _aggregates():
+    V = models.Visita
+    return [
+        func.count(V.id).label("total_visitas"),
+        func.count(func.distinct(V.nino_id)).label("total_ninos"),
+        func.count(func.distinct(case((V.estado == 'encontrado', V.nino_id), else_=None))).label("encontrados"),
+        func.count(func.distinct(case((V.estado == 'no encontrado', V.nino_id), else_=None))).label("no_encontrados"),
+        func.count(func.distinct(case((V.estado == 'pendiente', V.nino_id), else_=None))).label("pendientes"),
+        func.count(case((V.estado == 'encontrado', 1))).label("visitas_encontrado"),
+        func.count(case((V.estado == 'no encontrado', 1))).label("visitas_no_encontrado"),
+    ]
+
+TOTAL_FIELDS = [
+    "total_visitas", "total_ninos", "encontrados", "no_encontrados", "pendientes",
+    "visitas_encontrado", "visitas_no_encontrado"
+]
+
+def lock_user(db: Session, user_id: int):
+    """
+    Bloquea la fila del usuario hasta el commit (SELECT ... FOR UPDATE). Serializa las escrituras
+    concurrentes de un mismo usuario (carga de Excel, edición de visitas) para que el recálculo
+    vea las visitas ya confirmadas de la otra transacción y no se pierda ninguna de las dos.
+    En SQLite se ignora: la primera escritura ya toma el bloqueo exclusivo de la base.
+    """
+    db.execute(select(models.Usuario.id).where(models.Usuario.id == user_id).with_for_update())
+
+def refresh_month(db: Session, user_id: int, anio: int, mes: int):
+    """Recalcula la fila de un mes (la elimina si ya no tiene visitas). No hace commit."""
+    lock_user(db, user_id)
+    # La sesión no hace autoflush: los cambios pendientes deben verse en el recálculo
+    db.flush()
+    totals = db.query(*_aggregates()).filter(
+        models.Visita.user_id == user_id,
+        periodo_filter(models.Visita.periodo, anio, mes)
+    ).one()
+
+    row = db.get(models.ResumenMensual, (user_id, anio, mes))
+    if not totals.total_visitas:
+        if row is not None:
+            db.delete(row)
+        return
+    if row is None:
+        row = models.ResumenMensual(user_id=user_id, anio=anio, mes=mes)
+        db.add(row)
+    for field in TOTAL_FIELDS:
+        setattr(row, field, getattr(totals, field) or 0)
+    row.updated_at = datetime.now()
+
+def refresh_months(db: Session, user_id: int, fechas):
+    """Recalcula los meses a los que pertenecen las fechas indicadas"""
+    for anio, mes in sorted({(f.year, f.month) for f in fechas if f}):
+        refresh_month(db, user_id, anio, mes)
+
+def rebuild(db: Session, user_id: int = None) -> int:
+    """Reconstruye la tabla desde las visitas (de un usuario o de todos). Devuelve los meses generados."""
+    V = models.Visita
+    table = models.ResumenMensual.__table__
+
+    borrar = table.delete()
+    if user_id is not None:
+        borrar = borrar.where(table.c.user_id == user_id)
+    db.execute(borrar)
+
+    # Agrupación por la clave AAAAMM (índice idx_visita_user_periodo)
+    origen = select(
+        V.user_id, V.periodo // 100, V.periodo % 100, *_aggregates(), literal(datetime.now())
+    ).where(V.user_id.isnot(None))
+    if user_id is not None:
+        origen = origen.where(V.user_id == user_id)
+    origen = origen.group_by(V.user_id, V.periodo)
+
+    columnas = ["user_id", "anio", "mes", *TOTAL_FIELDS, "updated_at"]
+    result = db.execute(insert(table).from_select(columnas, origen))
+    logger.info(f"resumen_mensual reconstruido: {result.rowcount} meses")
+    return result.rowcount
+
+def refresh_ninos(db: Session, user_id: int, nino_ids=None, fecha: date = None, mes_borrado: tuple = None):
+    """
+    Recalcula primera_visita, ultima_visita, ultimo_estado y visitas_count de los niños del
+    usuario: los de `nino_ids`, los que tienen una visita en `fecha` (carga de Excel), los que
+    tenían visitas en el mes `mes_borrado` = (anio, mes) ya eliminado o, sin ninguno, todos.
+    Dos sentencias por conjuntos; no hace commit.
+    """
+    V, N = models.Visita, models.Nino
+    db.flush()
+
+    objetivo = select(N.id).where(N.user_id == user_id)
+    if nino_ids is not None:
+        objetivo = objetivo.where(N.id.in_([i for i in set(nino_ids) if i is not None]))
+    if fecha is not None:
+        objetivo = objetivo.where(N.id.in_(
+            select(V.nino_id).where(V.user_id == user_id, V.fecha_visita == fecha)
+        ))
+    if mes_borrado is not None:
+        # Sus visitas ya no existen, pero cualquier niño con una visita en el mes la tenía
+        # entre primera_visita y ultima_visita
+        inicio, fin = month_range(*mes_borrado)
+        objetivo = objetivo.where(N.primera_visita < fin, N.ultima_visita >= inicio)
+
+    por_nino = select(
+        V.nino_id,
+        func.min(V.fecha_visita).label("primera"),
+        func.max(V.fecha_visita).label("ultima"),
+        func.count(V.id).label("total"),
+        func.max(V.id).label("ultima_id")
+    ).where(V.nino_id.in_(objetivo)).group_by(V.nino_id).subquery()
+    totales = select(por_nino, V.estado).join(V, V.id == por_nino.c.ultima_id).subquery()
+
+    # updated_at se conserva: refleja cambios en los datos del niño, no en sus visitas
+    db.execute(
+        update(N).where(N.id == totales.c.nino_id).values(
+            primera_visita=totales.c.primera,
+            ultima_visita=totales.c.ultima,
+            ultimo_estado=totales.c.estado,
+            visitas_count=totales.c.total,
+            updated_at=N.updated_at
+        ).execution_options(synchronize_session=False)
+    )
+
+    # Niños que se quedaron sin visitas (en una carga todos tienen al menos la del mes)
+    if fecha is None:
+        db.execute(
+            update(N).where(N.id.in_(objetivo), ~exists().where(V.nino_id == N.id)).values(
+                primera_visita=None,
+                ultima_visita=None,
+                ultimo_estado=None,
+                visitas_count=0,
+                updated_at=N.updated_at
+            ).execution_options(synchronize_session=False)
+        )
+
+def get_summary(db: Session, user_id: int):
+    """Meses del usuario, del más reciente al más antiguo"""
+    return db.query(models.ResumenMensual).filter(
+        models.ResumenMensual.user_id == user_id
+    ).order_by(models.ResumenMensual.anio.desc(), models.ResumenMensual.mes.desc()).all()
+
+def get_month(db: Session, user_id: int, anio: int, mes: int):
+    return db.get(models.ResumenMensual, (user_id, anio, mes))
+
+def global_totals(db: Session, user_id: int):
+    """Visitas encontradas / no encontradas de todo el historial del usuario"""
+    return db.query(
+        func.coalesce(func.sum(models.ResumenMensual.visitas_encontrado), 0).label("encontrados"),
+        func.coalesce(func.sum(models.ResumenMensual.visitas_no_encontrado), 0).label("no_encontrados")
+    ).filter(models.ResumenMensual.user_id == user_id).one()
+
+if __name__ == "__main__":
+    import argparse
+    from ..database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Reconstruye resumen_mensual y el resumen de visitas de cada niño")
+    parser.add_argument("--user-id", type=int, default=None, help="Solo este usuario (por defecto, todos)")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        meses = rebuild(db, args.user_id)
+        usuarios = [args.user_id] if args.user_id is not None else [u for (u,) in db.query(models.Usuario.id)]
+        for uid in usuarios:
+            refresh_ninos(db, uid)
+        db.commit()
+        print(f"resumen_mensual reconstruido: {meses} meses; resumen de niños recalculado para {len(usuarios)} usuario(s)")
+    finally:
+        db.close()
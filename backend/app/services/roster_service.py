@@ -0,0 +1,74 @@
+"""
+Listado de niños del usuario (GET /ninos/).
+
+Las filas se leen como tuplas de columnas (sin instanciar objetos del ORM) por lotes con
+yield_per y se convierten directamente en el diccionario de NinoListItem. En el formato
+NDJSON cada niño es una línea JSON y el cuerpo se genera mientras se lee la consulta, así la
+memoria usada no depende del número de niños.
+"""
+import json
+import os
+from datetime import date
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from .. import database
+from ..database import SessionLocal
+from ..models import models
+
+# Configuración leída desde .env
+ROSTER_BATCH_SIZE = int(os.getenv("ROSTER_BATCH_SIZE", 1000))
+
+# Campos de NinoListItem leídos tal cual de la fila, en el orden de la respuesta JSON
+ROSTER_FIELDS = [
+    "dni_nino", "nombres", "fecha_nacimiento", "direccion", "dni_madre", "nombre_madre",
+    "celular_madre", "rango_edad", "historia_clinica", "establecimiento_asignado", "id"
+]
+
+def roster_select(user_id: int):
+    N = models.Nino
+    columnas = [getattr(N, f) for f in ROSTER_FIELDS]
+    return select(*columnas, N.ultimo_estado, N.primera_visita, N.visitas_count)\
+        .where(N.user_id == user_id).order_by(N.id)
+
+def iter_roster_items(rows, today: date = None):
+    """Diccionarios de NinoListItem (estado de la última visita, es_nuevo y número de visitas)"""
+    today = today or date.today()
+    n = len(ROSTER_FIELDS)
+    for row in rows:
+        item = dict(zip(ROSTER_FIELDS, row[:n]))
+        estado, primera, visitas_count = row[n:]
+        item["estado"] = estado or "pendiente"
+        # Nuevo: su primera visita es del mes en curso
+        item["es_nuevo"] = bool(primera) and primera.year == today.year and primera.month == today.month
+        item["visitas_count"] = visitas_count or 0
+        yield item
+
+def roster_items(db: Session, user_id: int) -> list:
+    rows = db.execute(roster_select(user_id), execution_options={"yield_per": ROSTER_BATCH_SIZE})
+    return list(iter_roster_items(rows))
+
+def _ndjson(items) -> str:
+    return "".join(json.dumps(item, ensure_ascii=False, default=str) + "\n" for item in items)
+
+def iter_roster_ndjson(user_id: int):
+    """
+    Cuerpo NDJSON del listado, un bloque de texto por lote. Usa su propia sesión: la de la
+    petición se cierra antes de que termine de enviarse una respuesta en streaming.
+    """
+    db = SessionLocal()
+    try:
+        rows = db.execute(roster_select(user_id), execution_options={"yield_per": ROSTER_BATCH_SIZE})
+        for lote in rows.partitions():
+            yield _ndjson(iter_roster_items(lote))
+    finally:
+        db.close()
+
+async def aiter_roster_ndjson(user_id: int):
+    """iter_roster_ndjson con el motor asíncrono (ASYNC_DB): los lotes se esperan en el event loop"""
+    async with database.AsyncSessionLocal() as db:
+        result = await db.stream(roster_select(user_id))
+        async for lote in result.partitions(ROSTER_BATCH_SIZE):
+            yield _ndjson(iter_roster_items(lote))
+
+def roster_ndjson(user_id: int):
+    return aiter_roster_ndjson(user_id) if database.AsyncSessionLocal is not None else iter_roster_ndjson(user_id)
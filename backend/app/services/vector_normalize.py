@@ -0,0 +1,62 @@
+"""
+Núcleo vectorizado para normalizar columnas completas del Excel.
+
+Las columnas del MINSA tienen muy pocos valores distintos (EESS, estado) o se repiten
+mucho entre meses (documentos), así que en vez de llamar a la función de limpieza fila
+por fila se convierte la columna a texto, se factoriza (valores únicos + códigos) y la
+función escalar solo se evalúa una vez por valor distinto. El resultado se reparte de
+vuelta con los códigos, de modo que es idéntico a aplicar la función a cada celda.
+"""
+import numpy as np
+import pandas as pd
+
+def as_series(values) -> pd.Series:
+    if isinstance(values, pd.Series):
+        return values
+    return pd.Series(np.asarray(values, dtype=object))
+
+def none_or_nan_mask(s: pd.Series) -> np.ndarray:
+    """Posiciones que son None o un float NaN (lo que clean_document_value trata como vacío)"""
+    if s.dtype.kind == 'f':
+        return s.isna().to_numpy()
+    if s.dtype != object:
+        return np.zeros(len(s), dtype=bool)
+    mask = s.isna().to_numpy().copy()
+    idx = np.flatnonzero(mask)
+    if len(idx):
+        # pd.isna también marca NaT/pd.NA, que la función escalar convierte a texto
+        values = s.to_numpy()
+        mask[idx] = [values[i] is None or isinstance(values[i], float) for i in idx]
+    return mask
+
+def falsy_or_na_mask(s: pd.Series) -> np.ndarray:
+    """Equivalente vectorizado de `not valor or pd.isna(valor)`"""
+    mask = s.isna().to_numpy().copy()
+    if s.dtype == bool:
+        mask |= ~s.to_numpy()
+    elif s.dtype.kind in 'iuf':
+        mask |= (s == 0).to_numpy()
+    elif s.dtype == object:
+        mask |= (s.eq('') | s.eq(0)).to_numpy()
+    return mask
+
+def map_unique_text(values, func, empty_mask=None, empty_value=None) -> pd.Series:
+    """
+    Aplica `func` a str(valor) una sola vez por cada texto distinto de la columna.
+    `empty_mask` marca las celdas que la función escalar descarta antes de convertir
+    a texto (None, NaN, 0...); esas celdas reciben `empty_value`.
+    """
+    s = as_series(values)
+    if len(s) == 0:
+        return pd.Series([], index=s.index, dtype=object)
+
+    # str() de cada escalar (a través de object para no usar el formato propio de pandas)
+    text = s.astype(object).astype(str).to_numpy(dtype=object)
+    codes, uniques = pd.factorize(text, sort=False)
+
+    mapped = np.empty(len(uniques), dtype=object)
+    mapped[:] = [func(u) for u in uniques]
+    out = mapped[codes]
+    if empty_mask is not None:
+        out[empty_mask] = empty_value
+    return pd.Series(out, index=s.index, dtype=object)
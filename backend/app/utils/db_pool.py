@@ -0,0 +1,143 @@
+"""
+Pool de conexiones configurable e instrumentado.
+
+pool_options() arma los argumentos de create_engine desde .env (tamaño, overflow, espera máxima,
+reciclado, pre-ping y statement_timeout por sentencia). Los pools registran cuánto se espera
+para obtener una conexión y el máximo de conexiones en uso, para /debug/db-pool.
+
+Modo PgBouncer (DB_PGBOUNCER=true, PgBouncer en modo transaction): el pooling lo hace PgBouncer
+(NullPool en la app), no se envían parámetros de arranque (statement_timeout va con SET LOCAL
+en cada transacción) y asyncpg no usa sentencias preparadas, que no sobreviven entre transacciones.
+"""
+import os
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+# Configuración leída desde .env
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# Menor que el cierre por inactividad del Postgres administrado
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# 0 = sin límite
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+
+class PoolStats:
+    """Esperas por una conexión (checkout) y ocupación máxima de un pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.slow_checkouts = 0
+        self.max_checked_out = 0
+
+    def record(self, wait: float, checked_out: int, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            # Más de 10 ms esperando: no había conexión libre en el pool
+            if wait > 0.01:
+                self.slow_checkouts += 1
+            self.max_checked_out = max(self.max_checked_out, checked_out)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            total = self.checkouts + self.timeouts
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "esperas_lentas": self.slow_checkouts,
+                "espera_promedio_ms": round(self.total_wait / total * 1000, 2) if total else 0.0,
+                "espera_max_ms": round(self.max_wait * 1000, 2),
+                "max_en_uso": self.max_checked_out
+            }
+
+class _InstrumentedMixin:
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            self.stats.record(time.perf_counter() - inicio, self.checkedout(), timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - inicio, self.checkedout())
+        return conn
+
+class InstrumentedQueuePool(_InstrumentedMixin, QueuePool):
+    stats = None
+
+class InstrumentedAsyncQueuePool(_InstrumentedMixin, AsyncAdaptedQueuePool):
+    stats = None
+
+def _pool_class(base, stats: PoolStats):
+    # Una clase por motor para que cada uno tenga sus propias métricas
+    return type(base.__name__, (base,), {"stats": stats})
+
+def pool_options(url, is_async: bool = False) -> dict:
+    """Argumentos de create_engine / create_async_engine para la URL (solo PostgreSQL se configura)"""
+    if url.get_backend_name() != "postgresql":
+        return {}
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    if DB_PGBOUNCER:
+        options["poolclass"] = NullPool
+    else:
+        base = InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool
+        options.update(
+            poolclass=_pool_class(base, PoolStats()),
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE
+        )
+
+    if is_async:
+        connect_args = {}
+        if DB_PGBOUNCER:
+            connect_args.update(statement_cache_size=0, prepared_statement_cache_size=0)
+        elif DB_STATEMENT_TIMEOUT_MS:
+            connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+        options["connect_args"] = connect_args
+    elif DB_STATEMENT_TIMEOUT_MS and not DB_PGBOUNCER:
+        options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+def install_statement_timeout(engine):
+    """En modo PgBouncer el límite por sentencia se fija al inicio de cada transacción"""
+    if not (DB_PGBOUNCER and DB_STATEMENT_TIMEOUT_MS) or engine.dialect.name != "postgresql":
+        return
+
+    @event.listens_for(engine, "begin")
+    def _set_local_timeout(conn):
+        conn.exec_driver_sql(f"SET LOCAL statement_timeout = {DB_STATEMENT_TIMEOUT_MS}")
+
+def pool_status(engine) -> dict:
+    """Estado actual y métricas del pool de un motor (sync o async)"""
+    pool = engine.pool
+    status = {"clase": type(pool).__name__, "pgbouncer": DB_PGBOUNCER, "pre_ping": DB_POOL_PRE_PING,
+              "statement_timeout_ms": DB_STATEMENT_TIMEOUT_MS}
+    if isinstance(pool, QueuePool):
+        capacidad = pool.size() + max(pool._max_overflow, 0)
+        status.update({
+            "tamano": pool.size(),
+            "max_overflow": pool._max_overflow,
+            "en_uso": pool.checkedout(),
+            "libres": pool.checkedin(),
+            "overflow": pool.overflow(),
+            "saturacion": round(pool.checkedout() / capacidad, 2) if capacidad else None,
+            "recycle_s": pool._recycle,
+            "timeout_s": pool._timeout
+        })
+    if getattr(pool, "stats", None) is not None:
+        status.update(pool.stats.snapshot())
+    return status
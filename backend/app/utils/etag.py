@@ -0,0 +1,51 @@
+import hashlib
+import json
+from datetime import date
+from fastapi import Depends, HTTPException, Request, Response
+from ..auth import get_current_user
+from ..database import get_read_db, run_db
+from ..models import models
+from ..services import read_cache
+
+# Las respuestas se guardan en el navegador pero se revalidan siempre con If-None-Match
+CACHE_CONTROL = "private, no-cache"
+
+def weak_etag(*parts) -> str:
+    raw = json.dumps(parts, default=str, separators=(",", ":"))
+    return 'W/"' + hashlib.sha1(raw.encode("utf-8")).hexdigest() + '"'
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Comparación débil con la lista de If-None-Match (ignora el prefijo W/)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith("W/") else tag) == opaque:
+            return True
+    return False
+
+def check_etag(request: Request, response: Response, *freshness):
+    """
+    ETag de la respuesta a partir de las señales de frescura, la ruta y sus parámetros. Si el
+    cliente ya tiene esa versión responde 304 (la ruta no llega a ejecutarse); si no, deja el
+    encabezado en `response` para la respuesta normal.
+    """
+    etag = weak_etag(*freshness, request.url.path, sorted(request.query_params.multi_items()))
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        raise HTTPException(status_code=304, headers=headers)
+    response.headers.update(headers)
+
+async def user_data_etag(request: Request, response: Response, db=Depends(get_read_db),
+                         current_user: models.Usuario = Depends(get_current_user)):
+    """
+    Dependencia para las rutas GET cuyos datos solo cambian con las escrituras del usuario:
+    un 304 solo necesita Usuario.data_version, que sale del backend de services/read_cache.py sin
+    consultar la base, y la ruta reutiliza esa lectura aunque use otra sesión (memo de la petición).
+    El mes en curso cambia los flags es_nuevo del listado de niños.
+    """
+    version = await run_db(db, read_cache.data_version, current_user.id)
+    check_etag(request, response, current_user.id, version, date.today().strftime("%Y%m"))
@@ -0,0 +1,132 @@
+"""
+Ejecutores administrados para el trabajo que consume CPU fuera del event loop.
+
+- bcrypt_pool: hilos acotados para verificar y generar hashes de contraseñas (bcrypt libera
+  el GIL, así que basta con hilos; el tope evita que muchos logins ocupen todo el threadpool).
+- cpu_pool: procesos para el parseo de Excel con pandas y la generación de PDFs, que retienen
+  el GIL y en un hilo frenarían al resto de peticiones del worker. Se crean con 'spawn' (no
+  heredan conexiones de la base de datos) y solo al primer uso. Un script que use la app
+  directamente (TestClient) necesita `if __name__ == "__main__":` o CPU_PROCESSES=0.
+
+Las rutas async usan `await pool.run(fn, ...)` y las síncronas `pool.call(fn, ...)`. Cada pool
+lleva contadores de cola (en vuelo, en espera, máximos y tiempos) para /debug/executors.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+logger = logging.getLogger("AlyAPI.Executors")
+
+# Configuración leída desde .env
+BCRYPT_THREADS = int(os.getenv("BCRYPT_THREADS", 4))
+# Con CPU_PROCESSES=0 el trabajo pesado se hace en hilos (por ejemplo donde no se pueden crear procesos)
+CPU_PROCESSES = int(os.getenv("CPU_PROCESSES", 2))
+
+class ManagedExecutor:
+    """Executor creado al primer uso, con métricas de profundidad de cola y latencia"""
+
+    def __init__(self, name: str, max_workers: int, processes: bool = False):
+        self.name = name
+        self.max_workers = max(max_workers, 1)
+        self.processes = processes
+        self._executor = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.max_queue_depth = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.processes:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+                logger.info(f"Ejecutor '{self.name}' iniciado ({self.max_workers} {'procesos' if self.processes else 'hilos'})")
+            return self._executor
+
+    @property
+    def queue_depth(self) -> int:
+        """Tareas enviadas que esperan un worker libre"""
+        return max(self.in_flight - self.max_workers, 0)
+
+    def submit(self, fn, *args, **kwargs):
+        executor = self._get_executor()
+        inicio = time.monotonic()
+        # Se cuenta antes de enviar: una tarea corta puede terminar antes de que submit regrese
+        with self._lock:
+            self.submitted += 1
+            self.in_flight += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            future = executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            with self._lock:
+                self.in_flight -= 1
+                self.failed += 1
+            raise
+
+        def _done(f):
+            elapsed = time.monotonic() - inicio
+            with self._lock:
+                self.in_flight -= 1
+                if f.cancelled() or f.exception() is not None:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+                self.total_seconds += elapsed
+                self.max_seconds = max(self.max_seconds, elapsed)
+
+        future.add_done_callback(_done)
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """Ejecuta `fn` en el pool sin bloquear el event loop"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def call(self, fn, *args, **kwargs):
+        """Ejecuta `fn` en el pool y espera el resultado (desde rutas síncronas)"""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def stats(self) -> dict:
+        with self._lock:
+            terminadas = self.completed + self.failed
+            return {
+                "tipo": "procesos" if self.processes else "hilos",
+                "workers": self.max_workers,
+                "iniciado": self._executor is not None,
+                "en_vuelo": self.in_flight,
+                "en_cola": self.queue_depth,
+                "max_en_cola": self.max_queue_depth,
+                "enviadas": self.submitted,
+                "completadas": self.completed,
+                "fallidas": self.failed,
+                "promedio_ms": round(self.total_seconds / terminadas * 1000, 1) if terminadas else 0.0,
+                "max_ms": round(self.max_seconds * 1000, 1)
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+bcrypt_pool = ManagedExecutor("bcrypt", BCRYPT_THREADS)
+cpu_pool = ManagedExecutor("cpu", CPU_PROCESSES if CPU_PROCESSES > 0 else 2, processes=CPU_PROCESSES > 0)
+
+def stats() -> dict:
+    return {pool.name: pool.stats() for pool in (bcrypt_pool, cpu_pool)}
+
+def shutdown():
+    for pool in (bcrypt_pool, cpu_pool):
+        pool.shutdown()
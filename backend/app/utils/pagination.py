@@ -0,0 +1,19 @@
+import base64
+import json
+from fastapi import HTTPException
+
+def encode_cursor(*values) -> str:
+    """Cursor opaco (base64 url-safe) con los valores de la última fila de la página"""
+    raw = json.dumps(list(values), ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """Valores del cursor; 400 si no es uno generado por encode_cursor con `size` valores"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
+    return values
@@ -0,0 +1,31 @@
+from datetime import date
+from sqlalchemy import and_
+
+def month_range(anio: int, mes: int):
+    """Primer día del mes y primer día del mes siguiente"""
+    start = date(anio, mes, 1)
+    end = date(anio + 1, 1, 1) if mes == 12 else date(anio, mes + 1, 1)
+    return start, end
+
+def month_filter(column, anio: int, mes: int):
+    """
+    Condición `inicio <= columna < inicio del mes siguiente` para una columna de fecha. A diferencia
+    de extract('month'/'year', columna), el rango puede usar los índices que empiezan por la fecha
+    (por ejemplo idx_visita_user_fecha).
+    """
+    start, end = month_range(anio, mes)
+    return and_(column >= start, column < end)
+
+def periodo_key(anio: int, mes: int) -> int:
+    """Clave entera del mes (AAAAMM), la que guarda Visita.periodo"""
+    return anio * 100 + mes
+
+def periodo_filter(column, anio: int, mes: int):
+    """
+    Condición `columna = AAAAMM` sobre Visita.periodo. Junto con user_id es una igualdad sobre
+    todo el índice idx_visita_user_periodo, más selectiva que el rango de fechas de month_filter.
+    """
+    return column == periodo_key(anio, mes)
+
+def periodo_of(fecha) -> int:
+    return periodo_key(fecha.year, fecha.month) if fecha else None
@@ -0,0 +1,106 @@
+"""
+Métricas por petición: número de consultas SQL, tiempo total en la base y la sentencia más lenta.
+
+Los eventos de SQLAlchemy de install_sql_hooks() suman cada consulta al RequestStats de la
+petición en curso (contextvar, que también ven las rutas síncronas en el threadpool). El
+middleware de main.py lo combina con la plantilla de la ruta y lo publica como histogramas
+Prometheus (/metrics) y como cabecera Server-Timing.
+
+Con varios workers de gunicorn definir PROMETHEUS_MULTIPROC_DIR (directorio vacío al arrancar)
+para que /metrics sume los de todos los procesos.
+"""
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Histogram, REGISTRY, generate_latest, multiprocess
+)
+
+# Peticiones más lentas que esto se registran en el log con su detalle SQL (0 = nunca)
+REQUEST_BUDGET_MS = float(os.getenv("REQUEST_BUDGET_MS", 1000))
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_SECONDS = Histogram(
+    "aly_http_request_duration_seconds", "Duración de la petición HTTP",
+    ["method", "route", "status"], buckets=_LATENCY_BUCKETS
+)
+REQUEST_DB_SECONDS = Histogram(
+    "aly_http_request_db_seconds", "Tiempo en la base de datos por petición",
+    ["method", "route"], buckets=_LATENCY_BUCKETS
+)
+REQUEST_DB_QUERIES = Histogram(
+    "aly_http_request_db_queries", "Consultas SQL por petición",
+    ["method", "route"], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+)
+
+class RequestStats:
+    """Acumulado SQL de una petición"""
+    __slots__ = ("queries", "db_time", "slowest_time", "slowest_statement")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+
+    def record(self, statement: str, elapsed: float):
+        self.queries += 1
+        self.db_time += elapsed
+        if elapsed > self.slowest_time:
+            self.slowest_time = elapsed
+            self.slowest_statement = statement
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+def start_request() -> RequestStats:
+    stats = RequestStats()
+    _current.set(stats)
+    return stats
+
+def install_sql_hooks(engine):
+    """Mide cada sentencia del motor (en un AsyncEngine, pasar async_engine.sync_engine)"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        inicio = conn.info["query_start"].pop()
+        stats = _current.get()
+        if stats is not None:
+            stats.record(statement, time.perf_counter() - inicio)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        # Una sentencia que falla no llega a after_cursor_execute; su tiempo también cuenta
+        conn = context.connection
+        if conn is None or not conn.info.get("query_start"):
+            return
+        inicio = conn.info["query_start"].pop()
+        stats = _current.get()
+        if stats is not None:
+            stats.record(context.statement, time.perf_counter() - inicio)
+
+def observe(method: str, route: str, status: int, elapsed: float, stats: RequestStats):
+    REQUEST_SECONDS.labels(method, route, str(status)).observe(elapsed)
+    REQUEST_DB_SECONDS.labels(method, route).observe(stats.db_time)
+    REQUEST_DB_QUERIES.labels(method, route).observe(stats.queries)
+
+def server_timing(elapsed: float, stats: RequestStats) -> str:
+    """Valor de la cabecera Server-Timing (milisegundos)"""
+    return (f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} consultas", '
+            f'app;dur={(elapsed - stats.db_time) * 1000:.1f}, '
+            f'total;dur={elapsed * 1000:.1f}')
+
+def render_metrics():
+    """Texto de exposición Prometheus y su content-type"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
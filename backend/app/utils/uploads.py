@@ -0,0 +1,36 @@
+import hashlib
+import os
+from fastapi import HTTPException, UploadFile
+
+# Tamaño de bloque con el que se lee el archivo subido
+UPLOAD_READ_BLOCK = 1024 * 1024
+
+async def spool_upload(upload: UploadFile, max_bytes: int, too_large_detail: str, dest_path: str = None):
+    """
+    Recorre el archivo subido por bloques verificando el límite de tamaño y calculando su hash,
+    sin acumular el contenido en memoria. Starlette ya guarda el cuerpo en un SpooledTemporaryFile
+    (upload.file), que queda rebobinado para que el parser lo lea directamente; si se indica
+    `dest_path`, además se copia a ese archivo (cargas que procesa un trabajador en otro proceso).
+    Devuelve (tamaño en bytes, hash SHA-256).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    dest = open(dest_path, "wb") if dest_path else None
+    try:
+        await upload.seek(0)
+        while block := await upload.read(UPLOAD_READ_BLOCK):
+            size += len(block)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail=too_large_detail)
+            digest.update(block)
+            if dest:
+                dest.write(block)
+    except BaseException:
+        if dest:
+            dest.close()
+            os.remove(dest_path)
+        raise
+    if dest:
+        dest.close()
+    await upload.seek(0)
+    return size, digest.hexdigest()
@@ -0,0 +1,112 @@
+"""
+Benchmark de las rutas de lectura con el motor síncrono y con el asíncrono (ASYNC_DB=true).
+
+Levanta el servidor dos veces (una por modo) contra la misma base PostgreSQL de DATABASE_URL,
+con la caché de lecturas desactivada para medir el acceso a la base, y lanza --concurrency
+clientes sobre las rutas durante --duration segundos. Muestra peticiones por segundo y
+latencias, y comprueba que ambos modos devuelven las mismas respuestas.
+
+Uso:
+    DATABASE_URL=postgresql://... python bench_async.py --user admin --password ... --anio 2025 --mes 4
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+async def wait_ready(url, proc, timeout=30):
+    limite = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=url) as client:
+        while time.monotonic() < limite:
+            if proc.poll() is not None:
+                raise RuntimeError("El servidor terminó al iniciar")
+            try:
+                await client.get("/")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.3)
+    raise RuntimeError("El servidor no respondió a tiempo")
+
+async def worker(client, paths, headers, stop, latencias, errores, n):
+    i = n
+    while not stop.is_set():
+        path = paths[i % len(paths)]
+        i += 1
+        inicio = time.perf_counter()
+        r = await client.get(path, headers=headers)
+        if r.status_code != 200:
+            errores.append(r.status_code)
+            continue
+        latencias.append((time.perf_counter() - inicio) * 1000)
+
+async def run_mode(nombre, env, args, paths):
+    url = f"http://127.0.0.1:{args.port}"
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port), "--log-level", "warning"],
+        env={**os.environ, **env}
+    )
+    try:
+        await wait_ready(url, proc)
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=url, timeout=60, limits=limits) as client:
+            r = await client.post("/auth/login", data={"username": args.user, "password": args.password})
+            r.raise_for_status()
+            headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+            respuestas = {}
+            for path in paths:
+                r = await client.get(path, headers=headers)
+                r.raise_for_status()
+                respuestas[path] = r.json()
+
+            stop = asyncio.Event()
+            latencias, errores = [], []
+            tareas = [asyncio.create_task(worker(client, paths, headers, stop, latencias, errores, n))
+                      for n in range(args.concurrency)]
+            inicio = time.perf_counter()
+            await asyncio.sleep(args.duration)
+            stop.set()
+            await asyncio.gather(*tareas)
+            segundos = time.perf_counter() - inicio
+
+        print(f"{nombre:<6} rps={len(latencias) / segundos:7.1f} p50={percentile(latencias, 50):7.1f}ms "
+              f"p95={percentile(latencias, 95):7.1f}ms p99={percentile(latencias, 99):7.1f}ms errores={len(errores)}")
+        return respuestas
+    finally:
+        proc.terminate()
+        proc.wait()
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--anio", type=int, required=True)
+    parser.add_argument("--mes", type=int, required=True)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--port", type=int, default=8799)
+    args = parser.parse_args()
+
+    paths = [
+        "/ninos/", "/ninos/stats", "/visitas/resumen",
+        f"/visitas/detalle/{args.anio}/{args.mes}?limit=50",
+        f"/visitas/detalle/{args.anio}/{args.mes}?limit=50&estado=encontrado",
+    ]
+    # Sin caché de lecturas ni trabajadores de Excel: se mide solo el acceso a la base
+    comunes = {"READ_CACHE_BACKEND": "off", "EXCEL_WORKERS": "0"}
+    sync = await run_mode("sync", {**comunes, "ASYNC_DB": "false"}, args, paths)
+    asyn = await run_mode("async", {**comunes, "ASYNC_DB": "true"}, args, paths)
+    distintas = [p for p in paths if sync[p] != asyn[p]]
+    print("respuestas iguales en ambos modos" if not distintas else f"respuestas distintas: {distintas}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+"""
+Prueba de carga: latencia de un endpoint no relacionado mientras se suben Excels y se verifican contraseñas.
+
+Mide la latencia de --probe-path primero sin carga y luego mientras --workers clientes envían
+vistas previas de Excel (cada una con un hash distinto, para que no la sirva la caché de parseo)
+y verificaciones de contraseña. Si el trabajo pesado bloquea el event loop, el p99 de la
+segunda fase sube; con los ejecutores de app/utils/executors.py debe quedar casi igual.
+
+/auth/login y /auth/verify-password tienen límite de 5 por minuto: para medir bcrypt con carga
+arranque el servidor con RATELIMIT_ENABLED=false (variable de slowapi).
+
+Uso (con el servidor corriendo):
+    python load_test.py --url http://localhost:8000 --user admin --password ... --file reporte.xlsx
+"""
+import argparse
+import asyncio
+import io
+import statistics
+import time
+import zipfile
+
+import httpx
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+def excel_variant(data: bytes, n: int) -> bytes:
+    """Mismo Excel con otro comentario en el zip: el contenido no cambia pero el hash sí"""
+    out = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(data)) as src, zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as dst:
+        for item in src.infolist():
+            dst.writestr(item, src.read(item.filename))
+        dst.comment = f"load-test {n}".encode()
+    return out.getvalue()
+
+async def probe(client, path, headers, stop, latencias, interval):
+    while not stop.is_set():
+        inicio = time.perf_counter()
+        r = await client.get(path, headers=headers)
+        r.raise_for_status()
+        latencias.append((time.perf_counter() - inicio) * 1000)
+        await asyncio.sleep(interval)
+
+async def heavy(client, n, args, headers, data, stop, conteo):
+    i = 0
+    while not stop.is_set():
+        i += 1
+        if data is not None:
+            archivo = excel_variant(data, n * 100000 + i)
+            r = await client.post("/excel/preview", headers=headers,
+                                  files={"file": ("carga.xlsx", archivo, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")})
+            r.raise_for_status()
+            conteo["preview"] += 1
+        r = await client.post("/auth/verify-password", headers=headers, json={"password": args.password})
+        if r.status_code == 429:
+            conteo["limitadas"] += 1
+            continue
+        r.raise_for_status()
+        conteo["bcrypt"] += 1
+
+async def phase(client, args, headers, data, with_load):
+    stop = asyncio.Event()
+    latencias = []
+    conteo = {"preview": 0, "bcrypt": 0, "limitadas": 0}
+    tareas = [asyncio.create_task(probe(client, args.probe_path, headers, stop, latencias, args.interval))
+              for _ in range(args.probes)]
+    if with_load:
+        tareas += [asyncio.create_task(heavy(client, n, args, headers, data, stop, conteo)) for n in range(args.workers)]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*tareas)
+    return latencias, conteo
+
+def report(nombre, latencias, conteo=None):
+    extra = f"  previews={conteo['preview']} bcrypt={conteo['bcrypt']} (429: {conteo['limitadas']})" if conteo else ""
+    print(f"{nombre:<10} n={len(latencias):<5} p50={percentile(latencias, 50):7.1f}ms "
+          f"p95={percentile(latencias, 95):7.1f}ms p99={percentile(latencias, 99):7.1f}ms "
+          f"max={max(latencias, default=0):7.1f}ms media={statistics.fmean(latencias) if latencias else 0:6.1f}ms{extra}")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--file", help="Excel para /excel/preview (sin él solo se prueba bcrypt)")
+    parser.add_argument("--probe-path", default="/")
+    parser.add_argument("--probes", type=int, default=4, help="clientes que miden la latencia")
+    parser.add_argument("--workers", type=int, default=4, help="clientes que generan carga")
+    parser.add_argument("--duration", type=float, default=15.0, help="segundos por fase")
+    parser.add_argument("--interval", type=float, default=0.02, help="pausa entre sondeos")
+    args = parser.parse_args()
+
+    data = open(args.file, "rb").read() if args.file else None
+    async with httpx.AsyncClient(base_url=args.url, timeout=120) as client:
+        r = await client.post("/auth/login", data={"username": args.user, "password": args.password})
+        r.raise_for_status()
+        headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+        report("sin carga", *(await phase(client, args, headers, data, False))[:1])
+        latencias, conteo = await phase(client, args, headers, data, True)
+        report("con carga", latencias, conteo)
+
+        r = await client.get("/debug/executors", headers=headers)
+        if r.status_code == 200:
+            print("ejecutores:", r.json())
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,28 @@
+"""nino keyset index
+
+Revision ID: 0b9e5f3a7c14
+Revises: f4b81c6d2e90
+Create Date: 2026-10-17 20:41:55.208416
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0b9e5f3a7c14'
+down_revision: Union[str, Sequence[str], None] = 'f4b81c6d2e90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('idx_nino_user_nombres', 'ninos', ['user_id', 'nombres', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_nino_user_nombres', table_name='ninos')
@@ -0,0 +1,73 @@
+"""nino busqueda
+
+Revision ID: 3d6a1f8c0b52
+Revises: 0b9e5f3a7c14
+Create Date: 2026-10-17 21:14:37.902415
+
+"""
+import unicodedata
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3d6a1f8c0b52'
+down_revision: Union[str, Sequence[str], None] = '0b9e5f3a7c14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 5000
+
+
+def _normalizar(valor) -> str:
+    # Misma normalización que excel_service.normalize_text (mayúsculas y sin acentos)
+    if not valor:
+        return ""
+    texto = str(valor).strip().upper()
+    return "".join(c for c in unicodedata.normalize('NFD', texto) if unicodedata.category(c) != 'Mn')
+
+
+def _pg_trgm_disponible(bind) -> bool:
+    if bind.dialect.name != 'postgresql':
+        return False
+    return bind.execute(sa.text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).first() is not None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('ninos', sa.Column('busqueda', sa.String(), nullable=True))
+
+    # Llenado inicial por lotes de id (la normalización de acentos se hace en Python)
+    bind = op.get_bind()
+    ninos = sa.table('ninos',
+        sa.column('id', sa.Integer), sa.column('dni_nino', sa.String),
+        sa.column('nombres', sa.String), sa.column('nombre_madre', sa.String),
+        sa.column('busqueda', sa.String))
+    actualizar = ninos.update().where(ninos.c.id == sa.bindparam('b_id')).values(busqueda=sa.bindparam('b_busqueda'))
+    ultimo_id = 0
+    while True:
+        filas = bind.execute(
+            sa.select(ninos.c.id, ninos.c.dni_nino, ninos.c.nombres, ninos.c.nombre_madre)
+            .where(ninos.c.id > ultimo_id).order_by(ninos.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not filas:
+            break
+        bind.execute(actualizar, [
+            {'b_id': f.id, 'b_busqueda': '|'.join(_normalizar(v) for v in (f.dni_nino, f.nombres, f.nombre_madre))}
+            for f in filas
+        ])
+        ultimo_id = filas[-1].id
+
+    # Índice de trigramas para LIKE '%texto%' (solo PostgreSQL con pg_trgm; en SQLite el filtro recorre las filas)
+    if _pg_trgm_disponible(bind):
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.create_index('idx_nino_busqueda_trgm', 'ninos', ['busqueda'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'busqueda': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP INDEX IF EXISTS idx_nino_busqueda_trgm")
+    op.drop_column('ninos', 'busqueda')
@@ -0,0 +1,28 @@
+"""usuario data version
+
+Revision ID: 5a7f3c9e2d18
+Revises: 9c4e2b7d1a06
+Create Date: 2026-10-17 22:31:48.115920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a7f3c9e2d18'
+down_revision: Union[str, Sequence[str], None] = '9c4e2b7d1a06'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('usuario_config', sa.Column('data_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('usuario_config', 'data_version')
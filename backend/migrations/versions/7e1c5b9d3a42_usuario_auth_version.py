@@ -0,0 +1,28 @@
+"""usuario auth version
+
+Revision ID: 7e1c5b9d3a42
+Revises: d2f8a6c41e73
+Create Date: 2026-10-18 11:02:44.305918
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7e1c5b9d3a42'
+down_revision: Union[str, Sequence[str], None] = 'd2f8a6c41e73'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('usuario_config', sa.Column('auth_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('usuario_config', 'auth_version')
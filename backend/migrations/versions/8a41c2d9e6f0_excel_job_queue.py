@@ -0,0 +1,40 @@
+"""excel job queue
+
+Revision ID: 8a41c2d9e6f0
+Revises: 179119f23cd3
+Create Date: 2026-10-17 18:05:12.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8a41c2d9e6f0'
+down_revision: Union[str, Sequence[str], None] = '179119f23cd3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('cargas_excel', sa.Column('total_nuevos', sa.Integer(), nullable=True))
+    op.add_column('cargas_excel', sa.Column('eess_filter', sa.String(length=255), nullable=True))
+    op.add_column('cargas_excel', sa.Column('ruta_archivo', sa.String(length=500), nullable=True))
+    op.add_column('cargas_excel', sa.Column('intentos', sa.Integer(), nullable=True))
+    op.add_column('cargas_excel', sa.Column('iniciado_en', sa.DateTime(), nullable=True))
+    op.add_column('cargas_excel', sa.Column('finalizado_en', sa.DateTime(), nullable=True))
+    op.create_index('idx_carga_estado_creado', 'cargas_excel', ['estado', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_carga_estado_creado', table_name='cargas_excel')
+    op.drop_column('cargas_excel', 'finalizado_en')
+    op.drop_column('cargas_excel', 'iniciado_en')
+    op.drop_column('cargas_excel', 'intentos')
+    op.drop_column('cargas_excel', 'ruta_archivo')
+    op.drop_column('cargas_excel', 'eess_filter')
+    op.drop_column('cargas_excel', 'total_nuevos')
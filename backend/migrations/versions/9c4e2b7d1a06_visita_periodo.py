@@ -0,0 +1,37 @@
+"""visita periodo
+
+Revision ID: 9c4e2b7d1a06
+Revises: 3d6a1f8c0b52
+Create Date: 2026-10-17 21:58:12.406733
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c4e2b7d1a06'
+down_revision: Union[str, Sequence[str], None] = '3d6a1f8c0b52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('visitas', sa.Column('periodo', sa.Integer(), nullable=True))
+
+    # Llenado inicial: AAAAMM a partir de fecha_visita (extract es válido en PostgreSQL y SQLite)
+    visitas = sa.table('visitas', sa.column('fecha_visita', sa.Date), sa.column('periodo', sa.Integer))
+    anio = sa.cast(sa.extract('year', visitas.c.fecha_visita), sa.Integer)
+    mes = sa.cast(sa.extract('month', visitas.c.fecha_visita), sa.Integer)
+    op.execute(visitas.update().values(periodo=anio * 100 + mes))
+
+    op.create_index('idx_visita_user_periodo', 'visitas', ['user_id', 'periodo'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_visita_user_periodo', table_name='visitas')
+    op.drop_column('visitas', 'periodo')
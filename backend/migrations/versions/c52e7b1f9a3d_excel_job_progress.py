@@ -0,0 +1,34 @@
+"""excel job progress
+
+Revision ID: c52e7b1f9a3d
+Revises: 8a41c2d9e6f0
+Create Date: 2026-10-17 18:32:47.905114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c52e7b1f9a3d'
+down_revision: Union[str, Sequence[str], None] = '8a41c2d9e6f0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('cargas_excel', sa.Column('etapa', sa.String(length=30), nullable=True))
+    op.add_column('cargas_excel', sa.Column('progreso', sa.Integer(), nullable=True))
+    op.add_column('cargas_excel', sa.Column('filas_procesadas', sa.Integer(), nullable=True))
+    op.add_column('cargas_excel', sa.Column('progreso_en', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('cargas_excel', 'progreso_en')
+    op.drop_column('cargas_excel', 'filas_procesadas')
+    op.drop_column('cargas_excel', 'progreso')
+    op.drop_column('cargas_excel', 'etapa')
@@ -0,0 +1,28 @@
+"""carga tipo
+
+Revision ID: d2f8a6c41e73
+Revises: 5a7f3c9e2d18
+Create Date: 2026-10-18 10:12:05.481337
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2f8a6c41e73'
+down_revision: Union[str, Sequence[str], None] = '5a7f3c9e2d18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('cargas_excel', sa.Column('tipo', sa.String(length=20), server_default='excel', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('cargas_excel', 'tipo')
@@ -0,0 +1,70 @@
+"""resumen mensual
+
+Revision ID: e7d3a9b45c21
+Revises: c52e7b1f9a3d
+Create Date: 2026-10-17 19:20:41.517302
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7d3a9b45c21'
+down_revision: Union[str, Sequence[str], None] = 'c52e7b1f9a3d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    resumen = op.create_table('resumen_mensual',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('anio', sa.Integer(), nullable=False),
+    sa.Column('mes', sa.Integer(), nullable=False),
+    sa.Column('total_visitas', sa.Integer(), nullable=False),
+    sa.Column('total_ninos', sa.Integer(), nullable=False),
+    sa.Column('encontrados', sa.Integer(), nullable=False),
+    sa.Column('no_encontrados', sa.Integer(), nullable=False),
+    sa.Column('pendientes', sa.Integer(), nullable=False),
+    sa.Column('visitas_encontrado', sa.Integer(), nullable=False),
+    sa.Column('visitas_no_encontrado', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['usuario_config.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'anio', 'mes')
+    )
+
+    # Llenado inicial desde las visitas existentes
+    visitas = sa.table('visitas',
+        sa.column('id', sa.Integer), sa.column('nino_id', sa.Integer), sa.column('user_id', sa.Integer),
+        sa.column('estado', sa.String), sa.column('fecha_visita', sa.Date))
+    anio = sa.cast(sa.extract('year', visitas.c.fecha_visita), sa.Integer)
+    mes = sa.cast(sa.extract('month', visitas.c.fecha_visita), sa.Integer)
+
+    def ninos_con(estado):
+        return sa.func.count(sa.func.distinct(sa.case((visitas.c.estado == estado, visitas.c.nino_id), else_=None)))
+
+    def visitas_con(estado):
+        return sa.func.count(sa.case((visitas.c.estado == estado, 1)))
+
+    origen = sa.select(
+        visitas.c.user_id, anio, mes,
+        sa.func.count(visitas.c.id),
+        sa.func.count(sa.func.distinct(visitas.c.nino_id)),
+        ninos_con('encontrado'), ninos_con('no encontrado'), ninos_con('pendiente'),
+        visitas_con('encontrado'), visitas_con('no encontrado'),
+        sa.literal(datetime.now())
+    ).where(visitas.c.user_id.isnot(None)).group_by(visitas.c.user_id, anio, mes)
+
+    op.execute(resumen.insert().from_select([
+        'user_id', 'anio', 'mes', 'total_visitas', 'total_ninos', 'encontrados', 'no_encontrados',
+        'pendientes', 'visitas_encontrado', 'visitas_no_encontrado', 'updated_at'
+    ], origen))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('resumen_mensual')
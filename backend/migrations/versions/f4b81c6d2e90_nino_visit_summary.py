@@ -0,0 +1,45 @@
+"""nino visit summary
+
+Revision ID: f4b81c6d2e90
+Revises: e7d3a9b45c21
+Create Date: 2026-10-17 20:02:13.640871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f4b81c6d2e90'
+down_revision: Union[str, Sequence[str], None] = 'e7d3a9b45c21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('ninos', sa.Column('primera_visita', sa.Date(), nullable=True))
+    op.add_column('ninos', sa.Column('ultima_visita', sa.Date(), nullable=True))
+    op.add_column('ninos', sa.Column('ultimo_estado', sa.String(length=20), nullable=True))
+    op.add_column('ninos', sa.Column('visitas_count', sa.Integer(), server_default='0', nullable=True))
+    op.create_index('idx_nino_user_primera', 'ninos', ['user_id', 'primera_visita'], unique=False)
+
+    # Llenado inicial desde las visitas existentes (subconsultas correlacionadas, válidas en PostgreSQL y SQLite)
+    op.execute("""
+        UPDATE ninos SET
+            primera_visita = (SELECT min(v.fecha_visita) FROM visitas v WHERE v.nino_id = ninos.id),
+            ultima_visita = (SELECT max(v.fecha_visita) FROM visitas v WHERE v.nino_id = ninos.id),
+            ultimo_estado = (SELECT v.estado FROM visitas v WHERE v.nino_id = ninos.id ORDER BY v.id DESC LIMIT 1),
+            visitas_count = (SELECT count(*) FROM visitas v WHERE v.nino_id = ninos.id)
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_nino_user_primera', table_name='ninos')
+    op.drop_column('ninos', 'visitas_count')
+    op.drop_column('ninos', 'ultimo_estado')
+    op.drop_column('ninos', 'ultima_visita')
+    op.drop_column('ninos', 'primera_visita')
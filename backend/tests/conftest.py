@@ -0,0 +1,129 @@
+"""
+Base SQLite temporal para las pruebas (se recrea en cada prueba) y utilidades comunes.
+Las variables de entorno se fijan antes de importar la app: database.py las lee al importarse.
+"""
+import io
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import date
+
+_TMP = tempfile.mkdtemp(prefix="ninos_aly_tests_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP, 'test.db')}"
+os.environ["UPLOAD_SPOOL_DIR"] = os.path.join(_TMP, "uploads")
+os.environ["EXCEL_WORKERS"] = "0"
+os.environ["CPU_PROCESSES"] = "0"
+os.environ["ASYNC_DB"] = "false"
+os.environ["READ_CACHE_BACKEND"] = "memory"
+
+import openpyxl
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app.main import app
+from app.database import engine, SessionLocal
+from app.models import models
+from app.auth import create_access_token, get_password_hash, _principals
+from app.services import read_cache, resumen_service
+from app.services.parse_cache import parse_cache
+from app.routes import visitas as visitas_routes
+from app.utils.limiter import limiter
+
+PASSWORD = "secreto123"
+_PASSWORD_HASH = get_password_hash(PASSWORD)
+
+@pytest.fixture
+def db_schema():
+    """Tablas vacías y cachés en memoria limpias (data_version vuelve a empezar en cada prueba)"""
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    read_cache.backend = read_cache.MemoryBackend(read_cache.READ_CACHE_MAX_ENTRIES, read_cache.READ_CACHE_TTL_SECONDS)
+    _principals.clear()
+    visitas_routes._detail_totals.clear()
+    parse_cache.clear()
+    limiter.enabled = False
+    yield
+    engine.dispose()
+
+@pytest.fixture
+def db(db_schema):
+    session = SessionLocal()
+    yield session
+    session.close()
+
+@pytest.fixture
+def user(db):
+    usuario = models.Usuario(usuario="gestor1", password_hash=_PASSWORD_HASH, rol="gestor")
+    db.add(usuario)
+    db.commit()
+    return usuario
+
+@pytest.fixture
+def headers(user):
+    return {"Authorization": "Bearer " + create_access_token({"sub": user.usuario})}
+
+@pytest.fixture
+def client(db_schema):
+    # Sin "with": no arrancan los eventos de inicio (cola de cargas)
+    return TestClient(app)
+
+ESTADOS = ["encontrado", "no encontrado", "pendiente"]
+
+def seed_visits(db, user_id: int, ninos: int, anio: int = 2025, mes: int = 4, start: int = 0, eess: str = "LAS PALMAS"):
+    """
+    Crea `ninos` niños con una visita en el mes y otra en el mes anterior (la mitad), y deja
+    resumen_mensual y el resumen de cada niño como los dejaría una carga.
+    """
+    nuevos = [
+        models.Nino(
+            user_id=user_id, dni_nino=f"{40000000 + start + i}", nombres=f"NIÑO {start + i:05d}",
+            nombre_madre=f"MADRE {start + i}", establecimiento_asignado=eess, fecha_nacimiento=date(2022, 1, 1)
+        )
+        for i in range(ninos)
+    ]
+    db.add_all(nuevos)
+    db.flush()
+    previo = date(anio - 1, 12, 1) if mes == 1 else date(anio, mes - 1, 1)
+    for i, nino in enumerate(nuevos):
+        db.add(models.Visita(nino_id=nino.id, user_id=user_id, fecha_visita=date(anio, mes, 1),
+                             estado=ESTADOS[i % 3], establecimiento_atencion=eess, actor_social="ACTOR"))
+        if i % 2:
+            db.add(models.Visita(nino_id=nino.id, user_id=user_id, fecha_visita=previo, estado="encontrado"))
+    db.flush()
+    resumen_service.rebuild(db, user_id)
+    resumen_service.refresh_ninos(db, user_id)
+    read_cache.bump_version(db, user_id)
+    db.commit()
+    return nuevos
+
+def minsa_excel(filas: int) -> bytes:
+    """Excel del padrón MINSA con `filas` niños encontrados en P.S. LAS PALMAS"""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["PADRON NOMINAL"])
+    ws.append([])
+    ws.append(["N°", "DNI NIÑO", "NOMBRES DEL NIÑO", "FECHA DE NACIMIENTO", "DNI MADRE", "NOMBRE MADRE",
+               "CELULAR MADRE", "DIRECCIÓN", "EESS", "HISTORIA CLINICA", "ESTADO", "OBSERVACION",
+               "ACTOR SOCIAL", "RANGO DE EDAD", "NRO VISITA", "ESTABLECIMIENTO DE ATENCION"])
+    for i in range(filas):
+        ws.append([i + 1, str(50000000 + i), f"CARGA {i:03d}", "15/03/2022", None, f"MADRE {i}", None,
+                   f"CALLE {i}", "P.S. LAS PALMAS", None, "Encontrado", None, "ACTOR", "1 AÑO", 1,
+                   "P.S. LAS PALMAS"])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+@contextmanager
+def count_statements():
+    """Cuenta las sentencias SQL ejecutadas en el motor dentro del bloque"""
+    statements = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
@@ -0,0 +1,45 @@
+"""
+Con el usuario en la caché de auth.py una petición autenticada no consulta usuario_config; la
+edición de la cuenta publicada en el backend compartido lo descarta en los demás procesos.
+"""
+from app.auth import create_access_token
+from app.models import models
+from app.services import read_cache
+from conftest import count_statements, seed_visits
+
+def usuario_config_statements(statements):
+    return [s for s in statements if "usuario_config" in s]
+
+def test_warm_request_runs_no_usuario_config_statements(client, db, user, headers):
+    seed_visits(db, user.id, 5)
+    first = client.get("/visitas/resumen", headers=headers)
+    assert first.status_code == 200
+
+    with count_statements() as statements:
+        cached = client.get("/visitas/resumen", headers=headers)
+        not_modified = client.get("/visitas/resumen", headers={**headers, "If-None-Match": first.headers["ETag"]})
+    assert (cached.status_code, not_modified.status_code) == (200, 304)
+    assert cached.json() == first.json()
+    assert usuario_config_statements(statements) == []
+
+def test_published_auth_version_invalidates_cached_user(client, db, user, headers):
+    assert client.get("/ninos/stats", headers=headers).status_code == 200
+
+    # Otro proceso desactiva la cuenta: solo cambia la base y publica el nuevo auth_version
+    user.is_active = 0
+    user.auth_version += 1
+    db.commit()
+    read_cache.publish_auth_version(user.usuario, user.auth_version)
+
+    response = client.get("/ninos/stats", headers=headers)
+    assert response.status_code == 403
+
+def test_deleted_user_is_rejected(client, db, user, headers):
+    admin = models.Usuario(usuario="admin1", password_hash=user.password_hash, rol="admin")
+    db.add(admin)
+    db.commit()
+    admin_headers = {"Authorization": "Bearer " + create_access_token({"sub": admin.usuario})}
+    assert client.get("/ninos/stats", headers=headers).status_code == 200
+
+    assert client.delete(f"/auth/users/{user.id}", headers=admin_headers).status_code == 200
+    assert client.get("/ninos/stats", headers=headers).status_code == 401
@@ -0,0 +1,49 @@
+"""
+Consultas de /visitas/detalle: número fijo de sentencias por página, con los contadores
+calculados (caché vacía) o tomados de la caché, y en las páginas siguientes por cursor.
+"""
+from conftest import count_statements, seed_visits
+
+URL = "/visitas/detalle/2025/4"
+
+def detalle(client, headers, **params):
+    with count_statements() as statements:
+        response = client.get(URL, headers=headers, params={"limit": 20, **params})
+    assert response.status_code == 200, response.text
+    return len(statements), response.json()
+
+def test_detalle_statement_count(client, db, user, headers):
+    seed_visits(db, user.id, 50)
+    # La primera petición además carga al usuario en la caché de auth.py
+    client.get("/visitas/resumen", headers=headers)
+
+    # Contadores + página + visitas de la página (usuario y versión salen de la caché)
+    queries, first = detalle(client, headers)
+    assert queries == 3
+    assert first["total"] == 50 and first["has_more"]
+    assert first["encontrados"] + first["no_encontrados"] + first["pendientes"] == 50
+
+    # Misma combinación de filtros: los contadores salen de la caché
+    queries, cached = detalle(client, headers)
+    assert queries == 2
+    assert cached == first
+
+    # Páginas siguientes por keyset con los mismos contadores en caché
+    ids = {c["id"] for c in first["children"]}
+    cursor = first["next_cursor"]
+    while cursor:
+        queries, page = detalle(client, headers, cursor=cursor)
+        assert queries == 2
+        assert page["total"] == 50
+        ids |= {c["id"] for c in page["children"]}
+        cursor = page["next_cursor"]
+    assert len(ids) == 50
+
+def test_detalle_totals_follow_writes(client, db, user, headers):
+    seed_visits(db, user.id, 10)
+    queries, before = detalle(client, headers)
+    seed_visits(db, user.id, 5, start=10)
+    # La carga sube data_version: se relee la versión y los contadores se recalculan
+    queries, after = detalle(client, headers)
+    assert queries == 4
+    assert (before["total"], after["total"]) == (10, 15)
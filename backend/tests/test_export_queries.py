@@ -0,0 +1,38 @@
+"""
+La exportación del reporte mensual hace las mismas pocas consultas con cualquier volumen:
+una fila por niño agregada en SQL, sin consultas por niño ni por lote.
+"""
+import io
+
+import openpyxl
+
+from app.services import export_service
+from conftest import count_statements, seed_visits
+
+def export(client, headers):
+    with count_statements() as statements:
+        response = client.get("/excel/export/2025/4", headers=headers)
+    assert response.status_code == 200, response.text
+    sheet = openpyxl.load_workbook(io.BytesIO(response.content), read_only=True).active
+    return len(statements), sheet.max_row - 1
+
+def test_export_statement_count_does_not_grow(client, db, user, headers, monkeypatch):
+    # Lotes pequeños: leer varios lotes tampoco debe añadir consultas
+    monkeypatch.setattr(export_service, "EXPORT_BATCH_SIZE", 25)
+    N = 30
+    seed_visits(db, user.id, N)
+    # La primera petición además carga al usuario en la caché de auth.py
+    client.get("/visitas/resumen", headers=headers)
+    queries_n, rows_n = export(client, headers)
+
+    seed_visits(db, user.id, 9 * N, start=N)
+    queries_10n, rows_10n = export(client, headers)
+
+    assert (rows_n, rows_10n) == (N, 10 * N)
+    # Solo la consulta del reporte (el usuario sale de la caché de auth.py)
+    assert queries_n == queries_10n == 1
+
+def test_export_without_rows_is_404(client, db, user, headers):
+    seed_visits(db, user.id, 5)
+    response = client.get("/excel/export/2024/1", headers=headers)
+    assert response.status_code == 404
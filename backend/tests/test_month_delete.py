@@ -0,0 +1,57 @@
+"""
+Borrar el reporte de un mes mientras una carga de Excel de ese mes sigue en la cola se
+rechaza con 409: la carga, su archivo y las visitas del mes quedan intactos.
+"""
+import os
+
+import pytest
+
+from app.models import models
+from app.services import job_queue
+from conftest import PASSWORD, seed_visits
+
+def pending_upload(db, user_id, anio, mes):
+    ruta = job_queue.new_spool_path("padron.xlsx")
+    with open(ruta, "wb") as f:
+        f.write(b"xlsx")
+    return job_queue.enqueue_upload(db, ruta, "padron.xlsx", mes, anio, user_id)
+
+def delete_month(client, headers, **params):
+    return client.request("DELETE", "/visitas/2025/4", json={"password": PASSWORD}, headers=headers, params=params)
+
+def visitas_del_mes(db, user_id):
+    db.expire_all()
+    return db.query(models.Visita).filter_by(user_id=user_id, periodo=202504).count()
+
+@pytest.mark.parametrize("estado", [job_queue.PENDIENTE, job_queue.PROCESANDO])
+@pytest.mark.parametrize("segundo_plano", [False, True])
+def test_delete_month_with_active_upload_is_rejected(estado, segundo_plano, client, db, user, headers):
+    seed_visits(db, user.id, 6)
+    carga = pending_upload(db, user.id, 2025, 4)
+    carga.estado = estado
+    db.commit()
+
+    response = delete_month(client, headers, segundo_plano=segundo_plano)
+    assert response.status_code == 409, response.text
+
+    db.expire_all()
+    assert db.get(models.CargaExcel, carga.id).estado == estado
+    assert os.path.exists(carga.ruta_archivo)
+    assert visitas_del_mes(db, user.id) == 6
+
+def test_delete_month_after_upload_finished(client, db, user, headers):
+    seed_visits(db, user.id, 6)
+    carga = pending_upload(db, user.id, 2025, 4)
+    carga.estado = job_queue.COMPLETADO
+    # Una carga en cola de otro mes no impide el borrado
+    otra = pending_upload(db, user.id, 2025, 5)
+    db.commit()
+    carga_id, otra_id = carga.id, otra.id
+
+    response = delete_month(client, headers)
+    assert response.status_code == 200, response.text
+
+    db.expire_all()
+    assert db.get(models.CargaExcel, carga_id) is None
+    assert db.get(models.CargaExcel, otra_id).estado == job_queue.PENDIENTE
+    assert visitas_del_mes(db, user.id) == 0
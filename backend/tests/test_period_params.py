@@ -0,0 +1,34 @@
+"""
+Un mes o año fuera de rango en las rutas por periodo es un error de validación (422), no un
+500 de date(anio, mes, 1).
+"""
+import pytest
+
+from conftest import PASSWORD, seed_visits
+
+@pytest.mark.parametrize("url", [
+    "/visitas/detalle/2025/13?solo_nuevos=true",
+    "/visitas/detalle/2025/0",
+    "/visitas/eess/2025/13",
+    "/excel/export/2025/13?solo_nuevos=true",
+    "/visitas/detalle/10000/12",
+])
+def test_get_out_of_range_month_is_422(url, client, db, user, headers):
+    seed_visits(db, user.id, 3)
+    assert client.get(url, headers=headers).status_code == 422
+
+def test_delete_out_of_range_month_is_422(client, db, user, headers):
+    seed_visits(db, user.id, 3)
+    response = client.request("DELETE", "/visitas/2025/13", json={"password": PASSWORD}, headers=headers)
+    assert response.status_code == 422
+
+def test_upload_out_of_range_month_is_422(client, user, headers):
+    files = {"file": ("padron.xlsx", b"xlsx")}
+    response = client.post("/excel/upload", files=files, data={"mes": "13", "anio": "2025"}, headers=headers)
+    assert response.status_code == 422
+
+def test_valid_month_without_data(client, db, user, headers):
+    seed_visits(db, user.id, 3)
+    response = client.get("/visitas/detalle/2025/12?solo_nuevos=true", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["total"] == 0
@@ -0,0 +1,55 @@
+"""
+Las consultas por mes sobre visitas deben buscar en el índice idx_visita_user_periodo y no
+recorrer la tabla. Se capturan las sentencias reales de cada operación y se pasan por
+EXPLAIN QUERY PLAN de SQLite.
+"""
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from app.database import engine
+from app.routes import visitas as visitas_routes
+from app.services import export_service, purge_service, resumen_service
+from conftest import seed_visits
+
+@contextmanager
+def capture_statements():
+    """Sentencias sobre visitas que filtran o agrupan por periodo, con sus parámetros"""
+    captured = []
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        if "visitas" in statement and "periodo" in statement and not statement.lstrip().upper().startswith("INSERT INTO VISITAS"):
+            captured.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", _capture)
+    try:
+        yield captured
+    finally:
+        event.remove(engine, "before_cursor_execute", _capture)
+
+def query_plan(statement, parameters):
+    with engine.connect() as conn:
+        return [row[3] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+
+OPERATIONS = {
+    "eess": lambda db, uid: visitas_routes._monthly_eess(db, uid, 2025, 4),
+    "export": lambda db, uid: export_service.build_report_query(db, 2025, 4, uid).all(),
+    "refresh_month": lambda db, uid: resumen_service.refresh_month(db, uid, 2025, 4),
+    "rebuild": lambda db, uid: resumen_service.rebuild(db, uid),
+    "delete_month": lambda db, uid: purge_service.delete_month(db, uid, 2025, 4),
+}
+
+@pytest.mark.parametrize("name", list(OPERATIONS))
+def test_period_queries_search_periodo_index(name, db, user):
+    seed_visits(db, user.id, 40)
+    with capture_statements() as captured:
+        OPERATIONS[name](db, user.id)
+    db.rollback()
+
+    assert captured, f"{name}: no se ejecutó ninguna consulta por periodo"
+    for statement, parameters in captured:
+        plan = query_plan(statement, parameters)
+        detalle = "\n".join(plan)
+        assert any(p.startswith("SEARCH visitas USING") and "idx_visita_user_periodo" in p for p in plan), detalle
+        assert not any(p.startswith("SCAN visitas") for p in plan), detalle
@@ -0,0 +1,52 @@
+"""
+Directorio de cargas en cola: privado del usuario de la aplicación, y el trabajador solo lee el
+Excel original (un archivo plantado junto a él nunca se deserializa).
+"""
+import os
+import pickle
+import stat
+
+import pytest
+
+from app.services import job_queue
+from conftest import minsa_excel
+
+def test_spool_dir_is_private(tmp_path, monkeypatch):
+    spool = tmp_path / "spool"
+    spool.mkdir(mode=0o777)
+    os.chmod(spool, 0o777)
+    monkeypatch.setattr(job_queue, "UPLOAD_SPOOL_DIR", str(spool))
+
+    ruta = job_queue.new_spool_path("padron.xlsx")
+    assert os.path.dirname(ruta) == str(spool)
+    assert stat.S_IMODE(os.stat(spool).st_mode) == 0o700
+
+@pytest.mark.skipif(not hasattr(os, "getuid"), reason="propietario de archivos POSIX")
+def test_spool_dir_owned_by_other_user_is_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "UPLOAD_SPOOL_DIR", str(tmp_path))
+    monkeypatch.setattr(os, "getuid", lambda: os.stat(tmp_path).st_uid + 1)
+    with pytest.raises(RuntimeError):
+        job_queue.new_spool_path("padron.xlsx")
+
+class _Planted:
+    def __reduce__(self):
+        return (os.mkdir, (self.marker,))
+
+def test_worker_never_unpickles_from_spool(db, user, tmp_path):
+    ruta = job_queue.new_spool_path("padron.xlsx")
+    with open(ruta, "wb") as f:
+        f.write(minsa_excel(3))
+    planted = _Planted()
+    planted.marker = str(tmp_path / "ejecutado")
+    for sufijo in (".parsed.pkl", ".pkl"):
+        with open(ruta + sufijo, "wb") as f:
+            pickle.dump(planted, f)
+
+    carga = job_queue.enqueue_upload(db, ruta, "padron.xlsx", 6, 2025, user.id)
+    assert job_queue.run_pending_jobs() == 1
+
+    db.refresh(carga)
+    assert carga.estado == job_queue.COMPLETADO, carga.mensaje_error
+    assert carga.total_registros == 3
+    assert not os.path.exists(planted.marker)
+    assert not os.path.exists(ruta)
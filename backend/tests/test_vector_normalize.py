@@ -0,0 +1,118 @@
+"""
+Las versiones por columna de la limpieza del Excel deben dar, celda por celda, lo mismo que las
+funciones escalares (y que el antiguo cálculo fila a fila de fecha de nacimiento y nro de visitas).
+Se comparan sobre columnas aleatorias con semilla fija y tipos mezclados como los que entrega pandas.
+"""
+import datetime
+import math
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.excel_service import (
+    build_visit_plan, clean_document_series, clean_document_value, clean_minsa_chunk, normalize_eess_name,
+    normalize_eess_series, normalize_status, normalize_status_series, normalize_text, normalize_text_series,
+    parse_birth_dates
+)
+
+pytestmark = pytest.mark.filterwarnings("ignore::UserWarning")
+
+SEEDS = range(40)
+
+MIXED_VALUES = [
+    None, float("nan"), 0, 7, -3, 1234567, 12345678, 123456789012, 0.0, 1.5, 12345678.0, 1234567.0,
+    45.00, 1e20, True, False, "", "   ", "0", "00123", "123.00", "12345678.0", "1.50", "ab-12",
+    "José", "ÑANDÚ", "  maría  ", "x" * 30, "p.s. san juan", "PUESTO DE SALUD - LAS PALMAS",
+    "Centro de Salud. Aguas", "CS. Aguas", "PS Vista Alegre", "C.S./Norte", "no encontrado",
+    "Encontrados", "NO_ENCONTRADO", "pendiente", "NO", "encontrado ", "nan", "None",
+    datetime.datetime(2020, 1, 5), pd.Timestamp("2021-07-30"),
+]
+
+def random_column(rng: random.Random, size: int) -> pd.Series:
+    """Columna object mezclada o, a veces, de un solo dtype (float con NaN, int, texto)"""
+    kind = rng.random()
+    if kind < 0.15:
+        return pd.Series([rng.choice([float("nan"), 0.0, 12345678.0, 1.25, 7.0]) for _ in range(size)], dtype=float)
+    if kind < 0.25:
+        return pd.Series([rng.choice([0, 5, 1234567, 12345678]) for _ in range(size)], dtype="int64")
+    values = [rng.choice(MIXED_VALUES) for _ in range(size)]
+    return pd.Series(np.asarray(values + [None], dtype=object)[:-1], dtype=object)
+
+def assert_same(series, expected):
+    got = series.tolist()
+    assert len(got) == len(expected)
+    for i, (g, e) in enumerate(zip(got, expected)):
+        assert g == e or (g is None and e is None), f"fila {i}: {g!r} != {e!r}"
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("series_fn, scalar_fn", [
+    (clean_document_series, clean_document_value),
+    (normalize_text_series, normalize_text),
+    (normalize_eess_series, normalize_eess_name),
+    (normalize_status_series, normalize_status),
+])
+def test_series_match_scalar(seed, series_fn, scalar_fn):
+    rng = random.Random(seed)
+    column = random_column(rng, rng.randint(1, 80))
+    assert_same(series_fn(column), [scalar_fn(v) for v in column.tolist()])
+
+def test_series_keep_index():
+    column = pd.Series(["CS. A", None, "ps b"], index=[10, 20, 30], dtype=object)
+    assert list(normalize_eess_series(column).index) == [10, 20, 30]
+    assert normalize_text_series(pd.Series([], dtype=object)).empty
+
+DATE_VALUES = [
+    None, float("nan"), 43000, 43000.5, 1, 0, 2958465, 10 ** 12, "05/03/2020", "2020-03-05",
+    "31/12/2019", "13/13/2020", "abc", "", datetime.datetime(2019, 2, 1), pd.Timestamp("2018-06-15"),
+]
+
+def scalar_birth_date(value):
+    """Conversión fila a fila previa a la vectorización"""
+    if not pd.notna(value):
+        return pd.NaT
+    try:
+        if isinstance(value, (int, float)):
+            return pd.to_datetime(value, origin='1899-12-30', unit='D')
+        return pd.to_datetime(str(value), dayfirst=True, errors='coerce')
+    except Exception:
+        return pd.NaT
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_parse_birth_dates_matches_scalar(seed):
+    rng = random.Random(seed)
+    values = [rng.choice(DATE_VALUES) for _ in range(rng.randint(1, 60))]
+    column = pd.Series(np.asarray(values + [None], dtype=object)[:-1], dtype=object)
+    got = parse_birth_dates(column).tolist()
+    for i, (value, g) in enumerate(zip(values, got)):
+        e = scalar_birth_date(value)
+        assert (pd.isna(g) and pd.isna(e)) or g == e, f"fila {i} ({value!r}): {g!r} != {e!r}"
+
+VISIT_VALUES = [None, float("nan"), 0, 1, 2, 3, 11, 2.7, -4, "3", "x", "", "inf", 1e20, 10.0]
+
+def scalar_nro_visitas(group: pd.DataFrame) -> int:
+    """Número de visitas por niño como lo calculaba el bucle por grupo"""
+    nro = len(group)
+    try:
+        nro = max(nro, int(pd.to_numeric(group['nro_visitas'], errors='coerce').max() or 1))
+    except Exception:
+        pass
+    return 1 if nro > 10 else nro
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_nro_visitas_matches_scalar(seed):
+    rng = random.Random(seed)
+    size = rng.randint(1, 80)
+    raw = pd.DataFrame({
+        'dni_nino': [rng.choice(["12345678", "1234567", 87654321.0, "ab-1", "00000009"]) for _ in range(size)],
+        'nro_visitas': pd.Series([rng.choice(VISIT_VALUES) for _ in range(size)], dtype=object),
+        'nombres': "NIÑO",
+        'fecha_nacimiento': None,
+    })
+    df = clean_minsa_chunk(raw)
+    plan = build_visit_plan(df)
+    expected = {dni: scalar_nro_visitas(group) for dni, group in df.groupby('dni_final')}
+    got = dict(zip(plan['dni_nino'], plan['nro_visitas']))
+    assert got == expected
+    assert all(isinstance(v, (int, np.integer)) and not math.isnan(v) for v in got.values())
@@ -0,0 +1,43 @@
+"""
+data_version se lee una vez por petición aunque la pidan sesiones distintas (la de get_db y la
+AsyncSession de get_read_db con ASYNC_DB): el memo vive en la petición, no en la sesión.
+"""
+import contextvars
+
+from app.database import SessionLocal
+from app.services import read_cache
+from conftest import count_statements
+
+def in_request(fn):
+    """Ejecuta `fn` en un contexto nuevo, como el middleware de main.py en cada petición"""
+    def run():
+        read_cache.start_request()
+        return fn()
+    return contextvars.copy_context().run(run)
+
+def test_version_is_read_once_per_request_across_sessions(db, user):
+    read_cache.backend = read_cache.NullBackend()
+    user_id = user.id
+    otra = SessionLocal()
+    try:
+        def two_sessions():
+            return read_cache.data_version(db, user_id), read_cache.data_version(otra, user_id)
+
+        with count_statements() as statements:
+            assert in_request(two_sessions) == (0, 0)
+            # La petición siguiente vuelve a leerla
+            assert in_request(two_sessions) == (0, 0)
+        assert len(statements) == 2
+    finally:
+        otra.close()
+
+def test_bump_clears_request_memo(db, user):
+    read_cache.backend = read_cache.NullBackend()
+
+    def write_then_read():
+        antes = read_cache.data_version(db, user.id)
+        read_cache.bump_version(db, user.id)
+        db.commit()
+        return antes, read_cache.data_version(db, user.id)
+
+    assert in_request(write_then_read) == (0, 1)
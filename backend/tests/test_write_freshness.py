@@ -0,0 +1,101 @@
+"""
+Cada ruta que escribe datos del usuario sube Usuario.data_version, y la siguiente lectura
+cacheada (read_cache, contadores del detalle y ETag) devuelve los datos nuevos: el ETag que
+tenía el cliente ya no coincide y la respuesta es 200, no 304.
+"""
+from datetime import date
+
+import pytest
+
+from app.models import models
+from app.services import job_queue
+from conftest import PASSWORD, minsa_excel, seed_visits
+
+def data_version(db, user_id):
+    db.expire_all()
+    return db.get(models.Usuario, user_id).data_version
+
+def read(client, headers, url, etag=None):
+    extra = {"If-None-Match": etag} if etag else {}
+    return client.get(url, headers={**headers, **extra})
+
+def resumen_mes(body, anio, mes):
+    return next((m for m in body if (m["anio"], m["mes"]) == (anio, mes)), None)
+
+# Cada caso: (escritura, URL de lectura cacheada, comprobación de la lectura antes y después)
+
+def crear_visita(client, headers, db, user_id, ninos):
+    body = {"nino_id": ninos[0].id, "fecha_visita": "2025-05-10", "estado": "encontrado"}
+    return client.post("/visitas/", json=body, headers=headers)
+
+def editar_visita(client, headers, db, user_id, ninos):
+    visita = db.query(models.Visita).filter_by(nino_id=ninos[2].id, fecha_visita=date(2025, 4, 1)).one()
+    body = {"nino_id": ninos[2].id, "fecha_visita": "2025-04-01", "estado": "encontrado"}
+    return client.put(f"/visitas/{visita.id}", json=body, headers=headers)
+
+def borrar_visita(client, headers, db, user_id, ninos):
+    visita = db.query(models.Visita).filter_by(nino_id=ninos[0].id, fecha_visita=date(2025, 4, 1)).one()
+    return client.delete(f"/visitas/{visita.id}", headers=headers)
+
+def crear_nino(client, headers, db, user_id, ninos):
+    return client.post("/ninos/", json={"dni_nino": "77777777", "nombres": "NIÑO NUEVO"}, headers=headers)
+
+def editar_nino(client, headers, db, user_id, ninos):
+    body = {"dni_nino": ninos[0].dni_nino, "nombres": "NOMBRE CORREGIDO"}
+    return client.put(f"/ninos/{ninos[0].id}", json=body, headers=headers)
+
+def borrar_nino(client, headers, db, user_id, ninos):
+    return client.delete(f"/ninos/{ninos[0].id}", headers=headers)
+
+def cargar_excel(client, headers, db, user_id, ninos):
+    files = {"file": ("padron.xlsx", minsa_excel(4))}
+    response = client.post("/excel/upload", files=files, data={"mes": "6", "anio": "2025"}, headers=headers)
+    assert response.status_code == 200, response.text
+    # EXCEL_WORKERS=0: la carga se procesa como tarea de fondo de la respuesta
+    job_queue.run_pending_jobs()
+    estado = client.get(f"/excel/jobs/{response.json()['job_id']}", headers=headers).json()
+    assert estado["estado"] == "completado", estado
+    return response
+
+def borrar_mes(client, headers, db, user_id, ninos):
+    return client.request("DELETE", "/visitas/2025/4", json={"password": PASSWORD}, headers=headers)
+
+CASES = {
+    "visita_crear": (crear_visita, "/visitas/resumen",
+                     lambda antes, despues: resumen_mes(antes, 2025, 5) is None and resumen_mes(despues, 2025, 5)["total"] == 1),
+    "visita_editar": (editar_visita, "/visitas/detalle/2025/4",
+                      lambda antes, despues: despues["encontrados"] == antes["encontrados"] + 1),
+    "visita_borrar": (borrar_visita, "/visitas/resumen",
+                      lambda antes, despues: resumen_mes(despues, 2025, 4)["total"] == resumen_mes(antes, 2025, 4)["total"] - 1),
+    "nino_crear": (crear_nino, "/ninos/stats",
+                   lambda antes, despues: despues["global"]["total_ninos"] == antes["global"]["total_ninos"] + 1),
+    "nino_editar": (editar_nino, "/ninos/",
+                    lambda antes, despues: "NOMBRE CORREGIDO" in {n["nombres"] for n in despues} - {n["nombres"] for n in antes}),
+    "nino_borrar": (borrar_nino, "/ninos/stats",
+                    lambda antes, despues: despues["global"]["total_ninos"] == antes["global"]["total_ninos"] - 1),
+    "carga_excel": (cargar_excel, "/visitas/resumen",
+                    lambda antes, despues: resumen_mes(antes, 2025, 6) is None and resumen_mes(despues, 2025, 6)["total"] == 4),
+    "mes_borrar": (borrar_mes, "/visitas/resumen",
+                   lambda antes, despues: resumen_mes(antes, 2025, 4) and resumen_mes(despues, 2025, 4) is None),
+}
+
+@pytest.mark.parametrize("name", list(CASES))
+def test_write_invalidates_cached_reads(name, client, db, user, headers):
+    write, url, changed = CASES[name]
+    ninos = seed_visits(db, user.id, 6)
+
+    first = read(client, headers, url)
+    assert first.status_code == 200, first.text
+    etag = first.headers["ETag"]
+    # Sin escrituras: la lectura se revalida con 304
+    assert read(client, headers, url, etag).status_code == 304
+
+    before = data_version(db, user.id)
+    response = write(client, headers, db, user.id, ninos)
+    assert response.status_code == 200, response.text
+    assert data_version(db, user.id) > before
+
+    fresh = read(client, headers, url, etag)
+    assert fresh.status_code == 200, fresh.text
+    assert fresh.headers["ETag"] != etag
+    assert changed(first.json(), fresh.json())
@@ -32,4 +32,88 @@ apiClient.interceptors.response.use(
     }
 )
 
+/**
+ * Abre un stream de Server-Sent Events del backend con el token de la sesión.
+ * Se usa fetch (y no EventSource) porque EventSource no permite enviar el header Authorization.
+ * `onClose` se llama si el servidor cierra el stream. Devuelve un AbortController para cerrarlo.
+ */
+export const streamEvents = (path, onEvent, { onError, onClose } = {}) => {
+    const controller = new AbortController()
+    const token = sessionStorage.getItem('token')
+
+    const run = async () => {
+        const response = await fetch(`${apiClient.defaults.baseURL}${path}`, {
+            headers: token ? { Authorization: `Bearer ${token}` } : {},
+            credentials: 'include',
+            signal: controller.signal
+        })
+        if (!response.ok || !response.body) {
+            throw new Error(`Stream ${path}: HTTP ${response.status}`)
+        }
+
+        const reader = response.body.getReader()
+        const decoder = new TextDecoder()
+        let buffer = ''
+        while (true) {
+            const { value, done } = await reader.read()
+            if (done) break
+            buffer += decoder.decode(value, { stream: true })
+
+            // Los eventos vienen separados por una línea en blanco
+            let sep
+            while ((sep = buffer.indexOf('\n\n')) !== -1) {
+                const frame = buffer.slice(0, sep)
+                buffer = buffer.slice(sep + 2)
+                let event = 'message'
+                let data = ''
+                for (const line of frame.split('\n')) {
+                    if (line.startsWith('event:')) event = line.slice(6).trim()
+                    else if (line.startsWith('data:')) data += line.slice(5).trim()
+                }
+                if (data) onEvent(event, JSON.parse(data))
+            }
+        }
+    }
+
+    run().then(() => {
+        if (onClose) onClose()
+    }).catch((err) => {
+        if (err.name !== 'AbortError' && onError) onError(err)
+    })
+    return controller
+}
+
+/**
+ * Lee una respuesta NDJSON (un objeto JSON por línea) del backend con el token de la sesión.
+ * `onItems` recibe cada bloque de objetos apenas llega, sin esperar al final de la respuesta.
+ * Devuelve una promesa que se resuelve cuando el servidor termina de enviar.
+ */
+export const streamNdjson = async (path, onItems) => {
+    const token = sessionStorage.getItem('token')
+    const response = await fetch(`${apiClient.defaults.baseURL}${path}`, {
+        headers: token ? { Authorization: `Bearer ${token}` } : {},
+        credentials: 'include'
+    })
+    if (!response.ok || !response.body) {
+        throw new Error(`Stream ${path}: HTTP ${response.status}`)
+    }
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    while (true) {
+        const { value, done } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+
+        // La última línea puede estar incompleta: se queda en el buffer
+        const lines = buffer.split('\n')
+        buffer = lines.pop()
+        const items = lines.filter(line => line.trim()).map(line => JSON.parse(line))
+        if (items.length) onItems(items)
+    }
+    buffer += decoder.decode()
+    if (buffer.trim()) onItems([JSON.parse(buffer)])
+}
+
 export default apiClient